@@ -0,0 +1,157 @@
+"""Per-function call statistics for the aggregation mode of Annalist.
+
+In aggregation mode, calls are counted instead of logged one by one, and
+a summary record per function is logged periodically and at exit. The
+durations of the calls are kept in a histogram with logarithmic buckets,
+which bounds the memory per function and the relative error of the
+percentiles (to about 6%).
+"""
+
+import threading
+
+# Fields of the summary records, besides the usual function fields.
+SUMMARY_FIELDS = (
+    "call_count",
+    "error_count",
+    "duration_total_ns",
+    "duration_p50_ns",
+    "duration_p95_ns",
+    "duration_p99_ns",
+)
+
+# Each power of two is split into this many buckets.
+_SUB_BUCKETS = 8
+_SUB_BITS = 3
+
+
+def _bucket(value):
+    """Index of the histogram bucket of a non-negative integer."""
+    if value < _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - _SUB_BITS - 1
+    return _SUB_BUCKETS * (shift + 1) + (value >> shift) - _SUB_BUCKETS
+
+
+def _bucket_midpoint(index):
+    """Representative value of the values in a bucket."""
+    if index < _SUB_BUCKETS:
+        return index
+    shift, offset = divmod(index - _SUB_BUCKETS, _SUB_BUCKETS)
+    low = (_SUB_BUCKETS + offset) << shift
+    return low + (1 << shift) // 2
+
+
+class CallStatistics:
+    """Counters and a duration histogram of the calls of one function."""
+
+    __slots__ = ("calls", "errors", "histogram", "total_ns")
+
+    def __init__(self):
+        """Construct empty CallStatistics."""
+        self.calls = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.histogram: dict[int, int] = {}
+
+    def add(self, duration_ns, error=False):
+        """Count a call, and its duration if it was measured."""
+        self.calls += 1
+        if error:
+            self.errors += 1
+        if duration_ns is not None:
+            self.total_ns += duration_ns
+            index = _bucket(duration_ns)
+            self.histogram[index] = self.histogram.get(index, 0) + 1
+
+    def merge(self, other):
+        """Add the calls counted by other CallStatistics."""
+        self.calls += other.calls
+        self.errors += other.errors
+        self.total_ns += other.total_ns
+        for index, count in other.histogram.items():
+            self.histogram[index] = self.histogram.get(index, 0) + count
+
+    def percentile(self, q):
+        """Estimate a percentile (0-100) of the durations, in nanoseconds.
+
+        Returns None if no duration was measured.
+        """
+        measured = sum(self.histogram.values())
+        if not measured:
+            return None
+        rank = q / 100 * measured
+        seen = 0
+        for index in sorted(self.histogram):
+            seen += self.histogram[index]
+            if seen >= rank:
+                return _bucket_midpoint(index)
+        return _bucket_midpoint(max(self.histogram))
+
+    def summary(self):
+        """Return the summary fields of the statistics."""
+        return {
+            "call_count": self.calls,
+            "error_count": self.errors,
+            "duration_total_ns": self.total_ns,
+            "duration_p50_ns": self.percentile(50),
+            "duration_p95_ns": self.percentile(95),
+            "duration_p99_ns": self.percentile(99),
+        }
+
+
+class Aggregator:
+    """Collect call statistics per function, and log them periodically.
+
+    Parameters
+    ----------
+    log_summary : callable
+        Called with a function and the ``CallStatistics`` of its calls, for
+        every function that was called since the previous flush.
+    flush_interval : float, optional
+        Seconds between summaries. A background thread takes care of this.
+        None disables periodic summaries, leaving only those of ``flush``
+        (which Annalist calls at exit).
+    """
+
+    def __init__(self, log_summary, flush_interval: float | None = 60.0):
+        """Construct an Aggregator."""
+        self.log_summary = log_summary
+        self.flush_interval = flush_interval
+        self._stats: dict = {}
+        self._lock = threading.Lock()
+
+        self._closing = threading.Event()
+        if flush_interval is not None:
+            threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+    def add(self, func, duration_ns, error=False):
+        """Count a call of ``func``."""
+        with self._lock:
+            stats = self._stats.get(func)
+            if stats is None:
+                stats = self._stats[func] = CallStatistics()
+            stats.add(duration_ns, error)
+
+    def merge(self, func, stats):
+        """Add the calls of ``func`` counted by other ``CallStatistics``."""
+        with self._lock:
+            own = self._stats.get(func)
+            if own is None:
+                own = self._stats[func] = CallStatistics()
+            own.merge(stats)
+
+    def flush(self):
+        """Log the summaries of the calls since the previous flush."""
+        with self._lock:
+            stats, self._stats = self._stats, {}
+        for func, func_stats in stats.items():
+            self.log_summary(func, func_stats)
+
+    def close(self):
+        """Log the last summaries and stop the background thread."""
+        self._closing.set()
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._closing.wait(self.flush_interval):
+            self.flush()
@@ -1,9 +1,37 @@
 """Main module."""
 
+import asyncio
+import atexit
+import contextvars
+import functools
 import inspect
 import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
 import re
+import threading
+import time
+import weakref
+from collections.abc import Mapping
+from contextlib import contextmanager
+from logging.handlers import QueueListener
 from os import PathLike
+from types import MappingProxyType
+
+from annalist.aggregation import SUMMARY_FIELDS, Aggregator
+from annalist.binary import BinaryFileHandler
+from annalist.fingerprint import Fingerprinter
+from annalist.formatters import RAW_FIELDS, JSONLinesFormatter
+from annalist.handlers import (
+    BatchingQueueHandler,
+    BlockingQueueHandler,
+    BufferedFileHandler,
+    RotatingCompressedFileHandler,
+)
+from annalist.sampling import SamplingPolicy
+from annalist.serializer import BoundedSerializer
 
 LOGGER_LEVELS = {
     "DEBUG": logging.DEBUG,
@@ -18,13 +46,44 @@ LOGGER_LEVELS = {
     50: logging.CRITICAL,
 }
 
+# Attributes of every LogRecord, which don't need a default. The message
+# and asctime are added by the formatters.
+RECORD_ATTRIBUTES = frozenset(
+    vars(logging.LogRecord("", logging.INFO, "", 0, "", (), None))
+) | {"message", "asctime"}
+
+# Output formats supported for the log file.
+FILE_OUTPUTS = ("text", "jsonl", "binary")
+
+# Values of the ANNALIST_DISABLE environment variable that disable Annalist.
+DISABLE_VALUES = {"1", "true", "yes", "on"}
+
+# Fields that need the parameters of a call to be bound to their names.
+PARAMS_FIELDS = frozenset({"params", "raw_params", "params_hash"})
+
+# Fields added with ``Annalist.context``.
+_context_fields: contextvars.ContextVar[Mapping] = contextvars.ContextVar(
+    "annalist_context_fields", default=MappingProxyType({})
+)
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
 
 class AnnalistLogger(logging.Logger):
-    """Custom Logger class to add contextual information."""
+    """Custom Logger class to add contextual information.
+
+    Attributes
+    ----------
+    extra_attributes : list
+        The user-defined fields, without duplicates, in the order they were
+        added.
+    field_defaults : dict
+        The user-defined fields that aren't attributes of every LogRecord
+        anyway, mapped to None. Merged into every record, so that
+        formatters can print fields that a record doesn't supply.
+    """
 
     def __init__(self, name, extra_attributes):
         """Construct a AnnalistLogger.
@@ -32,26 +91,229 @@ class AnnalistLogger(logging.Logger):
         Extends the functionality of the Logger class to accept user-defined
         fields as attributes.
         """
+        self.extra_attributes = []
+        self.field_defaults = {}
         if extra_attributes:
-            self.extra_attributes = extra_attributes
-        else:
-            self.extra_attributes = []
+            self.add_attributes(extra_attributes)
         logging.Logger.__init__(self, name)
         logging.Logger.setLevel(self, logging.INFO)
         self.propagate = True
 
     def add_attributes(self, extra_attributes: list):
-        """Add user-defined fields as attributes."""
-        self.extra_attributes += extra_attributes
-
-    def makeRecord(self, *args, **kwargs):  # type: ignore
-        """Override Logger.makeRecord to accept user-defined fields."""
-        rv = super().makeRecord(*args, **kwargs)
-        for attr in self.extra_attributes:
-            rv.__dict__[attr] = rv.__dict__.get(attr, None)
+        """Add user-defined fields as attributes.
+
+        Fields that were added before are skipped, so that e.g. changing a
+        formatter repeatedly doesn't grow the work done per record.
+        """
+        for attr in extra_attributes:
+            if attr in self.extra_attributes:
+                continue
+            self.extra_attributes.append(attr)
+            if attr not in RECORD_ATTRIBUTES:
+                self.field_defaults[attr] = None
+
+    def makeRecord(  # type: ignore
+        self,
+        name,
+        level,
+        fn,
+        lno,
+        msg,
+        args,
+        exc_info,
+        func=None,
+        extra=None,
+        sinfo=None,
+    ):
+        """Override Logger.makeRecord to accept user-defined fields.
+
+        The defaults of the fields are merged into the record in one step,
+        and then the fields in ``extra``.
+        """
+        rv = logging.getLogRecordFactory()(
+            name, level, fn, lno, msg, args, exc_info, func, sinfo
+        )
+        fields = rv.__dict__
+        if extra is not None:
+            # The same check as Logger.makeRecord.
+            for key in extra:
+                if key in ("message", "asctime") or key in fields:
+                    raise KeyError(f"Attempt to overwrite {key!r} in LogRecord")
+        fields.update(self.field_defaults)
+        if extra is not None:
+            fields.update(extra)
         return rv
 
 
+class BindPlan:
+    """Precompiled mapping of call arguments onto parameter metadata.
+
+    Compiled once per signature, so that building the ``params`` field
+    only needs a single pass over the actual arguments of a call.
+
+    Parameters
+    ----------
+    signature : inspect.Signature
+        Signature of the function whose calls are bound.
+    skip : int, optional
+        Number of leading parameters that are not part of ``args``, such as
+        the ``self`` or ``cls`` of a method called through ``ClassLogger``.
+    """
+
+    def __init__(self, signature, skip=0):
+        """Compile the plan from a signature."""
+        self.positional = []
+        self.keyword = {}
+        self.var_positional = None
+        self.var_keyword = None
+
+        empty = inspect.Parameter.empty
+        for param in list(signature.parameters.values())[skip:]:
+            default = None if param.default is empty else param.default
+            annotation = None if param.annotation is empty else param.annotation
+            if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+                self.positional.append((param.name, default, annotation))
+            if param.kind in (param.POSITIONAL_OR_KEYWORD, param.KEYWORD_ONLY):
+                self.keyword[param.name] = (default, annotation, "keyword")
+            elif param.kind == param.VAR_POSITIONAL:
+                self.var_positional = (param.name, default, annotation)
+            elif param.kind == param.VAR_KEYWORD:
+                self.var_keyword = (default, annotation, "var_keyword")
+        self.n_positional = len(self.positional)
+
+    def bind(self, args, kwargs):
+        """Map the arguments of a call to their parameter metadata.
+
+        Parameters
+        ----------
+        args : tuple
+            Positional arguments of the call.
+        kwargs : dict
+            Keyword arguments of the call.
+
+        Returns
+        -------
+        dict
+            Parameter names mapped to a dict holding the ``default``,
+            ``annotation``, ``kind`` (how the argument was passed) and
+            ``value`` of each supplied argument.
+        """
+        params = {}
+        for (name, default, annotation), value in zip(self.positional, args):
+            params[name] = {
+                "default": default,
+                "annotation": annotation,
+                "kind": "positional",
+                "value": value,
+            }
+        if self.var_positional is not None and len(args) > self.n_positional:
+            name, default, annotation = self.var_positional
+            params[name] = {
+                "default": default,
+                "annotation": annotation,
+                "kind": "var_positional",
+                "value": args[self.n_positional :],
+            }
+        for name, value in kwargs.items():
+            spec = self.keyword.get(name, self.var_keyword)
+            if spec is not None:
+                params[name] = {
+                    "default": spec[0],
+                    "annotation": spec[1],
+                    "kind": spec[2],
+                    "value": value,
+                }
+        return params
+
+
+class FunctionMetadata:
+    """Introspected details of a decorated function.
+
+    Computed once when a function is decorated, so that ``log_call`` only has
+    to look these up instead of inspecting the function on every call.
+
+    Attributes
+    ----------
+    name : str
+        The ``__name__`` of the function.
+    doc : str
+        The cleaned docstring of the function.
+    ret_annotation : object
+        The return annotation of the function, or None if it has none.
+    signature : inspect.Signature
+        The signature of the function.
+    bind_plan : BindPlan
+        Plan used to build the ``params`` field from the call arguments.
+    instance_plan : annalist.decorators.InstancePlan or None
+        Plan used by ``ClassLogger`` to look up the custom fields of a
+        method call, compiled on the first call.
+    """
+
+    def __init__(self, func, bound=False):
+        """Inspect a function and store its metadata."""
+        # (global policy, copy of it for this function), see ``sample``.
+        self.global_sampling = None
+        self.instance_plan = None
+        self.signature = inspect.signature(func)
+        self.bind_plan = BindPlan(self.signature, skip=1 if bound else 0)
+        self.name = func.__name__
+        self.doc = clean_str(func.__doc__)
+        # For structured formatters, which don't need the cleaning.
+        self.raw_doc = func.__doc__
+        if self.signature.return_annotation == inspect._empty:
+            self.ret_annotation = None
+        else:
+            self.ret_annotation = self.signature.return_annotation
+
+
+# Keyed weakly so that the cache does not keep decorated functions alive.
+_function_metadata: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def register_function(func, bound=False):
+    """Inspect a function and (re)populate its metadata cache entry.
+
+    Called by the decorators at decoration time. Redecorating a function
+    replaces its cache entry, so changes made to the function in between
+    (e.g. to its docstring) are picked up.
+
+    Parameters
+    ----------
+    func : callable
+        The function being decorated.
+    bound : bool, optional
+        Whether the first parameter of ``func`` (e.g. ``self``) is supplied
+        implicitly rather than as part of the logged arguments.
+
+    Returns
+    -------
+    FunctionMetadata
+        The freshly computed metadata of ``func``.
+    """
+    metadata = FunctionMetadata(func, bound)
+    try:
+        _function_metadata[func] = metadata
+    except TypeError:
+        # Some callables (e.g. builtins) can't be weakly referenced.
+        pass
+    return metadata
+
+
+def get_function_metadata(func):
+    """Retrieve the cached metadata of a function.
+
+    Falls back to inspecting (and caching) the function if it was never
+    registered, e.g. when ``Annalist.log_call`` is called directly.
+    """
+    try:
+        metadata = _function_metadata.get(func)
+    except TypeError:
+        metadata = None
+    if metadata is None:
+        metadata = register_function(func)
+    return metadata
+
+
 class Singleton(type):
     """Singleton Metaclass.
 
@@ -92,6 +354,16 @@ class Annalist(metaclass=Singleton):
     file_formatter : str
         File formatting string to be parsed by `logging.Formatter`.
         See `logging.Formatter documentation`_ for more info.
+    serializer : BoundedSerializer
+        Serializer used to render the ``params`` and ``ret_val`` fields.
+        Replace it to change the limits on the size of logged values.
+    fingerprinter : Fingerprinter
+        Computes the ``params_hash`` and ``ret_val_hash`` fields, blake2b
+        fingerprints of the content of the parameters and return value.
+    enabled : bool
+        Process-wide switch for all Annalist logging. Starts out False if the
+        ``ANNALIST_DISABLE`` environment variable is set to e.g. "1" or
+        "true". Use ``disable`` and ``enable`` to change it.
     """
 
     _configured = False
@@ -105,6 +377,26 @@ class Annalist(metaclass=Singleton):
         """
         self.logger = AnnalistLogger("TempLogger", None)
         self.stream_handler = logging.StreamHandler()  # Log to console
+        self._required_fields = set()
+        self._time_duration = False
+        self._time_cpu = False
+        self.serializer = BoundedSerializer()
+        self.fingerprinter = Fingerprinter()
+        self.enabled = (
+            os.environ.get("ANNALIST_DISABLE", "").strip().lower() not in DISABLE_VALUES
+        )
+        self._queue = None
+        self._listener = None
+        self._pool_queue = None
+        self._pool_context = None
+        self._aggregator = None
+        self.file_handler = None
+        self._file_buffer = None
+        self._file_output = "text"
+        self._rotation = None
+        self.sampling = None
+        self._call_stats = None
+        atexit.register(self.shutdown)
 
     def configure(
         self,
@@ -114,8 +406,98 @@ class Annalist(metaclass=Singleton):
         stream_format_str: str | None = None,
         level_filter: str = "INFO",
         default_level: str = "INFO",
+        async_logging: bool = False,
+        queue_size: int = 10000,
+        file_buffer: dict | None = None,
+        file_output: str = "text",
+        rotation: dict | None = None,
+        sampling: SamplingPolicy | None = None,
+        aggregation: dict | None = None,
     ):
-        """Configure the Annalist."""
+        """Configure the Annalist.
+
+        Parameters
+        ----------
+        logfile : str or PathLike, optional
+            File to write the audit trail to. If omitted, Annalist only logs
+            to the console.
+        analyst_name : str, optional
+            Name of the analyst who is invoking the script.
+        file_format_str : str, optional
+            `printf-style` format string of the log file records.
+        stream_format_str : str, optional
+            `printf-style` format string of the console records.
+        level_filter : str, optional
+            Records below this level are not logged. Defaults to "INFO".
+        default_level : str, optional
+            Level of records from decorators that don't specify a level.
+            Defaults to "INFO".
+        async_logging : bool, optional
+            If True, records are put on a queue and written to the file and
+            console by a background thread, so that audited calls don't wait
+            on the write. Call ``flush`` or ``shutdown`` to wait for pending
+            records. Defaults to False.
+        queue_size : int, optional
+            Maximum number of pending records in async mode. Callers wait
+            when the queue is full. 0 means unbounded. Defaults to 10000.
+        file_buffer : dict, optional
+            If given, the log file is written in batches by a
+            ``BufferedFileHandler``, and this dict holds its keyword
+            arguments (``max_bytes``, ``max_records``, ``flush_interval`` and
+            ``fsync``). Pass an empty dict to use the defaults.
+        file_output : str, optional
+            Output format of the log file. "text" (default) formats records
+            with ``file_format_str``. "jsonl" writes every record as a line
+            of typed JSON with a ``JSONLinesFormatter``; ``file_format_str``
+            then only selects which fields are written. "binary" writes the
+            same fields in the compact format of ``annalist.binary``, which
+            stores repeated strings only once. ``file_buffer`` is ignored
+            for binary files, which are always written through a buffer.
+        rotation : dict, optional
+            If given, the log file is split into segments by a
+            ``RotatingCompressedFileHandler``, which compresses closed
+            segments in the background and never overwrites the log of an
+            earlier run. This dict holds its keyword arguments
+            (``max_bytes``, ``interval`` and ``compress``). Pass an empty
+            dict to use the defaults. Can't be combined with ``file_buffer``
+            or "binary" output.
+        sampling : SamplingPolicy, optional
+            Sampling policy of functions whose decorator doesn't set one.
+            Each function gets its own copy of the policy. See
+            ``annalist.sampling``.
+        aggregation : dict, optional
+            If given, calls are not logged one by one. Instead, Annalist
+            counts the calls and errors of every decorated function and
+            keeps a histogram of their durations, and logs a summary record
+            per function every ``flush_interval`` seconds, on ``flush`` and
+            at exit. This dict holds the keyword arguments of the
+            ``annalist.aggregation.Aggregator`` (``flush_interval``). Pass an
+            empty dict to use the defaults.
+        """
+        if file_output not in FILE_OUTPUTS:
+            raise ValueError(
+                f"Unknown file output {file_output!r}, expected one of "
+                f"{FILE_OUTPUTS}."
+            )
+        if rotation is not None and (
+            file_buffer is not None or file_output == "binary"
+        ):
+            raise ValueError(
+                "Log rotation can't be combined with file_buffer or binary output."
+            )
+
+        # Drain the queue of a previous async configuration.
+        self.shutdown()
+        if self.file_handler is not None:
+            self.file_handler.close()
+            self.file_handler = None
+        self._file_buffer = file_buffer
+        self._file_output = file_output
+        self._rotation = rotation
+        self.sampling = sampling
+        if aggregation is not None:
+            self._call_stats = Aggregator(self._log_summary, **aggregation)
+
         self._analyst_name = analyst_name
 
         extra_attributes = []
@@ -134,7 +516,22 @@ class Annalist(metaclass=Singleton):
             self.date_format,
         )
         # Set up formatters
-        if file_format_str:
+        if file_output in ("jsonl", "binary"):
+            if file_format_str:
+                json_fields = file_format_attrs
+            else:
+                json_fields = list(JSONLinesFormatter.DEFAULT_FIELDS)
+                if aggregation is not None:
+                    json_fields += SUMMARY_FIELDS
+                elif sampling is not None:
+                    json_fields.append("sample_rate")
+                json_fields += [
+                    attr for attr in extra_attributes if attr not in json_fields
+                ]
+            self.file_formatter = JSONLinesFormatter(
+                json_fields, self.date_format, self.serializer
+            )
+        elif file_format_str:
             self.file_formatter = logging.Formatter(file_format_str, self.date_format)
         else:
             self.file_formatter = default_formatter
@@ -149,7 +546,7 @@ class Annalist(metaclass=Singleton):
 
         # Set up handlers
         if self.logfile:
-            self.file_handler = logging.FileHandler(self.logfile, mode="w")
+            self.file_handler = self._make_file_handler(mode="w")
         self.stream_handler = logging.StreamHandler()  # Log to console
 
         default_attributes = [
@@ -162,11 +559,11 @@ class Annalist(metaclass=Singleton):
             "ret_val_type",
         ]
 
-        self.all_attributes = default_attributes + extra_attributes
-
         self._default_level = LOGGER_LEVELS[default_level]
 
-        self.logger = AnnalistLogger("auditor", self.all_attributes)
+        self.logger = AnnalistLogger("auditor", default_attributes + extra_attributes)
+        # Kept up to date by the logger as formatters change.
+        self.all_attributes = self.logger.extra_attributes
 
         if self.logfile:
             self.logger.addHandler(self.file_handler)
@@ -182,9 +579,308 @@ class Annalist(metaclass=Singleton):
 
         self.logger.setLevel(self._level_filter)
 
+        if async_logging:
+            self._start_listener(queue_size)
+
+        self._compile_required_fields()
+
         # Adding some more fields to the logger this way
         self._configured = True
 
+    def _start_listener(self, queue_size):
+        """Move the handlers of the logger behind a queue.
+
+        A ``QueueListener`` drains the queue on a background thread and
+        passes the records on to the original handlers.
+        """
+        handlers = list(self.logger.handlers)
+        for handler in handlers:
+            self.logger.removeHandler(handler)
+
+        self._queue = queue.Queue(queue_size)
+        self.queue_handler = BlockingQueueHandler(self._queue)
+        self.logger.addHandler(self.queue_handler)
+        self._listener = QueueListener(
+            self._queue, *handlers, respect_handler_level=True
+        )
+        self._listener.start()
+
+    def _add_handler(self, handler):
+        """Attach a handler to the logger, or to the queue in async mode."""
+        if self._listener is None:
+            self.logger.addHandler(handler)
+        else:
+            self._listener.handlers += (handler,)
+
+    def _remove_handler(self, handler):
+        """Detach a handler from the logger, or from the queue in async mode."""
+        if self._listener is None:
+            self.logger.removeHandler(handler)
+        else:
+            self._listener.handlers = tuple(
+                h for h in self._listener.handlers if h is not handler
+            )
+
+    def pool_kwargs(
+        self,
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        mp_context=None,
+    ):
+        """Set up the workers of a process pool to log through this process.
+
+        Starts an aggregator thread that receives the records of the
+        workers and passes them to the handlers of this Annalist, so that
+        only this process writes to the log file and console. The workers
+        are configured automatically when they start, and send their records
+        in batches.
+
+        Parameters
+        ----------
+        batch_size : int, optional
+            Number of records a worker collects before sending them.
+        flush_interval : float, optional
+            Seconds after which a worker sends a partial batch.
+        mp_context : multiprocessing context, optional
+            The context that the pool starts its workers with, if it is not
+            the default one. Must be passed to the pool as well.
+
+        Returns
+        -------
+        dict
+            The ``initializer`` and ``initargs`` keyword arguments for a
+            ``concurrent.futures.ProcessPoolExecutor`` or a
+            ``multiprocessing.Pool``.
+
+        Examples
+        --------
+        >>> with ProcessPoolExecutor(**ann.pool_kwargs()) as pool:
+        ...     results = list(pool.map(audited_function, items))
+        >>> ann.flush()
+        """
+        if not self._configured:
+            raise ValueError(
+                "Annalist not configured. Configure object after retrieval."
+            )
+        mp_context = mp_context or multiprocessing.get_context()
+        if self._aggregator is not None and self._pool_context is not mp_context:
+            self._stop_aggregator()
+        if self._aggregator is None:
+            self._pool_context = mp_context
+            self._pool_queue = mp_context.JoinableQueue()
+            self._aggregator = threading.Thread(
+                target=self._aggregate, args=(self._pool_queue,), daemon=True
+            )
+            self._aggregator.start()
+        config = {
+            "analyst_name": self._analyst_name,
+            "all_attributes": list(self.logger.extra_attributes),
+            "required_fields": set(self._required_fields),
+            "level_filter": self._level_filter,
+            "default_level": self._default_level,
+            "enabled": self.enabled,
+            "sampling": self.sampling,
+            "aggregation": (
+                None
+                if self._call_stats is None
+                else {"flush_interval": self._call_stats.flush_interval}
+            ),
+            "date_format": self.date_format,
+            "serializer_limits": (
+                self.serializer.max_chars,
+                self.serializer.max_depth,
+                self.serializer.max_elements,
+                self.serializer.fillvalue,
+            ),
+            "batch_size": batch_size,
+            "flush_interval": flush_interval,
+        }
+        return {
+            "initializer": _init_pool_worker,
+            "initargs": (self._pool_queue, config),
+        }
+
+    def _stop_aggregator(self):
+        """Pass on the pending records of pool workers and stop listening."""
+        if self._aggregator is None:
+            return
+        self._pool_queue.put(None)
+        self._aggregator.join()
+        self._aggregator = None
+        self._pool_queue = None
+        self._pool_context = None
+
+    def _aggregate(self, pool_queue):
+        """Pass batches of records from pool workers on to the handlers.
+
+        In aggregation mode, the workers send the statistics of their calls
+        instead, which are merged with those of this process.
+        """
+        while True:
+            batch = pool_queue.get()
+            try:
+                if batch is None:
+                    return
+                if isinstance(batch, tuple):
+                    call_stats = self._call_stats
+                    if call_stats is not None:
+                        call_stats.merge(*batch)
+                    continue
+                field_defaults = self.logger.field_defaults
+                for entry in batch:
+                    record = logging.makeLogRecord({**field_defaults, **entry})
+                    self.logger.handle(record)
+            except Exception:
+                logger.exception("Could not log records from a pool worker.")
+            finally:
+                pool_queue.task_done()
+
+    def _configure_pool_worker(self, pool_queue, config):
+        """Configure this Annalist inside a pool worker.
+
+        Replaces any handlers inherited from the parent process (without
+        closing them, which could write out their buffers a second time)
+        with a single handler that sends records to the aggregator. In
+        aggregation mode, the worker counts its calls with an ``Aggregator``
+        of its own, which sends the statistics to the aggregator instead of
+        logging summaries.
+        """
+        self._queue = None
+        self._listener = None
+        self._pool_queue = None
+        self._pool_context = None
+        self._aggregator = None
+        self.logfile = None
+        self.file_handler = None
+
+        self._analyst_name = config["analyst_name"]
+        self._level_filter = config["level_filter"]
+        self._default_level = config["default_level"]
+        self.enabled = config["enabled"]
+        self.sampling = config["sampling"]
+        # The Aggregator of a forked parent has no thread in the worker.
+        self._call_stats = None
+        if config["aggregation"] is not None:
+            self._call_stats = Aggregator(
+                functools.partial(_send_call_stats, pool_queue),
+                **config["aggregation"],
+            )
+        self.date_format = config["date_format"]
+        (
+            self.serializer.max_chars,
+            self.serializer.max_depth,
+            self.serializer.max_elements,
+            self.serializer.fillvalue,
+        ) = config["serializer_limits"]
+
+        self.logger = AnnalistLogger("auditor", config["all_attributes"])
+        self.all_attributes = self.logger.extra_attributes
+        self._set_required_fields(config["required_fields"])
+        self.logger.setLevel(self._level_filter)
+        self.logger.propagate = False
+        handler = BatchingQueueHandler(
+            pool_queue,
+            batch_size=config["batch_size"],
+            flush_interval=config["flush_interval"],
+            json_formatter=JSONLinesFormatter(serializer=self.serializer),
+        )
+        self.logger.addHandler(handler)
+        # Send the last batch when the worker exits. Finalizers run on exit
+        # for both forked and spawned workers, unlike atexit handlers. This
+        # one has to run before the queue closes its feeder thread, which
+        # happens at exit priority 10.
+        multiprocessing.util.Finalize(handler, handler.flush, exitpriority=20)
+        if self._call_stats is not None:
+            multiprocessing.util.Finalize(
+                self._call_stats, self._call_stats.close, exitpriority=20
+            )
+        self._configured = True
+
+    def flush(self):
+        """Wait until all pending records have been written.
+
+        Includes the records that pool workers have sent, but not the
+        records that they are still holding in a partial batch. In
+        aggregation mode, the summaries of the calls so far are logged
+        first, including the calls that pool workers have sent statistics
+        of.
+        """
+        if self._pool_queue is not None:
+            self._pool_queue.join()
+        if self._call_stats is not None:
+            self._call_stats.flush()
+        if self._listener is not None:
+            self._queue.join()
+            handlers = self._listener.handlers
+        else:
+            handlers = self.logger.handlers
+        for handler in handlers:
+            handler.flush()
+
+    def shutdown(self):
+        """Write out all pending records and stop the background writer.
+
+        Called automatically at exit. After shutdown the handlers are
+        reattached to the logger, so any later records are written
+        synchronously. In aggregation mode, the last summaries are logged,
+        and later calls are logged one by one again.
+        """
+        self._stop_aggregator()
+        if self._call_stats is not None:
+            self._call_stats.close()
+            self._call_stats = None
+        if self._listener is None:
+            return
+        self._listener.stop()
+        self.logger.removeHandler(self.queue_handler)
+        for handler in self._listener.handlers:
+            self.logger.addHandler(handler)
+        self._listener = None
+        self._queue = None
+
+    @contextmanager
+    def context(self, **fields):
+        """Add fields to the records logged within a block.
+
+        The fields are kept in a ``contextvars.ContextVar``, so they only
+        apply to the current thread or asyncio task, and no locking is
+        needed. Contexts can be nested; inner fields override outer ones.
+        The fields of a context override ``analyst_name`` and the defaults
+        of the audit fields, but not the ``extra_info`` of a decorator.
+
+        Parameters
+        ----------
+        **fields
+            Field names and values to add. Include a field in a format
+            string to print it.
+
+        Examples
+        --------
+        >>> with ann.context(site="Manawatu at Teachers College"):
+        ...     process_site()
+        """
+        token = _context_fields.set({**_context_fields.get(), **fields})
+        try:
+            yield
+        finally:
+            _context_fields.reset(token)
+
+    def disable(self):
+        """Switch off all Annalist logging for this process.
+
+        Functions and methods decorated while Annalist is disabled are left
+        untouched by the decorators, so they run with no overhead at all.
+        Functions decorated earlier skip logging after a single flag check.
+        """
+        self.enabled = False
+
+    def enable(self):
+        """Switch Annalist logging back on after ``disable``.
+
+        Functions decorated while Annalist was disabled stay undecorated.
+        """
+        self.enabled = True
+
     @property
     def analyst_name(self):
         """The analyst_name property."""
@@ -211,6 +907,14 @@ class Annalist(metaclass=Singleton):
             )
         self._analyst_name = value
 
+    @property
+    def required_fields(self):
+        """Fields printed by the active formatters.
+
+        Optional fields are only computed if they appear in this set.
+        """
+        return self._required_fields
+
     @property
     def level_filter(self):
         """The level_filter property."""
@@ -218,7 +922,7 @@ class Annalist(metaclass=Singleton):
 
     @level_filter.setter
     def level_filter(self, value):
-        self._level_filter = value
+        self._level_filter = LOGGER_LEVELS[value]
         self.logger.setLevel(self._level_filter)
 
     @property
@@ -229,7 +933,7 @@ class Annalist(metaclass=Singleton):
     @default_level.setter
     def default_level(self, value):
         """Set the default_level property."""
-        self._default_level = value
+        self._default_level = LOGGER_LEVELS[value]
 
     @staticmethod
     def parse_formatter(format_string):
@@ -254,92 +958,370 @@ class Annalist(metaclass=Singleton):
         """
         return re.findall(r"%\((.*?)\)", format_string)
 
-    def set_file_formatter(self, formatter, logfile: str | PathLike[str] | None = None):
-        """Change the file formatter of the logger."""
+    def _compile_required_fields(self):
+        """Collect the fields referenced by the active formatters.
+
+        ``log_call`` only computes the default fields that appear in this
+        set, so that e.g. a large return value is never stringified if no
+        formatter prints ``%(ret_val)s``. Needs to be recompiled whenever a
+        formatter changes.
+        """
+        formatters = [self.stream_formatter]
+        if self.logfile:
+            formatters.append(self.file_formatter)
+
+        required_fields = set()
+        for formatter in formatters:
+            # Structured formatters declare their fields, text formatters
+            # are parsed.
+            if hasattr(formatter, "required_fields"):
+                required_fields.update(formatter.required_fields)
+            else:
+                required_fields.update(self.parse_formatter(formatter._fmt))
+        self._set_required_fields(required_fields)
+
+    def _set_required_fields(self, required_fields):
+        self._required_fields = required_fields
+        # A new tuple whenever the formatters change, which invalidates the
+        # instance plans of ClassLogger.
+        self.instance_fields = tuple(dict.fromkeys(self.all_attributes))
+        # Aggregation needs the duration of every call.
+        self._time_duration = (
+            "duration_ns" in required_fields or self._call_stats is not None
+        )
+        self._time_cpu = "cpu_ns" in required_fields
+
+    def start_timer(self):
+        """Start measuring a call, for the timing fields that are printed.
+
+        ``duration_ns`` is the wall-clock time of the call, measured with
+        ``time.perf_counter_ns``. ``cpu_ns`` is the CPU time of the process
+        (of all its threads) during the call, measured with
+        ``time.process_time_ns``. The clocks are only read if a formatter
+        prints the field.
+
+        Returns
+        -------
+        tuple or None
+            The start times, to pass to ``stop_timer``, or None if no timing
+            field is printed.
+        """
+        if not (self._time_duration or self._time_cpu):
+            return None
+        return (
+            time.perf_counter_ns() if self._time_duration else None,
+            time.process_time_ns() if self._time_cpu else None,
+        )
+
+    def stop_timer(self, timer, extra_data=None):
+        """Finish measuring a call started with ``start_timer``.
+
+        Parameters
+        ----------
+        timer : tuple or None
+            The return value of ``start_timer``.
+        extra_data : dict, optional
+            Extra fields of the call.
+
+        Returns
+        -------
+        dict or None
+            A copy of ``extra_data`` with the timing fields added, or
+            ``extra_data`` itself if nothing was measured.
+        """
+        if timer is None:
+            return extra_data
+        cpu_end = time.process_time_ns() if timer[1] is not None else None
+        end = time.perf_counter_ns() if timer[0] is not None else None
+        fields = dict(extra_data) if extra_data else {}
+        if end is not None:
+            fields["duration_ns"] = end - timer[0]
+        if cpu_end is not None:
+            fields["cpu_ns"] = cpu_end - timer[1]
+        return fields
+
+    def count_error(self, func, timer):
+        """Count a call that raised an exception, in aggregation mode.
+
+        Failed calls are not logged otherwise, so this does nothing outside
+        aggregation mode.
+
+        Parameters
+        ----------
+        func : callable
+            The decorated function.
+        timer : tuple or None
+            The return value of ``start_timer`` for the call.
+        """
+        call_stats = self._call_stats
+        if call_stats is None or not self.enabled:
+            return
+        fields = self.stop_timer(timer)
+        call_stats.add(func, fields.get("duration_ns") if fields else None, True)
+
+    def _log_summary(self, func, stats):
+        """Log the summary record of the calls of a function."""
+        if isinstance(func, tuple):
+            # Calls of pool workers, see ``_send_call_stats``.
+            _, name, doc, raw_doc = func
+        else:
+            metadata = get_function_metadata(func)
+            name, doc, raw_doc = metadata.name, metadata.doc, metadata.raw_doc
+        fields = stats.summary()
+        report = {
+            "function_name": name,
+            "function_doc": doc,
+            "analyst_name": clean_str(self.analyst_name),
+            **fields,
+        }
+        if "raw_function_doc" in self._required_fields:
+            report["raw_function_doc"] = raw_doc
+        if "raw_analyst_name" in self._required_fields:
+            report["raw_analyst_name"] = self.analyst_name
+        self.logger.log(
+            self.default_level,
+            "SUMMARY of %d calls to %s, %d failed",
+            fields["call_count"],
+            name,
+            fields["error_count"],
+            extra=report,
+        )
+
+    def _make_file_handler(self, mode="a"):
+        """Create the handler that writes to the log file."""
+        if self._rotation is not None:
+            # Rotated logs are always appended to, see the handler.
+            return RotatingCompressedFileHandler(self.logfile, **self._rotation)
+        if self._file_output == "binary":
+            return BinaryFileHandler(self.logfile, mode=mode)
+        if self._file_buffer is None:
+            return logging.FileHandler(self.logfile, mode=mode)
+        return BufferedFileHandler(self.logfile, mode=mode, **self._file_buffer)
+
+    def set_file_formatter(
+        self,
+        formatter,
+        logfile: str | PathLike[str] | None = None,
+        file_buffer: dict | None = None,
+        file_output: str | None = None,
+    ):
+        """Change the file formatter of the logger.
+
+        Parameters
+        ----------
+        formatter : str
+            `printf-style` format string of the log file records. For
+            "jsonl" and "binary" output, only selects the fields to write.
+        logfile : str or PathLike, optional
+            File to write to. Required if no log file was configured yet.
+        file_buffer : dict, optional
+            Keyword arguments of a ``BufferedFileHandler`` to write the file
+            in batches. Defaults to the buffering set up in ``configure``.
+        file_output : str, optional
+            Format of the log file, one of "text", "jsonl" or "binary".
+            Defaults to the format set up in ``configure``.
+        """
+        if file_output is not None:
+            if file_output not in FILE_OUTPUTS:
+                raise ValueError(
+                    f"Unknown file output {file_output!r}, expected one of "
+                    f"{FILE_OUTPUTS}."
+                )
+            if self._rotation is not None and file_output == "binary":
+                raise ValueError("Log rotation can't be combined with binary output.")
+            self._file_output = file_output
+        if file_buffer is not None:
+            self._file_buffer = file_buffer
         if self.logfile is None:
             if logfile is None:
                 raise ValueError("Cannot set up file formatter, no log file specified.")
             else:
                 self.logfile = logfile
-            self.file_handler = logging.FileHandler(self.logfile)
+            self.file_handler = self._make_file_handler()
         else:
-            self.logger.removeHandler(self.file_handler)
-            self.file_handler = logging.FileHandler(self.logfile)
+            self._remove_handler(self.file_handler)
+            self.file_handler.close()
+            self.file_handler = self._make_file_handler()
 
         file_format_attrs = self.parse_formatter(formatter)
         self.logger.add_attributes(file_format_attrs)
-        self.file_formatter = logging.Formatter(formatter, self.date_format)
+        if self._file_output == "text":
+            self.file_formatter = logging.Formatter(formatter, self.date_format)
+        else:
+            # Structured outputs only take the fields from the format string.
+            self.file_formatter = JSONLinesFormatter(
+                file_format_attrs, self.date_format, self.serializer
+            )
         self.file_handler.setFormatter(self.file_formatter)
-        self.logger.addHandler(self.file_handler)
+        self._add_handler(self.file_handler)
+        self._compile_required_fields()
 
     def set_stream_formatter(self, formatter):
         """Change the stream formatter of the logger."""
         stream_format_attrs = self.parse_formatter(formatter)
         self.logger.add_attributes(stream_format_attrs)
-        self.logger.removeHandler(self.stream_handler)
+        self._remove_handler(self.stream_handler)
         self.stream_formatter = logging.Formatter(formatter, self.date_format)
         self.stream_handler = logging.StreamHandler()
         self.stream_handler.setFormatter(self.stream_formatter)
-        self.logger.addHandler(self.stream_handler)
+        self._add_handler(self.stream_handler)
+        self._compile_required_fields()
 
-    def log_call(self, message, level, func, ret_val, extra_data, *args, **kwargs):
-        """Log function call."""
+    def sample(self, func, sampling=None):
+        """Decide whether to log a call of a function.
+
+        Parameters
+        ----------
+        func : callable
+            The function that was called.
+        sampling : SamplingPolicy, optional
+            Sampling policy of the function's decorator. Defaults to the
+            policy set in ``configure``, of which every function gets its
+            own copy.
+
+        Returns
+        -------
+        float or None
+            None to skip the call, otherwise the sample rate of its record.
+            Every call is logged in aggregation mode, so that all of them
+            are counted.
+        """
+        if self._call_stats is not None:
+            return 1.0
+        if sampling is None:
+            if self.sampling is None:
+                return 1.0
+            metadata = get_function_metadata(func)
+            if (
+                metadata.global_sampling is None
+                or metadata.global_sampling[0] is not self.sampling
+            ):
+                metadata.global_sampling = (self.sampling, self.sampling.clone())
+            sampling = metadata.global_sampling[1]
+        return sampling.sample()
+
+    async def alog_call(
+        self, message, level, func, ret_val, extra_data, /, *args, **kwargs
+    ):
+        """Log a call from a coroutine, without blocking the event loop.
+
+        In async mode, ``log_call`` only puts the record on the queue, and is
+        called directly. Otherwise the record is built and written on a
+        worker thread with ``asyncio.to_thread``, which also carries over the
+        fields of ``context``. Takes the same arguments as ``log_call``.
+        """
+        if self._listener is not None:
+            self.log_call(message, level, func, ret_val, extra_data, *args, **kwargs)
+        else:
+            await asyncio.to_thread(
+                self.log_call,
+                message,
+                level,
+                func,
+                ret_val,
+                extra_data,
+                *args,
+                **kwargs,
+            )
+
+    def log_call(self, message, level, func, ret_val, extra_data, /, *args, **kwargs):
+        """Log function call.
+
+        The leading parameters are positional-only, so that the arguments of
+        the call can be named e.g. ``level`` or ``message``. The call is
+        sampled with the policy set in ``configure``, unless ``extra_data``
+        holds the ``sample_rate`` decided by the decorator.
+        """
         if not self._configured:
             raise ValueError(
                 "Annalist not configured. Configure object after retrieval."
             )
 
-        report = {}
-        signature = inspect.signature(func)
+        if not self.enabled:
+            return
 
-        report["function_name"] = func.__name__
-        report["function_doc"] = clean_str(func.__doc__)
-        if signature.return_annotation == inspect._empty:
-            report["ret_annotation"] = None
+        if level:
+            logger_level = LOGGER_LEVELS[level]
         else:
-            report["ret_annotation"] = signature.return_annotation
-
-        params = {}
-        all_args = list(args) + list(kwargs.values())
-        for i, ((name, param), arg) in enumerate(
-            zip(signature.parameters.items(), all_args)
-        ):
-            if param.default == inspect._empty:
-                default_val = None
-            else:
-                default_val = param.default
-
-            if param.annotation == inspect._empty:
-                annotation = None
-            else:
-                annotation = param.annotation
-
-            if i > len(args):
-                kind = "positional"
-                value = arg
-            else:
-                kind = "keyword"
-                value = arg
-            params[name] = {
-                "default": default_val,
-                "annotation": annotation,
-                "kind": kind,
-                "value": value,
-            }
-        report["params"] = clean_str(params)
+            logger_level = self.default_level
 
-        report["analyst_name"] = clean_str(self.analyst_name)
-        report["ret_val_type"] = type(ret_val)
-        report["ret_val"] = clean_str(ret_val)
+        # Don't build a record that the logger would throw away.
+        if not self.logger.isEnabledFor(logger_level):
+            return
+
+        # Aggregation replaces the records of the calls with summaries.
+        call_stats = self._call_stats
+        if call_stats is not None:
+            call_stats.add(func, extra_data.get("duration_ns") if extra_data else None)
+            return
+
+        # The decorators sample calls before they collect anything for
+        # them, and pass on the sample rate.
+        sample_rate = extra_data.get("sample_rate") if extra_data else None
+        if sample_rate is None:
+            sample_rate = self.sample(func)
+            if sample_rate is None:
+                return
+        metadata = get_function_metadata(func)
+
+        # Only the fields that a formatter actually prints are computed.
+        required = self._required_fields
+        report = {}
 
+        if "function_name" in required:
+            report["function_name"] = metadata.name
+        if "function_doc" in required:
+            report["function_doc"] = metadata.doc
+        if "raw_function_doc" in required:
+            report["raw_function_doc"] = metadata.raw_doc
+        if "ret_annotation" in required:
+            report["ret_annotation"] = metadata.ret_annotation
+        if not required.isdisjoint(PARAMS_FIELDS):
+            params = metadata.bind_plan.bind(args, kwargs)
+            if "params" in required:
+                report["params"] = clean_str(self.serializer.serialize(params))
+            if "raw_params" in required:
+                report["raw_params"] = params
+            if "params_hash" in required:
+                # Only the values count, not how they were passed.
+                report["params_hash"] = self.fingerprinter.fingerprint(
+                    {name: param["value"] for name, param in params.items()}
+                )
+        if "analyst_name" in required:
+            report["analyst_name"] = clean_str(self.analyst_name)
+        if "raw_analyst_name" in required:
+            report["raw_analyst_name"] = self.analyst_name
+        if "ret_val_type" in required:
+            report["ret_val_type"] = type(ret_val)
+        if "ret_val" in required:
+            report["ret_val"] = clean_str(self.serializer.serialize(ret_val))
+        if "ret_val_hash" in required:
+            report["ret_val_hash"] = self.fingerprinter.fingerprint(ret_val)
+        if "raw_ret_val" in required:
+            # Structured formatters encode the value themselves.
+            report["raw_ret_val"] = ret_val
+        if "sample_rate" in required:
+            report["sample_rate"] = sample_rate
+        if "raw_message" in required:
+            report["raw_message"] = str(message)
+
+        context = _context_fields.get()
+        if context:
+            report.update(context)
+            _override_raw_fields(report, context)
         if extra_data:
             for key, val in extra_data.items():
                 report[key] = val
-
-        if level:
-            logger_level = LOGGER_LEVELS[level]
-        else:
-            logger_level = self.default_level
+            _override_raw_fields(report, extra_data)
+        if self._listener is not None and isinstance(
+            self.file_formatter, JSONLinesFormatter
+        ):
+            # The listener formats the record later, by when the caller may
+            # have changed the raw values. Converted values are left as they
+            # are by the formatter.
+            for key in RAW_FIELDS.values():
+                if key in report:
+                    report[key] = self.file_formatter.to_json(report[key])
 
         self.logger.log(
             logger_level,
@@ -348,6 +1330,17 @@ class Annalist(metaclass=Singleton):
         )
 
 
+def _override_raw_fields(report, fields):
+    """Write the fields that override default fields as raw values too.
+
+    Unless the raw value is overridden itself, as the decorators do.
+    """
+    for key in fields:
+        raw_key = RAW_FIELDS.get(key)
+        if raw_key is not None and raw_key in report and raw_key not in fields:
+            report[raw_key] = fields[key]
+
+
 def clean_str(s):
     """Clean a string for nice clean logging."""
     process = {
@@ -359,3 +1352,25 @@ def clean_str(s):
     }
     s = str(s).translate(process)
     return s
+
+
+def _send_call_stats(pool_queue, func, stats):
+    """Send the call statistics of a pool worker to the parent process.
+
+    The decorated functions of the worker can't be pickled, so they are
+    identified by their qualified name instead, along with the fields of
+    their summary records.
+    """
+    metadata = get_function_metadata(func)
+    key = (
+        f"{func.__module__}.{func.__qualname__}",
+        metadata.name,
+        metadata.doc,
+        metadata.raw_doc,
+    )
+    pool_queue.put((key, stats))
+
+
+def _init_pool_worker(pool_queue, config):
+    """Configure Annalist in a new pool worker, see ``Annalist.pool_kwargs``."""
+    Annalist()._configure_pool_worker(pool_queue, config)
@@ -0,0 +1,325 @@
+"""Compact binary audit log format.
+
+A binary log file starts with ``MAGIC``, followed by a sequence of frames.
+Every frame is a ``struct``-packed header holding the frame type (one byte)
+and the payload length (four bytes, little-endian), followed by the
+payload:
+
+* ``STRING`` frames define the next entry of the string table. Strings
+  that are short enough are written once, and then referred to by their
+  index in the table.
+* ``SHAPE`` frames define the next entry of the shape table: the keys of
+  a dict, as references into the string table. Dicts with a known shape
+  (such as every record, and every entry of ``params``) are written as a
+  shape reference followed by their values only.
+* ``RECORD`` frames hold one audit record, encoded as a tagged value.
+* ``RESET`` frames clear the string and shape tables. They are written
+  when a handler appends to an existing file.
+
+Values are encoded as a one-byte tag, followed by the data of the value:
+``N``, ``T`` and ``F`` for None, True and False, ``i`` for a 64-bit int,
+``I`` for a larger int (as a string), ``f`` for a double, ``r`` and ``s``
+for a one- or four-byte reference into the string table, ``S`` for an
+inline string, ``l`` and ``d`` for a list or a dict, followed by their
+length and their items, and ``p`` and ``P`` for a one- or four-byte
+reference into the shape table, followed by the values of the dict.
+"""
+
+import logging
+import struct
+
+MAGIC = b"ANNALIST-BIN\x01\n"
+
+STRING = 1
+RECORD = 2
+RESET = 3
+SHAPE = 4
+
+_FRAME = struct.Struct("<BI")
+_UBYTE = struct.Struct("<B")
+_UINT = struct.Struct("<I")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+
+_INT_MIN = -(2**63)
+_INT_MAX = 2**63 - 1
+
+
+class BinaryFileHandler(logging.FileHandler):
+    """Write audit records in the compact binary format.
+
+    The fields of each record are collected by the formatter of the handler,
+    which must have a ``to_dict`` method, such as a ``JSONLinesFormatter``.
+    Repeated strings (function names, docstrings, analyst names, custom
+    fields, ...) are interned into a string table that is stored in the file
+    itself, so each of them is only written once.
+
+    Use ``read_binary_log`` to read the records back.
+
+    Parameters
+    ----------
+    filename : str or PathLike
+        The file to write to.
+    mode : str, optional
+        Mode in which the file is opened, "a" (default) or "w". The file is
+        always opened in binary mode.
+    max_intern_length : int, optional
+        Only strings up to this length are interned. Longer strings are
+        written inline, unless they are the value of one of
+        ``intern_fields``.
+    intern_fields : tuple of str, optional
+        Record fields whose values repeat from record to record, and are
+        interned whatever their length. Defaults to the docstring, function
+        name and analyst name.
+    max_interned : int, optional
+        Maximum size of the string and shape tables. Once a table is full,
+        new strings are written inline, and dicts of new shapes are written
+        with their keys.
+    """
+
+    def __init__(
+        self,
+        filename,
+        mode: str = "a",
+        max_intern_length: int = 256,
+        max_interned: int = 2**20,
+        intern_fields: tuple = ("function_doc", "function_name", "analyst_name"),
+    ):
+        """Construct a BinaryFileHandler."""
+        self.max_intern_length = max_intern_length
+        self.intern_fields = intern_fields
+        self.max_interned = max_interned
+        self._strings: dict[str, int] = {}
+        self._shapes: dict[tuple, int] = {}
+        super().__init__(filename, mode.replace("b", "") + "b")
+
+    def _open(self):
+        """Open the file and start fresh string and shape tables."""
+        stream = super()._open()
+        self._strings = {}
+        self._shapes = {}
+        if stream.tell() == 0:
+            stream.write(MAGIC)
+        else:
+            stream.write(_FRAME.pack(RESET, 0))
+        return stream
+
+    def emit(self, record):
+        """Encode a record and write it to the file."""
+        try:
+            entry = self.formatter.to_dict(record)
+            if self.stream is None:
+                self.stream = self._open()
+            frames = []
+            for field in self.intern_fields:
+                value = entry.get(field)
+                if type(value) is str:
+                    # Found in the string table when the record is encoded.
+                    self._intern(value, frames, force=True)
+            payload = bytearray()
+            self._encode(entry, payload, frames)
+            frames.append(_FRAME.pack(RECORD, len(payload)))
+            frames.append(payload)
+            self.stream.write(b"".join(frames))
+        except Exception:
+            self.handleError(record)
+
+    def _encode(self, value, out, frames):
+        """Append the encoding of a value to ``out``.
+
+        Frames defining newly interned strings are appended to ``frames``.
+        """
+        value_type = type(value)
+        if value_type is str:
+            ref = self._intern(value, frames)
+            if ref is None:
+                data = value.encode("utf-8")
+                out += b"S"
+                out += _UINT.pack(len(data))
+                out += data
+            elif ref < 256:
+                out += b"r"
+                out += _UBYTE.pack(ref)
+            else:
+                out += b"s"
+                out += _UINT.pack(ref)
+        elif value is None:
+            out += b"N"
+        elif value is True:
+            out += b"T"
+        elif value is False:
+            out += b"F"
+        elif value_type is int:
+            if _INT_MIN <= value <= _INT_MAX:
+                out += b"i"
+                out += _INT.pack(value)
+            else:
+                data = str(value).encode("ascii")
+                out += b"I"
+                out += _UINT.pack(len(data))
+                out += data
+        elif value_type is float:
+            out += b"f"
+            out += _FLOAT.pack(value)
+        elif value_type is list:
+            out += b"l"
+            out += _UINT.pack(len(value))
+            for item in value:
+                self._encode(item, out, frames)
+        elif value_type is dict:
+            shape = self._shape(value, frames)
+            if shape is None:
+                out += b"d"
+                out += _UINT.pack(len(value))
+                for key, item in value.items():
+                    self._encode(key, out, frames)
+                    self._encode(item, out, frames)
+            else:
+                if shape < 256:
+                    out += b"p"
+                    out += _UBYTE.pack(shape)
+                else:
+                    out += b"P"
+                    out += _UINT.pack(shape)
+                for item in value.values():
+                    self._encode(item, out, frames)
+        else:
+            raise TypeError(f"Cannot encode values of type {value_type}.")
+
+    def _intern(self, string, frames, force=False):
+        """Look up or define the string table reference of a string.
+
+        Returns None if the string can't be interned. Strings longer than
+        ``max_intern_length`` are interned too if ``force`` is true.
+        """
+        ref = self._strings.get(string)
+        if ref is None and (
+            (force or len(string) <= self.max_intern_length)
+            and len(self._strings) < self.max_interned
+        ):
+            ref = self._strings[string] = len(self._strings)
+            data = string.encode("utf-8")
+            frames.append(_FRAME.pack(STRING, len(data) + 4))
+            frames.append(_UINT.pack(ref))
+            frames.append(data)
+        return ref
+
+    def _shape(self, value, frames):
+        """Look up or define the shape table reference of a dict.
+
+        Returns None if the dict can't be written by shape.
+        """
+        keys = tuple(value)
+        shape = self._shapes.get(keys)
+        if shape is None and len(self._shapes) < self.max_interned:
+            refs = []
+            for key in keys:
+                ref = self._intern(key, frames) if type(key) is str else None
+                if ref is None:
+                    return None
+                refs.append(ref)
+            shape = self._shapes[keys] = len(self._shapes)
+            frames.append(_FRAME.pack(SHAPE, 4 * len(refs)))
+            frames.append(struct.pack(f"<{len(refs)}I", *refs))
+        return shape
+
+
+def read_binary_log(path):
+    """Stream the records of a binary log file.
+
+    Parameters
+    ----------
+    path : str or PathLike
+        The binary log file.
+
+    Yields
+    ------
+    dict
+        The fields of each record, in the order they were written.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a binary Annalist log.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a binary Annalist log.")
+        strings: list[str] = []
+        shapes: list[tuple] = []
+        while True:
+            header = f.read(_FRAME.size)
+            if len(header) < _FRAME.size:
+                # End of file, or a frame that was cut short mid-write.
+                return
+            frame_type, length = _FRAME.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            if frame_type == STRING:
+                strings.append(payload[4:].decode("utf-8"))
+            elif frame_type == SHAPE:
+                refs = struct.unpack(f"<{length // 4}I", payload)
+                shapes.append(tuple(strings[ref] for ref in refs))
+            elif frame_type == RECORD:
+                value, _ = _decode(memoryview(payload), 0, strings, shapes)
+                yield value
+            elif frame_type == RESET:
+                strings = []
+                shapes = []
+
+
+def _decode(data, pos, strings, shapes):
+    """Decode the value at ``pos``, returning it and the position after it."""
+    tag = data[pos]
+    pos += 1
+    if tag == 0x72:  # r
+        return strings[data[pos]], pos + 1
+    if tag == 0x73:  # s
+        return strings[_UINT.unpack_from(data, pos)[0]], pos + 4
+    if tag == 0x70 or tag == 0x50:  # p, P
+        if tag == 0x70:
+            keys = shapes[data[pos]]
+            pos += 1
+        else:
+            keys = shapes[_UINT.unpack_from(data, pos)[0]]
+            pos += 4
+        entries = {}
+        for key in keys:
+            entries[key], pos = _decode(data, pos, strings, shapes)
+        return entries, pos
+    if tag == 0x53:  # S
+        length = _UINT.unpack_from(data, pos)[0]
+        pos += 4
+        return str(data[pos : pos + length], "utf-8"), pos + length
+    if tag == 0x4E:  # N
+        return None, pos
+    if tag == 0x54:  # T
+        return True, pos
+    if tag == 0x46:  # F
+        return False, pos
+    if tag == 0x69:  # i
+        return _INT.unpack_from(data, pos)[0], pos + 8
+    if tag == 0x49:  # I
+        length = _UINT.unpack_from(data, pos)[0]
+        pos += 4
+        return int(str(data[pos : pos + length], "ascii")), pos + length
+    if tag == 0x66:  # f
+        return _FLOAT.unpack_from(data, pos)[0], pos + 8
+    if tag == 0x6C:  # l
+        count = _UINT.unpack_from(data, pos)[0]
+        pos += 4
+        items = []
+        for _ in range(count):
+            item, pos = _decode(data, pos, strings, shapes)
+            items.append(item)
+        return items, pos
+    if tag == 0x64:  # d
+        count = _UINT.unpack_from(data, pos)[0]
+        pos += 4
+        entries = {}
+        for _ in range(count):
+            key, pos = _decode(data, pos, strings, shapes)
+            entries[key], pos = _decode(data, pos, strings, shapes)
+        return entries, pos
+    raise ValueError(f"Unknown value tag {tag!r} in binary Annalist log.")
@@ -3,9 +3,22 @@
 import functools
 import inspect
 import logging
+import threading
+import time
+import tracemalloc
+import types
 from functools import partial
-
-from annalist.annalist import Annalist
+from typing import ClassVar
+
+from annalist.annalist import (
+    LOGGER_LEVELS,
+    Annalist,
+    clean_str,
+    get_function_metadata,
+    register_function,
+)
+from annalist.sampling import SamplingPolicy
+from annalist.serializer import BoundedSerializer
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
@@ -13,6 +26,8 @@ logger.addHandler(logging.StreamHandler())
 
 ann = Annalist()
 
+_trunc_serializer = BoundedSerializer()
+
 
 def function_logger(
     _func=None,
@@ -20,6 +35,9 @@ def function_logger(
     level: str | None = None,
     *,
     extra_info: dict | None = None,
+    sample_size: int = 0,
+    track_memory: bool = False,
+    sampling: SamplingPolicy | None = None,
 ):
     """Decorate a function to provide Annalist logging functionality.
 
@@ -66,6 +84,22 @@ def function_logger(
             },
         )(arg1, arg2, ...)
 
+    Coroutine functions (``async def``) are logged once they have been
+    awaited, with their actual return value. The record is written without
+    blocking the event loop, see ``Annalist.alog_call``.
+
+    Generator functions are logged once, when the generator is exhausted or
+    closed, without collecting the items it produces. Besides the usual
+    fields, the record has the fields ``item_count`` (the number of items
+    produced), ``duration_ns`` (nanoseconds from the first item being
+    requested until the end), ``exhausted`` (False if the generator was
+    closed early) and, if ``sample_size`` is set, ``item_sample`` (the
+    first items, serialized within the usual limits)::
+
+        @function_logger(sample_size=3)
+        def read_chunks(path):
+            ...
+
     Parameters
     ----------
     _func : int, optional
@@ -79,15 +113,130 @@ def function_logger(
     extra_info : dict, optional
         Extra info to be passed to the formatter. Keys in the dict should
         correspond to fields present in the formatter for them to show up.
+    sample_size : int, optional
+        For generator functions, the number of items to keep for the
+        ``item_sample`` field. Defaults to 0, no sample.
+    track_memory : bool, optional
+        If True, the memory allocated during each call is traced with
+        ``tracemalloc``, and logged in the fields ``memory_peak`` (the most
+        memory in use at any point of the call) and ``memory_delta`` (the
+        memory still in use after the call), both in bytes. This slows the
+        function down considerably, and is not supported for coroutine and
+        generator functions. Defaults to False.
+    sampling : SamplingPolicy, optional
+        Only log the calls picked by this policy, e.g. ``EveryN(100)``, for
+        functions that are called too often to log every call. Overrides
+        the global policy set in ``configure``. See ``annalist.sampling``.
 
     """
+    # Resolved once, so that disabled levels can be skipped cheaply per call.
+    log_level = LOGGER_LEVELS[level] if level else None
 
     def decorator_logger(func):
+        # When disabled, leave the function exactly as it is.
+        if not ann.enabled:
+            return func
+
+        register_function(func)
+
+        if track_memory and (
+            inspect.iscoroutinefunction(func) or inspect.isgeneratorfunction(func)
+        ):
+            raise ValueError(
+                "track_memory is not supported for coroutine and generator "
+                f"functions, such as {func.__qualname__}."
+            )
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not ann.enabled:
+                    return await func(*args, **kwargs)
+                timer = ann.start_timer()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception:
+                    ann.count_error(func, timer)
+                    raise
+                extra_data = ann.stop_timer(timer, extra_info)
+                sample_rate = _sample_call(func, sampling, log_level)
+                if sample_rate is not None:
+                    extra_data = {**(extra_data or {}), "sample_rate": sample_rate}
+                    await ann.alog_call(
+                        message, level, func, result, extra_data, *args, **kwargs
+                    )
+                return result
+
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                def log_summary(result, summary):
+                    if extra_info:
+                        summary = {**extra_info, **summary}
+                    summary["sample_rate"] = sample_rate
+                    ann.log_call(message, level, func, result, summary, *args, **kwargs)
+
+                sample_rate = _sample_call(func, sampling, log_level)
+                if sample_rate is None:
+                    return (yield from func(*args, **kwargs))
+                return (
+                    yield from _audit_generator(
+                        func(*args, **kwargs), sample_size, log_summary
+                    )
+                )
+
+            return generator_wrapper
+
+        if track_memory:
+
+            @functools.wraps(func)
+            def memory_wrapper(*args, **kwargs):
+                if not ann.enabled:
+                    return func(*args, **kwargs)
+                timer = ann.start_timer()
+                try:
+                    with MemoryTracker() as memory:
+                        result = func(*args, **kwargs)
+                except Exception:
+                    ann.count_error(func, timer)
+                    raise
+                extra_data = ann.stop_timer(timer, extra_info)
+                sample_rate = _sample_call(func, sampling, log_level)
+                if sample_rate is not None:
+                    extra_data = {
+                        **(extra_data or {}),
+                        **memory.fields,
+                        "sample_rate": sample_rate,
+                    }
+                    ann.log_call(
+                        message, level, func, result, extra_data, *args, **kwargs
+                    )
+                return result
+
+            return memory_wrapper
+
         # This line reminds func that it is func and not the decorator
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            result = func(*args, **kwargs)
-            ann.log_call(message, level, func, result, extra_info, *args, **kwargs)
+            # Disabled at runtime, see ``Annalist.disable``.
+            if not ann.enabled:
+                return func(*args, **kwargs)
+            timer = ann.start_timer()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                # Only counted in aggregation mode.
+                ann.count_error(func, timer)
+                raise
+            extra_data = ann.stop_timer(timer, extra_info)
+            sample_rate = _sample_call(func, sampling, log_level)
+            if sample_rate is not None:
+                extra_data = {**(extra_data or {}), "sample_rate": sample_rate}
+                ann.log_call(message, level, func, result, extra_data, *args, **kwargs)
             return result
 
         return wrapper
@@ -99,6 +248,137 @@ def function_logger(
         return decorator_logger(_func)
 
 
+def _sample_call(func, sampling, log_level=None):
+    """Decide whether to log a call, before anything is collected for it.
+
+    Returns the sample rate of the call, or None if its record would be
+    filtered out or it is sampled out.
+    """
+    if not (ann.enabled and ann.logger.isEnabledFor(log_level or ann.default_level)):
+        return None
+    return ann.sample(func, sampling)
+
+
+class MemoryTracker:
+    """Trace the memory allocated within a block with ``tracemalloc``.
+
+    Starts tracing if it isn't running yet, and stops it again once the
+    last block of any thread has ended. Trackers can be nested; the peak of
+    an inner block counts towards the peak of the blocks around it. As
+    tracemalloc traces the whole process, allocations of other threads are
+    included.
+
+    After the block, ``fields`` holds ``memory_peak``, the most memory in
+    use at any point of the block, and ``memory_delta``, the memory still
+    in use at the end of it, in bytes, relative to the start of the block.
+    """
+
+    # Guards tracemalloc and the class attributes below.
+    _lock: ClassVar[threading.Lock] = threading.Lock()
+    # Trackers that are currently in a block, innermost last, per thread.
+    _active: ClassVar[dict[int, list["MemoryTracker"]]] = {}
+    # Number of blocks in progress, and whether tracing was started by them.
+    _users: ClassVar[int] = 0
+    _started: ClassVar[bool] = False
+
+    def __init__(self):
+        """Construct a MemoryTracker."""
+        self.fields = {}
+        self._start = 0
+        self._peak = 0
+
+    def __enter__(self):
+        """Start tracing."""
+        cls = type(self)
+        with cls._lock:
+            if not cls._users and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                cls._started = True
+            cls._users += 1
+            current, peak = tracemalloc.get_traced_memory()
+            for stack in cls._active.values():
+                # Resetting the peak below would lose the peaks of the
+                # blocks in progress, in this thread and the others.
+                outer = stack[-1]
+                outer._peak = max(outer._peak, peak)
+            tracemalloc.reset_peak()
+            self._start = self._peak = current
+            cls._active.setdefault(threading.get_ident(), []).append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop tracing and fill in ``fields``."""
+        cls = type(self)
+        with cls._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            thread_id = threading.get_ident()
+            stack = cls._active[thread_id]
+            stack.remove(self)
+            peak = max(peak, self._peak)
+            if stack:
+                outer = stack[-1]
+                outer._peak = max(outer._peak, peak)
+            else:
+                del cls._active[thread_id]
+            cls._users -= 1
+            if not cls._users and cls._started:
+                tracemalloc.stop()
+                cls._started = False
+        self.fields = {
+            "memory_peak": peak - self._start,
+            "memory_delta": current - self._start,
+        }
+
+
+def _audit_generator(gen, sample_size, log_summary):
+    """Pass the items of a generator through, and summarize them at the end.
+
+    Supports ``send`` and ``throw``. Once ``gen`` is exhausted or closed,
+    calls ``log_summary`` with its return value and a dict of the summary
+    fields. Nothing is logged if ``gen`` raises.
+    """
+    count = 0
+    sample = []
+    exhausted = False
+    result = None
+    start = time.perf_counter_ns()
+    try:
+        item = next(gen)
+        while True:
+            count += 1
+            if count <= sample_size:
+                sample.append(item)
+            try:
+                sent = yield item
+            except GeneratorExit:
+                raise
+            except BaseException as exc:  # noqa: BLE001
+                # Forwarded to the generator, which may handle it.
+                item = gen.throw(exc)
+            else:
+                item = next(gen) if sent is None else gen.send(sent)
+    except StopIteration as stop:
+        exhausted = True
+        result = stop.value
+    except GeneratorExit:
+        gen.close()
+    duration_ns = time.perf_counter_ns() - start
+
+    if ann.enabled:
+        summary = {
+            "item_count": count,
+            "duration_ns": duration_ns,
+            "exhausted": exhausted,
+        }
+        if sample_size:
+            if "item_sample" in ann.required_fields:
+                summary["item_sample"] = clean_str(ann.serializer.serialize(sample))
+            if "raw_item_sample" in ann.required_fields:
+                summary["raw_item_sample"] = sample
+        log_summary(result, summary)
+    return result
+
+
 class Wrapper:
     """Wrapper that overrides some method hooks so that logging can happen."""
 
@@ -110,6 +390,14 @@ class Wrapper:
         _ = message
         super().__init__()
         self.func = func
+        self._is_property = isinstance(func, property)
+        if not self._is_property:
+            # Bound to instances in __get__. Wrapped once here, so that
+            # accessing a method costs about as much as a plain bound method.
+            def call_method(instance, *args, **kwargs):
+                return self.__call_method__(instance, *args, **kwargs)
+
+            self._call_method = functools.update_wrapper(call_method, func)
 
     def __call__(self, *args, **kwargs):
         """Triggers when func is a function."""
@@ -136,19 +424,19 @@ class Wrapper:
     def __get__(self, instance, args):
         """Triggers when instance.method() is called."""
         _ = args
-        logger.debug(f"GETTER CALLED on {self.func}")
-        logger.debug(f"is it a property? {isinstance(self.func, property)}")
-        if isinstance(self.func, property):
+        if self._is_property:
             call_ret = self.__get_property__(instance)
             return call_ret
-        else:
+        if instance is None:
+            # Accessed on the class, which MethodType can't bind.
             call_ret = partial(self.__call_method__, instance)
             functools.update_wrapper(call_ret, self.func)
             return call_ret
+        return types.MethodType(self._call_method, instance)
 
     def __set__(self, instance, anything):
         """Triggers when setter is called."""
-        logger.debug(f"SETTER CALLED on {self.func} with value {anything}")
+        logger.debug("SETTER CALLED on %s with value %s", self.func, anything)
         if isinstance(self.func, property):
             call_ret = self.__set_property__(instance, anything)
             return call_ret
@@ -204,7 +492,9 @@ class ClassLogger(Wrapper):
     loop, as the logger calls the property, which calls the property ...
 
     Normal methods, static methods, and class methods can be decorated as
-    normal.
+    normal. So can ``async`` methods, which are logged once they have been
+    awaited, and generator methods, which are logged once the generator is
+    exhausted or closed (see ``function_logger``).
 
             @ClassLogger
             def normal_method(self, arg):
@@ -220,25 +510,84 @@ class ClassLogger(Wrapper):
             def class_method(cls, arg):
                 ...
 
+    The memory allocated by a method can be traced, and its calls can be
+    sampled, as with the ``track_memory`` and ``sampling`` options of
+    ``function_logger``::
+
+            @ClassLogger(track_memory=True)
+            def memory_hungry_method(self, arg):
+                ...
+
+            @ClassLogger(sampling=EveryN(100))
+            def frequently_called_method(self, arg):
+                ...
+
     I haven't tried all the magic methods. ``__init__`` works fine.
     ``__repr__`` does not, it does the infinite loop thing.
 
     """
 
+    def __new__(cls, func=None, message=None, *, track_memory=False, sampling=None):
+        """Leave the decorated descriptor untouched if Annalist is disabled.
+
+        Without ``func``, returns a decorator that applies the options.
+        """
+        if func is None:
+            return partial(
+                cls, message=message, track_memory=track_memory, sampling=sampling
+            )
+        if not ann.enabled:
+            return func
+        return super().__new__(cls)
+
+    def __init__(self, func, message=None, *, track_memory=False, sampling=None):
+        """Register the decorated function with Annalist.
+
+        Properties are registered through their setter, and other
+        descriptors (e.g. classmethods) through the function they wrap.
+        """
+        super().__init__(func, message)
+        self.track_memory = track_memory
+        self.sampling = sampling
+        self._is_coroutine = False
+        self._is_generator = False
+        if isinstance(func, property):
+            if func.fset is not None:
+                register_function(func.fset, bound=True)
+        else:
+            register_function(
+                inspect.unwrap(func),
+                bound=not isinstance(func, staticmethod),
+            )
+            self._is_coroutine = inspect.iscoroutinefunction(inspect.unwrap(func))
+            self._is_generator = inspect.isgeneratorfunction(inspect.unwrap(func))
+            if track_memory and (self._is_coroutine or self._is_generator):
+                raise ValueError(
+                    "track_memory is not supported for async and generator "
+                    f"methods, such as {inspect.unwrap(func).__qualname__}."
+                )
+
     def __call__(self, *args, **kwargs):
         """Triggers when a function is called.
 
         Logs, then sends to Wrapper.__call__.
         """
-        logger.debug(f"FUNCTION CALLED {self.func}")
+        if not ann.enabled:
+            return super().__call__(*args, **kwargs)
+        logger.debug("FUNCTION CALLED %s", self.func)
         logger.debug(
-            f"You decorated a function called {self.func.__name__} "
-            f"with args {args}, and kwargs {kwargs}"
+            "You decorated a function called %s with args %s, and kwargs %s",
+            self.func.__name__,
+            args,
+            kwargs,
         )
         ret_val = super().__call__(*args, **kwargs)
-        ret_val_str = trunc_value_string(ret_val)
-        logger.info(f"FUNCTION {self.func} called with args {args} and {kwargs}")
-        logger.info(f"FUNCTION {self.func} RETURNS {ret_val_str}")
+        if logger.isEnabledFor(logging.INFO):
+            ret_val_str = trunc_value_string(ret_val)
+            logger.info(
+                "FUNCTION %s called with args %s and %s", self.func, args, kwargs
+            )
+            logger.info("FUNCTION %s RETURNS %s", self.func, ret_val_str)
         return ret_val
 
     def __call_method__(self, instance, *args, **kwargs):
@@ -246,44 +595,97 @@ class ClassLogger(Wrapper):
 
         Logs, then sends to Wrapper.__call_method__.
         """
+        if not ann.enabled:
+            # Also returns the coroutine or generator of such methods as is.
+            return super().__call_method__(instance, *args, **kwargs)
+        if self._is_coroutine:
+            return self.__acall_method__(instance, *args, **kwargs)
+        if self._is_generator:
+            return self.__generate_method__(instance, *args, **kwargs)
         logger.debug("METHOD seen, let's get it.")
         logger.debug(
-            f"You decorated a method called {self.func.__name__} "
-            f"with instance {instance}, "
-            f"args {args}, and kwargs {kwargs}"
+            "You decorated a method called %s with instance %s, "
+            "args %s, and kwargs %s",
+            self.func.__name__,
+            instance,
+            args,
+            kwargs,
         )
-        ret_val = super().__call_method__(instance, *args, **kwargs)
-        logger.info(f"METHOD {self.func} called with args {args} and {kwargs}")
-        logger.info(f"METHOD {self.func} is on {instance}")
-        logger.info(f"METHOD {self.func} RETURNS {ret_val}")
+        timer = ann.start_timer()
+        try:
+            if self.track_memory:
+                with MemoryTracker() as memory:
+                    ret_val = super().__call_method__(instance, *args, **kwargs)
+                measured = {**(ann.stop_timer(timer) or {}), **memory.fields}
+            else:
+                ret_val = super().__call_method__(instance, *args, **kwargs)
+                measured = ann.stop_timer(timer)
+        except Exception:
+            ann.count_error(inspect.unwrap(self.func), timer)
+            raise
+        log_args = self._method_log_args(instance, ret_val, args, kwargs, measured)
+        if log_args is not None:
+            ann.log_call(*log_args, *args, **kwargs)
+            logger.debug("DONE LOGGING METHOD")
+        return ret_val
+
+    async def __acall_method__(self, instance, *args, **kwargs):
+        """Await an async method, then log it like __call_method__."""
+        timer = ann.start_timer()
+        try:
+            ret_val = await super().__call_method__(instance, *args, **kwargs)
+        except Exception:
+            ann.count_error(inspect.unwrap(self.func), timer)
+            raise
+        timing = ann.stop_timer(timer)
+        log_args = self._method_log_args(instance, ret_val, args, kwargs, timing)
+        if log_args is not None:
+            await ann.alog_call(*log_args, *args, **kwargs)
+        return ret_val
+
+    def __generate_method__(self, instance, *args, **kwargs):
+        """Run a generator method, and log it like __call_method__ at the end."""
+
+        def log_summary(result, summary):
+            log_args = self._method_log_args(instance, result, args, kwargs, summary)
+            if log_args is not None:
+                ann.log_call(*log_args, *args, **kwargs)
+
+        gen = super().__call_method__(instance, *args, **kwargs)
+        return (yield from _audit_generator(gen, 0, log_summary))
+
+    def _method_log_args(self, instance, ret_val, args, kwargs, measured=None):
+        """Collect the arguments of ``log_call`` for a method call.
+
+        ``measured`` holds fields measured during the call, such as the
+        timing fields. Returns None if the audit record would be filtered
+        out, or if the call is sampled out.
+        """
+        # I'm unwrapping here in case the func is a
+        # classmethod (which is a wrapper).
+        ret_func = inspect.unwrap(self.func)
+        sample_rate = _sample_call(ret_func, self.sampling)
+        if sample_rate is None:
+            return None
+
+        logger.info("METHOD %s called with args %s and %s", self.func, args, kwargs)
+        logger.info("METHOD %s is on %s", self.func, instance)
+        logger.info("METHOD %s RETURNS %s", self.func, ret_val)
         ret_val_str = trunc_value_string(ret_val)
         message = (
             f"METHOD {self.func.__qualname__} called with "
-            + f"args {args} and kwargs {kwargs}. "
+            + f"args {_trunc_serializer.serialize(args)} and "
+            + f"kwargs {_trunc_serializer.serialize(kwargs)}. "
             + f"It is on an instance of {instance.__class__.__name__}, "
             + f"and returns the value {ret_val_str}."
         )
 
-        if hasattr(self.func, "__wrapped__"):
-            ret_func = inspect.unwrap(self.func)
-        else:
-            ret_func = self.func
-
-        # I'm unwrapping here in case the func is a
-        # classmethod (which is a wrapper).
         fill_data = self._inspect_instance(ret_func, instance, args, kwargs)
+        if measured:
+            fill_data.update(measured)
+        fill_data["sample_rate"] = sample_rate
 
-        ann.log_call(
-            message=message,
-            level=ann.default_level,
-            func=ret_func,
-            ret_val=ret_val,
-            extra_data=fill_data,
-            args=args,
-            kwargs=kwargs,
-        )
-        logger.debug("DONE LOGGING METHOD")
-        return ret_val
+        return message, ann.default_level, ret_func, ret_val, fill_data
 
     def __get_property__(self, instance, *args, **kwargs):
         """Triggers when a property is called (through __get__).
@@ -294,11 +696,12 @@ class ClassLogger(Wrapper):
         _ = kwargs
         logger.debug("PROPERTY seen, let's get it.")
         logger.debug(
-            f"You decorated a property called {self.func.fget} "
-            f"on instance {instance}, "
+            "You decorated a property called %s on instance %s, ",
+            self.func.fget,
+            instance,
         )
         value = self.func.fget(instance)
-        logger.debug(f"PROPERTY IS {value}")
+        logger.debug("PROPERTY IS %s", value)
         return value
 
     def __set_property__(self, instance, value):
@@ -306,10 +709,17 @@ class ClassLogger(Wrapper):
 
         Logs, then sends to Wrapper.__set_property__
         """
+        # Nothing needs to be inspected if the audit record is filtered or
+        # sampled out.
+        sample_rate = _sample_call(self.func.fset, self.sampling)
+        if sample_rate is None:
+            return self.func.fset(instance, value)
+
         logger.debug("PROPERTY seen, let's SET it.")
         logger.debug(
-            f"You decorated a property called {self.func.fset} "
-            f"on instance {instance}, "
+            "You decorated a property called %s on instance %s, ",
+            self.func.fset,
+            instance,
         )
         logger.debug("Inspecting Instance:")
         fill_data = self._inspect_instance(
@@ -319,6 +729,7 @@ class ClassLogger(Wrapper):
             {},
             setter_value={self.func.fset.__name__: value},
         )
+        fill_data["sample_rate"] = sample_rate
 
         val_str = trunc_value_string(value)
 
@@ -328,87 +739,117 @@ class ClassLogger(Wrapper):
             + f"It is on an instance of {instance.__class__.__name__}."
         )
         ann.log_call(
-            message=message,
-            level=ann.default_level,
-            func=self.func.fset,
-            ret_val=None,
-            extra_data=fill_data,
-            args=value,
-            kwargs=None,
+            message,
+            ann.default_level,
+            self.func.fset,
+            None,
+            fill_data,
+            value,
         )
 
-        logger.info(f"PROPERTY {self.func.fset} SET TO {value}")
+        logger.info("PROPERTY %s SET TO %s", self.func.fset, value)
         return self.func.fset(instance, value)
 
     @staticmethod
     def _inspect_instance(func, instance, args, kwargs, setter_value=None):
-        if setter_value is None:
-            setter_value = {}
-        logger.debug(f"RAW ARGS: {args}")
-        logger.debug(f"RAW KWARGS: {kwargs}")
-        # arg_values = list(args) + list(kwargs.values())
-        argspec = inspect.getfullargspec(func)
-        logger.debug(f"argspec: {argspec}")
+        """Collect the custom fields of a method call.
+
+        Fields are taken from the arguments of the call, or otherwise from
+        the attributes of the instance. For a property setter,
+        ``setter_value`` maps the property name to the new value.
+        """
+        metadata = get_function_metadata(func)
+        plan = metadata.instance_plan
+        if plan is None or plan.fields is not ann.instance_fields:
+            plan = metadata.instance_plan = InstancePlan(func, ann.instance_fields)
+
+        if setter_value:
+            kwargs = {**kwargs, **setter_value}
+        fill_data = plan.fill(instance, args, kwargs)
+        if setter_value:
+            for name, value in setter_value.items():
+                if name in plan.fields:
+                    fill_data[name] = value
+        logger.debug("fill_data = %s", fill_data)
+        return fill_data
+
+
+_MISSING = object()
+
+
+class InstancePlan:
+    """Precompiled lookup of the custom fields of a method call.
+
+    Records, for each field that a formatter prints, whether it is an
+    argument of the method (by position or keyword, including keyword-only
+    arguments) or an attribute of the instance. Compiled once per method
+    and set of fields, so that a call only needs a few tuple lookups
+    instead of inspecting the method.
+
+    Parameters
+    ----------
+    func : callable
+        The (unwrapped) method.
+    fields : tuple
+        The fields to look up, see ``Annalist.instance_fields``.
+    """
 
-        if (len(argspec.args) > 0) and (argspec.args[0] == "self"):
+    __slots__ = ("arguments", "attributes", "fields")
+
+    def __init__(self, func, fields):
+        """Compile the plan of a method."""
+        argspec = inspect.getfullargspec(func)
+        if argspec.args and argspec.args[0] == "self":
             func_args = argspec.args[1:]
         else:
             func_args = argspec.args
 
+        self.fields = fields
+        arguments = []
+        attributes = []
+        for field in fields:
+            if field in func_args:
+                arguments.append((field, func_args.index(field)))
+            elif field in argspec.kwonlyargs:
+                arguments.append((field, None))
+            else:
+                attributes.append(field)
+        self.arguments = tuple(arguments)
+        self.attributes = tuple(attributes)
+
+    def fill(self, instance, args, kwargs):
+        """Look up the fields of a call.
+
+        Arguments that weren't supplied fall back to the attribute of the
+        same name, and fields that are neither are left out.
+        """
         fill_data = {}
-
-        arg_values = {}
-
-        for key, val in zip(func_args[: len(args)], args):
-            arg_values[key] = val
-
-        arg_values.update(kwargs)
-
-        if len(setter_value) != 0:
-            arg_values.update(setter_value)
-            if list(setter_value.keys())[0] in ann.all_attributes:
-                fill_data = setter_value
-
-        logger.debug(f"Fill data: {fill_data}")
-        logger.debug(f"Function Arguments: {func_args}")
-        logger.debug(f"Argument Values: {arg_values}")
-        logger.debug(f"Setter Values: {setter_value}")
-        logger.debug(f"Looking for: {ann.all_attributes}")
-        # if is_setter:
-        #     if func.__name__ in ann.all_attributes:
-
-        for attr in ann.all_attributes:
-            logger.debug(f"Searcing for {attr}")
-            if attr in fill_data:
-                pass
-            elif attr in func_args:
-                logger.info(f"Found {attr} in method args.")
-                if attr in arg_values.keys():
-                    fill_data[attr] = arg_values[attr]
-                elif hasattr(instance, attr):
-                    logger.info(
-                        "But no arg supplied." f"Found {attr} in class attributes."
-                    )
-                    fill_data[attr] = getattr(instance, attr)
-                else:
-                    logger.info("Arg not supplied, and not in class attributes")
-            elif hasattr(instance, attr):
-                logger.info(f"Found {attr} in class attributes.")
-                fill_data[attr] = getattr(instance, attr)
-
-        logger.debug(f"fill_data = {fill_data}")
-
+        for field, position in self.arguments:
+            if field in kwargs:
+                fill_data[field] = kwargs[field]
+            elif position is not None and position < len(args):
+                fill_data[field] = args[position]
+            else:
+                value = getattr(instance, field, _MISSING)
+                if value is not _MISSING:
+                    fill_data[field] = value
+        # Most fields are usually missing, and a getattr default skips
+        # raising (and catching) an AttributeError for each of them.
+        for field in self.attributes:
+            value = getattr(instance, field, _MISSING)
+            if value is not _MISSING:
+                fill_data[field] = value
         return fill_data
 
 
 def trunc_value_string(value):
     """Construct a short truncated string repr of a long value."""
-    val_str = str(value)
-    if len(val_str) > 20:
+    val_str, truncated = _trunc_serializer.serialize_bounded(value, max_chars=20)
+    if truncated:
         val_type = type(value)
         if hasattr(value, "__len__"):
             val_len = len(value)
-            val_str = val_str[:20] + f" ... [{val_type} " + f"of len {val_len}]"
+            val_str = val_str + f" ... [{val_type} " + f"of len {val_len}]"
         else:
-            val_str = val_str[:20] + f" ... [long {val_type} (trunc)]"
+            val_str = val_str + f" ... [long {val_type} (trunc)]"
     return val_str
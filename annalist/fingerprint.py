@@ -0,0 +1,217 @@
+"""Content fingerprints of logged values.
+
+A fingerprint is a blake2b digest of the content of a value, for checking
+whether a step produced the same data as in an earlier run. Unlike the
+serialized ``ret_val`` field, it covers the whole value: objects that
+support the buffer protocol, such as ``bytes``, ``array.array`` and NumPy
+arrays, are hashed through a ``memoryview`` of their memory, without
+copying it. pandas Series, DataFrames and Indexes are hashed with the
+vectorized ``pandas.util.hash_pandas_object``. Plain Python containers
+are encoded element by element, within limits on their size and depth.
+"""
+
+import hashlib
+import struct
+import sys
+
+# Tags that keep the encodings of different types apart.
+_NONE = b"N"
+_TRUE = b"T"
+_FALSE = b"F"
+_INT = b"i"
+_FLOAT = b"f"
+_COMPLEX = b"c"
+_STR = b"s"
+_BUFFER = b"b"
+_LIST = b"l"
+_TUPLE = b"("
+_UNORDERED = b"u"
+_PANDAS = b"p"
+_TRUNCATED = b"t"
+_OTHER = b"o"
+
+
+class Fingerprinter:
+    """Compute blake2b fingerprints of arbitrary values.
+
+    Equal values get equal fingerprints: dicts and sets are hashed
+    regardless of their order, and the shape and item format of buffers are
+    part of the fingerprint. Containers beyond the limits are only hashed
+    by their length, and other objects by their type and ``repr``, so the
+    fingerprints of those are weaker. Types that can be hashed in a better
+    way can be given their own function with ``register``.
+
+    Parameters
+    ----------
+    digest_size : int, optional
+        Size of the digest in bytes. Fingerprints are its hex string.
+    max_items : int, optional
+        Maximum number of container elements hashed per value. Buffers and
+        pandas objects don't count towards it, as they are always hashed
+        in full.
+    max_depth : int, optional
+        Maximum nesting depth of containers.
+    """
+
+    def __init__(
+        self, digest_size: int = 16, max_items: int = 10000, max_depth: int = 6
+    ):
+        """Construct a Fingerprinter."""
+        self.digest_size = digest_size
+        self.max_items = max_items
+        self.max_depth = max_depth
+        self.hashers: dict = {}
+
+    def register(self, value_type, hasher):
+        """Register a custom hash function for a type.
+
+        Parameters
+        ----------
+        value_type : type
+            Values of exactly this type are passed to ``hasher``.
+        hasher : callable
+            Takes the value and a ``hashlib.blake2b`` object, and feeds the
+            content of the value to the latter with ``update``.
+        """
+        self.hashers[value_type] = hasher
+
+    def fingerprint(self, value) -> str:
+        """Return the fingerprint of a value as a hex string."""
+        hasher = hashlib.blake2b(digest_size=self.digest_size)
+        self._feed(hasher, value, 0, [self.max_items])
+        return hasher.hexdigest()
+
+    def _feed(self, hasher, value, depth, budget):
+        value_type = type(value)
+        custom = self.hashers.get(value_type)
+        if custom is not None:
+            hasher.update(_OTHER + _encode_str(value_type.__qualname__))
+            custom(value, hasher)
+        elif value is None:
+            hasher.update(_NONE)
+        elif value_type is bool:
+            hasher.update(_TRUE if value else _FALSE)
+        elif value_type is int:
+            hasher.update(_INT + _encode_str(str(value)))
+        elif value_type is float:
+            hasher.update(_FLOAT + struct.pack("<d", value))
+        elif value_type is complex:
+            hasher.update(_COMPLEX + struct.pack("<dd", value.real, value.imag))
+        elif value_type is str:
+            hasher.update(_STR + _encode_str(value))
+        elif value_type is list:
+            self._feed_items(hasher, _LIST, value, depth, budget)
+        elif value_type is tuple:
+            self._feed_items(hasher, _TUPLE, value, depth, budget)
+        elif value_type in (set, frozenset):
+            self._feed_unordered(hasher, value, depth, budget)
+        elif value_type is dict:
+            self._feed_unordered(hasher, value.items(), depth, budget)
+        elif _is_pandas_container(value_type):
+            if not _feed_pandas(hasher, value):
+                # E.g. object columns that hold lists.
+                self._feed_other(hasher, value, depth, budget)
+        elif not _feed_buffer(hasher, value):
+            self._feed_other(hasher, value, depth, budget)
+
+    def _feed_other(self, hasher, value, depth, budget):
+        hasher.update(_OTHER + _encode_str(type(value).__qualname__))
+        if hasattr(value, "tolist"):
+            # E.g. NumPy arrays of Python objects.
+            self._feed(hasher, value.tolist(), depth, budget)
+        else:
+            hasher.update(_encode_str(repr(value)))
+
+    def _feed_items(self, hasher, tag, items, depth, budget):
+        hasher.update(tag + struct.pack("<Q", len(items)))
+        if depth >= self.max_depth or len(items) > budget[0]:
+            hasher.update(_TRUNCATED)
+            return
+        budget[0] -= len(items)
+        for item in items:
+            self._feed(hasher, item, depth + 1, budget)
+
+    def _feed_unordered(self, hasher, items, depth, budget):
+        # The digests of the elements are sorted, so that the order in
+        # which they were added doesn't matter.
+        if depth >= self.max_depth or len(items) > budget[0]:
+            hasher.update(_UNORDERED + struct.pack("<Q", len(items)) + _TRUNCATED)
+            return
+        budget[0] -= len(items)
+        digests = []
+        for item in items:
+            item_hasher = hashlib.blake2b(digest_size=self.digest_size)
+            self._feed(item_hasher, item, depth + 1, budget)
+            digests.append(item_hasher.digest())
+        digests.sort()
+        self._feed_items(hasher, _UNORDERED, digests, depth, [len(digests)])
+
+
+def _encode_str(text):
+    data = text.encode("utf-8", "surrogatepass")
+    return struct.pack("<Q", len(data)) + data
+
+
+def _feed_buffer(hasher, value):
+    """Hash the memory of a value that supports the buffer protocol.
+
+    Returns False if the value doesn't, or if its buffer holds object
+    pointers rather than data.
+    """
+    try:
+        view = memoryview(value)
+    except (TypeError, ValueError, BufferError):
+        dtype = getattr(value, "dtype", None)
+        if getattr(dtype, "kind", None) in ("M", "m"):
+            # NumPy datetimes and timedeltas don't export a buffer, but
+            # their 64-bit integer view does.
+            hasher.update(_encode_str(str(dtype)))
+            return _feed_buffer(hasher, value.view("i8"))
+        return False
+    with view:
+        if "O" in view.format:
+            return False
+        hasher.update(_BUFFER + _encode_str(view.format))
+        hasher.update(struct.pack(f"<{view.ndim + 1}Q", view.ndim, *view.shape))
+        if view.c_contiguous:
+            # Hashed in place, without a copy.
+            hasher.update(view)
+        else:
+            # Strided views (e.g. slices) can't be hashed in place.
+            hasher.update(view.tobytes())
+    return True
+
+
+def _is_pandas_container(value_type):
+    """Whether a type is a pandas Series, DataFrame or Index.
+
+    Other pandas types, such as ``Timestamp`` or extension arrays, are
+    hashed like any other value.
+    """
+    if value_type.__module__.partition(".")[0] != "pandas":
+        return False
+    pd = sys.modules["pandas"]
+    return issubclass(value_type, (pd.Series, pd.DataFrame, pd.Index))
+
+
+def _feed_pandas(hasher, value):
+    """Hash a pandas object with its vectorized row hashes.
+
+    Returns False if pandas can't hash the values, e.g. lists in an object
+    column.
+    """
+    from pandas.util import hash_pandas_object
+
+    try:
+        # One 64-bit hash per row, computed column by column.
+        row_hashes = hash_pandas_object(value, index=True).to_numpy()
+    except TypeError:
+        return False
+    hasher.update(_PANDAS + _encode_str(type(value).__qualname__))
+    if hasattr(value, "columns"):
+        hasher.update(_encode_str(repr(list(value.columns))))
+        hasher.update(_encode_str(repr(list(value.dtypes))))
+    else:
+        hasher.update(_encode_str(repr(value.dtype)))
+    hasher.update(row_hashes)
+    return True
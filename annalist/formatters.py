@@ -0,0 +1,184 @@
+"""Structured formatters for Annalist records."""
+
+import datetime
+import enum
+import json
+import logging
+import numbers
+from itertools import islice
+from os import PathLike
+
+from annalist.serializer import BoundedSerializer
+
+# Audit fields that hold raw values for structured formatters. ``log_call``
+# fills these instead of (or as well as) the cleaned text versions.
+RAW_FIELDS = {
+    "message": "raw_message",
+    "analyst_name": "raw_analyst_name",
+    "function_doc": "raw_function_doc",
+    "params": "raw_params",
+    "ret_val": "raw_ret_val",
+    "item_sample": "raw_item_sample",
+}
+
+_MISSING = object()
+
+_NATIVE_TYPES = (str, int, float, bool, type(None))
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """Format each record as a single line of typed JSON.
+
+    Unlike the text formatters, values keep their JSON types (numbers,
+    booleans, lists, objects) and are not passed through ``clean_str``, so
+    downstream tools can load the records with any JSON parser.
+
+    Values of non-JSON types are converted by an encoder that is looked up
+    once per type and cached. Containers are cut off at the element and
+    depth limits of the serializer, and values that have no JSON equivalent
+    are rendered with the (bounded) serializer.
+
+    Parameters
+    ----------
+    fields : list of str, optional
+        Record attributes to write, in order. Defaults to ``DEFAULT_FIELDS``.
+        Any attribute of the record can be used, including ``asctime`` and
+        ``message``.
+    datefmt : str, optional
+        Date format of the ``asctime`` field.
+    serializer : BoundedSerializer, optional
+        Supplies the size limits and renders values of unknown types.
+    """
+
+    DEFAULT_FIELDS = (
+        "asctime",
+        "levelname",
+        "name",
+        "message",
+        "analyst_name",
+        "function_name",
+        "function_doc",
+        "ret_annotation",
+        "params",
+        "ret_val",
+        "ret_val_type",
+    )
+
+    def __init__(
+        self,
+        fields=None,
+        datefmt: str | None = None,
+        serializer: BoundedSerializer | None = None,
+    ):
+        """Construct a JSONLinesFormatter."""
+        super().__init__(datefmt=datefmt)
+        self.fields = tuple(self.DEFAULT_FIELDS if fields is None else fields)
+        self.serializer = serializer or BoundedSerializer()
+        self.required_fields = {RAW_FIELDS.get(f, f) for f in self.fields}
+        self._json = json.JSONEncoder(
+            ensure_ascii=False, check_circular=False, separators=(",", ":")
+        )
+        self._encoders = {}
+
+    def format(self, record):
+        """Format a record as a JSON object on a single line."""
+        return self._json.encode(self.to_dict(record))
+
+    def to_dict(self, record):
+        """Collect the fields of a record as JSON-serializable values.
+
+        Parameters
+        ----------
+        record : logging.LogRecord
+            The record to convert.
+
+        Returns
+        -------
+        dict
+            The selected fields of the record, in order.
+        """
+        entry = {}
+        for field in self.fields:
+            if field == "asctime":
+                value = self.formatTime(record, self.datefmt)
+            elif field in RAW_FIELDS:
+                value = getattr(record, RAW_FIELDS[field], _MISSING)
+                if value is _MISSING:
+                    # Not logged by ``log_call``, e.g. a summary record.
+                    if field == "message":
+                        value = record.getMessage()
+                    else:
+                        value = getattr(record, field, None)
+            else:
+                value = getattr(record, field, None)
+            entry[field] = self.to_json(value)
+        return entry
+
+    def to_json(self, value, depth=0):
+        """Convert a value into JSON-serializable types.
+
+        Parameters
+        ----------
+        value : object
+            The value to convert.
+        depth : int, optional
+            Nesting depth of ``value``, used to apply the depth limit.
+
+        Returns
+        -------
+        object
+            A str, int, float, bool, None, or a list or dict of those.
+        """
+        value_type = type(value)
+        if value_type in _NATIVE_TYPES:
+            if value_type is str and len(value) > self.serializer.max_chars:
+                return value[: self.serializer.max_chars] + self.serializer.fillvalue
+            return value
+        encoder = self._encoders.get(value_type)
+        if encoder is None:
+            encoder = self._encoders[value_type] = self._find_encoder(value_type)
+        return encoder(value, depth)
+
+    def _find_encoder(self, value_type):
+        """Pick the encoder for a type. Called once per type."""
+        if issubclass(value_type, dict):
+            return self._encode_dict
+        if issubclass(value_type, list | tuple | set | frozenset):
+            return self._encode_items
+        if issubclass(value_type, enum.Enum):
+            return lambda value, depth: self.to_json(value.value, depth)
+        if issubclass(value_type, str):
+            return lambda value, depth: self.to_json(str(value), depth)
+        if issubclass(value_type, numbers.Integral):
+            return lambda value, depth: int(value)
+        if issubclass(value_type, numbers.Real):
+            return lambda value, depth: float(value)
+        if issubclass(value_type, datetime.date | datetime.time):
+            return lambda value, depth: value.isoformat()
+        if issubclass(value_type, PathLike):
+            return lambda value, depth: str(value)
+        if issubclass(value_type, type):
+            return lambda value, depth: value.__qualname__
+        return lambda value, depth: self.serializer.serialize(value)
+
+    def _encode_items(self, value, depth):
+        if depth >= self.serializer.max_depth:
+            return self.serializer.fillvalue
+        max_elements = self.serializer.max_elements
+        items = [self.to_json(item, depth + 1) for item in islice(value, max_elements)]
+        if len(value) > max_elements:
+            items.append(self.serializer.fillvalue)
+        return items
+
+    def _encode_dict(self, value, depth):
+        if depth >= self.serializer.max_depth:
+            return self.serializer.fillvalue
+        max_elements = self.serializer.max_elements
+        entries = {}
+        for key, item in islice(value.items(), max_elements):
+            if type(key) is not str:
+                key = self.serializer.serialize(key)
+            entries[key] = self.to_json(item, depth + 1)
+        if len(value) > max_elements:
+            entries[self.serializer.fillvalue] = self.serializer.fillvalue
+        return entries
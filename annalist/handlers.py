@@ -0,0 +1,435 @@
+"""Logging handlers used as Annalist sinks."""
+
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from logging.handlers import BaseRotatingHandler, QueueHandler
+
+from annalist.formatters import RAW_FIELDS
+
+
+class BlockingQueueHandler(QueueHandler):
+    """Queue handler that waits for room instead of dropping records.
+
+    The standard ``QueueHandler`` raises (and drops the record) when a
+    bounded queue is full. An audit trail should not lose records, so this
+    handler blocks the caller until the background writer catches up.
+    """
+
+    def enqueue(self, record):
+        """Put a record on the queue, waiting for a free slot if needed."""
+        self.queue.put(record)
+
+
+class BatchingQueueHandler(QueueHandler):
+    """Queue handler that sends records to another process in batches.
+
+    Used in the workers of a process pool (see ``Annalist.pool_kwargs``).
+    Each record is reduced to a plain dict of its attributes, leaving out
+    those that are None, and records are put on the queue in lists of up to
+    ``batch_size``, so that one pickling and one pipe write cover many
+    records. Raw values for structured outputs are converted to JSON types
+    first, so that they can be pickled.
+
+    Parameters
+    ----------
+    queue : multiprocessing.Queue
+        The queue that the aggregator in the parent process reads from.
+    batch_size : int, optional
+        Send the batch once it holds this many records.
+    flush_interval : float, optional
+        Send a partial batch after this many seconds. A background thread
+        takes care of this when no further records arrive. None disables
+        timed sending.
+    json_formatter : JSONLinesFormatter, optional
+        Converts raw values to JSON types. Raw values are dropped if not
+        given.
+    """
+
+    def __init__(
+        self,
+        queue,
+        batch_size: int = 100,
+        flush_interval: float | None = 0.5,
+        json_formatter=None,
+    ):
+        """Construct a BatchingQueueHandler."""
+        super().__init__(queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.json_formatter = json_formatter
+        self._batch: list[dict] = []
+        self._last_flush = time.monotonic()
+
+        self._closing = threading.Event()
+        if flush_interval is not None:
+            threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+    def prepare(self, record):
+        """Reduce a record to a dict of its (non-None) attributes."""
+        message = self.format(record)
+        fields = record.__dict__
+        entry = {key: value for key, value in fields.items() if value is not None}
+        entry["msg"] = entry["message"] = message
+        for key in ("args", "exc_info", "exc_text", "stack_info"):
+            entry.pop(key, None)
+        for key in RAW_FIELDS.values():
+            if key in fields:
+                if self.json_formatter is None:
+                    entry.pop(key, None)
+                else:
+                    # Kept even if None, e.g. a function without docstring.
+                    entry[key] = self.json_formatter.to_json(fields[key])
+        return entry
+
+    def emit(self, record):
+        """Add a record to the batch, sending it if it is due."""
+        try:
+            entry = self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+        self.acquire()
+        try:
+            self._batch.append(entry)
+            if len(self._batch) >= self.batch_size or (
+                self.flush_interval is not None
+                and time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self.flush()
+        finally:
+            self.release()
+
+    def flush(self):
+        """Send the records in the batch."""
+        self.acquire()
+        try:
+            if self._batch:
+                self.queue.put(self._batch)
+                self._batch = []
+            self._last_flush = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self):
+        """Send the remaining records and stop the background thread."""
+        self._closing.set()
+        self.flush()
+        super().close()
+
+    def _flush_periodically(self):
+        while not self._closing.wait(self.flush_interval):
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """File handler that writes records in batches.
+
+    Formatted records are collected in memory and written with a single
+    ``write`` call once enough bytes or records have accumulated, or once
+    ``flush_interval`` seconds have passed since the last write. This
+    trades a little latency before records hit the file for far fewer
+    system calls.
+
+    Parameters
+    ----------
+    filename : str or PathLike
+        The file to write to.
+    mode : str, optional
+        Mode in which the file is opened. Defaults to "a".
+    encoding : str, optional
+        Encoding of the file.
+    max_bytes : int, optional
+        Flush once this many bytes (counted as characters) are buffered.
+    max_records : int, optional
+        Flush once this many records are buffered.
+    flush_interval : float, optional
+        Flush buffered records after this many seconds, even if neither
+        limit has been reached. A background thread takes care of this
+        when no further records arrive. None disables timed flushing.
+    fsync : str, optional
+        When to ``os.fsync`` the file, i.e. force it onto the disk:
+        "never" (leave it to the OS), "flush" (after every batch) or
+        "close" (once, when the handler is closed).
+    """
+
+    FSYNC_POLICIES = ("never", "flush", "close")
+
+    def __init__(
+        self,
+        filename,
+        mode: str = "a",
+        encoding: str | None = None,
+        max_bytes: int = 64 * 1024,
+        max_records: int = 1000,
+        flush_interval: float | None = 1.0,
+        fsync: str = "never",
+    ):
+        """Construct a BufferedFileHandler."""
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(
+                f"Unknown fsync policy {fsync!r}, expected one of "
+                f"{self.FSYNC_POLICIES}."
+            )
+        super().__init__(filename, mode, encoding)
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+        self._buffer: list[str] = []
+        self._buffered_bytes = 0
+        self._last_flush = time.monotonic()
+
+        self._closing = threading.Event()
+        self._flusher = None
+        if flush_interval is not None:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, daemon=True
+            )
+            self._flusher.start()
+
+    def emit(self, record):
+        """Format a record and add it to the buffer."""
+        try:
+            msg = self.format(record) + self.terminator
+        except Exception:
+            self.handleError(record)
+            return
+        self._buffer.append(msg)
+        self._buffered_bytes += len(msg)
+        if (
+            self._buffered_bytes >= self.max_bytes
+            or len(self._buffer) >= self.max_records
+            or (
+                self.flush_interval is not None
+                and time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        ):
+            self.flush()
+
+    def flush(self):
+        """Write all buffered records to the file."""
+        self.acquire()
+        try:
+            if self._buffer:
+                if self.stream is None:
+                    # Reopen after close, like FileHandler.emit does.
+                    self.stream = self._open()
+                self.stream.write("".join(self._buffer))
+                self.stream.flush()
+                if self.fsync == "flush":
+                    os.fsync(self.stream.fileno())
+            self._buffer.clear()
+            self._buffered_bytes = 0
+            self._last_flush = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self):
+        """Flush the buffer, apply the fsync policy and close the file."""
+        self._closing.set()
+        self.acquire()
+        try:
+            self.flush()
+            if self.fsync == "close" and self.stream is not None:
+                os.fsync(self.stream.fileno())
+        finally:
+            self.release()
+        super().close()
+
+    def _flush_periodically(self):
+        while not self._closing.wait(self.flush_interval):
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+
+class RotatingCompressedFileHandler(BaseRotatingHandler):
+    """File handler that rotates the log into gzip-compressed segments.
+
+    Records are written to ``filename``, the active segment. Once it grows
+    past ``max_bytes``, or is older than ``interval`` seconds, it is renamed
+    to a numbered segment (``audit.log.00001``, ``audit.log.00002``, ...)
+    and a fresh active segment is started. Closed segments are compressed
+    by a background thread, so audited calls never wait on gzip.
+
+    A manifest (``audit.log.manifest.json``) lists the closed segments in
+    order, with the number of records and the time range of each. Use
+    ``annalist.reader.read_rotated_log`` to stream the records of all
+    segments.
+
+    The handler always appends. If the active segment already holds records
+    from an earlier run, it is rotated into a segment first, so earlier
+    runs are never overwritten. When the handler is closed, the active
+    segment is rotated and compressed as well.
+
+    Parameters
+    ----------
+    filename : str or PathLike
+        Path of the active segment.
+    encoding : str, optional
+        Encoding of the file.
+    max_bytes : int, optional
+        Rotate once the active segment holds this many bytes. None disables
+        rotation by size.
+    interval : float, optional
+        Rotate once the active segment is this many seconds old. None
+        (default) disables rotation by time.
+    compress : bool, optional
+        Whether to gzip closed segments. Defaults to True.
+    """
+
+    def __init__(
+        self,
+        filename,
+        encoding: str | None = None,
+        max_bytes: int | None = 64 * 1024 * 1024,
+        interval: float | None = None,
+        compress: bool = True,
+    ):
+        """Construct a RotatingCompressedFileHandler."""
+        super().__init__(filename, "a", encoding, delay=True)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.compress = compress
+        self.manifest_path = self.baseFilename + ".manifest.json"
+
+        self._manifest_lock = threading.Lock()
+        self._manifest = self._load_manifest()
+        self._sequence = len(self._manifest["segments"])
+        self._pending: queue.Queue = queue.Queue()
+        self._compressor = None
+        self._start_segment()
+
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename):
+            # Keep the tail of an earlier run as a segment of its own.
+            self._rotate(records=None)
+        if compress:
+            # Finish compressing segments of a run that was cut short.
+            for entry in self._manifest["segments"]:
+                if not entry["path"].endswith(".gz"):
+                    self._submit(entry)
+
+    def shouldRollover(self, record):
+        """Check whether the active segment is due for rotation."""
+        if self.stream is None or not self._records:
+            return False
+        if self.max_bytes is not None and self.stream.tell() >= self.max_bytes:
+            return True
+        return (
+            self.interval is not None
+            and record.created - self._opened_at >= self.interval
+        )
+
+    def doRollover(self):
+        """Close the active segment, queue it for compression, start anew."""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self._rotate(self._records)
+
+    def emit(self, record):
+        """Write a record, rotating the active segment first if it is due."""
+        super().emit(record)
+        if self._start is None:
+            self._start = record.created
+        self._end = record.created
+        self._records += 1
+
+    def wait_for_compression(self):
+        """Block until all closed segments have been compressed."""
+        if self._compressor is not None:
+            self._pending.join()
+
+    def close(self):
+        """Rotate the active segment, finish compression and close."""
+        self.acquire()
+        try:
+            if self._records:
+                self.doRollover()
+            if self._compressor is not None:
+                self._pending.put(None)
+                self._compressor.join()
+                self._compressor = None
+        finally:
+            self.release()
+        super().close()
+
+    def _start_segment(self):
+        self._records = 0
+        self._start = None
+        self._end = None
+        self._opened_at = time.time()
+
+    def _rotate(self, records):
+        """Move the active segment to the next numbered segment."""
+        self._sequence += 1
+        segment = f"{self.baseFilename}.{self._sequence:05d}"
+        os.replace(self.baseFilename, segment)
+        entry = {
+            "path": os.path.basename(segment),
+            "records": records,
+            "start": self._start,
+            "end": self._end,
+        }
+        with self._manifest_lock:
+            self._manifest["segments"].append(entry)
+            self._save_manifest()
+        self._start_segment()
+        if self.compress:
+            self._submit(entry)
+
+    def _submit(self, entry):
+        if self._compressor is None:
+            self._compressor = threading.Thread(
+                target=self._compress_segments, daemon=True
+            )
+            self._compressor.start()
+        self._pending.put(entry)
+
+    def _compress_segments(self):
+        while True:
+            entry = self._pending.get()
+            try:
+                if entry is None:
+                    return
+                self._compress(entry)
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "Could not compress log segment %s", entry["path"]
+                )
+            finally:
+                self._pending.task_done()
+
+    def _compress(self, entry):
+        """Gzip a closed segment and point the manifest at the result."""
+        directory = os.path.dirname(self.baseFilename)
+        source = os.path.join(directory, entry["path"])
+        target = source + ".gz"
+        with open(source, "rb") as f_in, gzip.open(target + ".tmp", "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.replace(target + ".tmp", target)
+        with self._manifest_lock:
+            entry["path"] = os.path.basename(target)
+            self._save_manifest()
+        os.remove(source)
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": []}
+
+    def _save_manifest(self):
+        """Write the manifest, replacing the old one atomically."""
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,470 @@
+"""Read and query Annalist log files.
+
+``AuditLog`` memory-maps a log file and keeps a sidecar index next to it,
+recording where each record starts, its timestamp, and which records
+belong to each function and level. Queries only touch the records they
+return, and reopening a log that has grown only indexes the new records.
+
+The sidecar is a JSON Lines file: a header line, followed by one chunk per
+update of the index, holding the records that it added. Updates append a
+chunk instead of rewriting the file, which is only rewritten when the log
+was, or once it has ``MAX_INDEX_CHUNKS`` chunks.
+"""
+
+import bisect
+import datetime
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import re
+
+INDEX_VERSION = 2
+
+# The sidecar index is compacted into one chunk once it has this many.
+MAX_INDEX_CHUNKS = 1000
+
+# Fields of the index that each chunk overrides, rather than extends.
+_INDEX_STATE = ("size", "file_size", "mtime_ns", "head", "ordered")
+
+# Matches one printf-style field of a logging format string.
+_FORMAT_FIELD = re.compile(r"%\((\w+)\)[#0+ -]*\d*(?:\.\d+)?[a-zA-Z]")
+
+# The index stores a digest of the first line of the log, which tells a log
+# that has grown apart from one that was rewritten since the last build.
+_HEAD_BYTES = 4096
+
+
+class AuditLog:
+    """An indexed, memory-mapped Annalist log file.
+
+    Reads logs written with ``file_output="jsonl"``, or, given the format
+    string they were written with, text logs. Binary logs can only be read
+    front to back, with ``annalist.binary.read_binary_log``, and rotated
+    logs with ``read_rotated_log``.
+
+    The index is stored in a sidecar file and brought up to date whenever
+    the log is opened or queried. Records that were appended since the last
+    build are added to it, while a log that was truncated or rewritten is
+    indexed from scratch. If the sidecar can't be written, e.g. next to a
+    log in a read-only archive, the index is only kept in memory.
+
+    Parameters
+    ----------
+    path : str or PathLike
+        The log file.
+    file_format_str : str, optional
+        The format string a text log was written with. Leave out for JSON
+        Lines logs.
+    date_format : str, optional
+        Date format of the ``asctime`` field. Defaults to the date format
+        used by Annalist.
+    index_path : str or PathLike, optional
+        Where to keep the index. Defaults to the log path with ".idx"
+        appended.
+
+    Examples
+    --------
+    >>> log = AuditLog("audit.jsonl")
+    >>> for record in log.query(function="resample", start="2024-01-01"):
+    ...     print(record["asctime"], record["ret_val"])
+    """
+
+    def __init__(
+        self,
+        path,
+        file_format_str: str | None = None,
+        date_format: str = "%Y-%m-%d %H:%M:%S",
+        index_path=None,
+    ):
+        """Open a log file and bring its index up to date."""
+        self.path = os.fspath(path)
+        self.index_path = os.fspath(index_path) if index_path else self.path + ".idx"
+        self.file_format_str = file_format_str
+        self.date_format = date_format
+        self._parse_text = _make_parser(file_format_str)
+
+        self._file = None
+        self._map = None
+        # Records in the sidecar, or None if it needs to be rewritten.
+        self._saved = None
+        self._chunks = 0
+        self._persist = True
+        self._index = self._load_index()
+        self.refresh()
+
+    def __enter__(self):
+        """Use the log as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the log on leaving the context."""
+        self.close()
+
+    def __len__(self):
+        """Return the number of indexed records."""
+        return len(self._index["offsets"])
+
+    def __iter__(self):
+        """Iterate over all indexed records, in file order."""
+        self.refresh()
+        for position in range(len(self)):
+            yield self._read(position)
+
+    def close(self):
+        """Release the memory map of the log file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def functions(self):
+        """Names of the functions that appear in the log."""
+        return sorted(name for name in self._index["functions"] if name)
+
+    def refresh(self):
+        """Index the records that were appended since the last build.
+
+        Returns
+        -------
+        int
+            The number of newly indexed records.
+        """
+        stat = os.stat(self.path)
+        index = self._index
+        if stat.st_size == index["file_size"] and stat.st_mtime_ns == index["mtime_ns"]:
+            return 0
+
+        self.close()
+        if stat.st_size == 0:
+            self._index = self._empty_index()
+            self._saved = None
+            self._save_index()
+            return 0
+        self._open_map()
+
+        head = self._head_digest()
+        if stat.st_size <= index["file_size"] or (
+            index["head"] and head != index["head"]
+        ):
+            # Truncated or rewritten since the last build.
+            index = self._index = self._empty_index()
+            self._saved = None
+        index["head"] = head
+        index["file_size"] = stat.st_size
+        index["mtime_ns"] = stat.st_mtime_ns
+
+        count = 0
+        pos = index["size"]
+        while True:
+            end = self._map.find(b"\n", pos)
+            if end == -1:
+                # Leave a line that is still being written for the next build.
+                break
+            line = self._map[pos:end]
+            if line.strip():
+                self._add_to_index(pos, self._parse(line))
+                count += 1
+            pos = end + 1
+        index["size"] = pos
+        self._save_index()
+        return count
+
+    def query(self, function=None, level=None, start=None, end=None):
+        """Find the records that match all of the given criteria.
+
+        Parameters
+        ----------
+        function : str, optional
+            Only records of calls to this function.
+        level : str, optional
+            Only records at this level, e.g. "INFO".
+        start : datetime, str or float, optional
+            Only records logged at or after this time. Strings are parsed
+            with ``date_format``, floats are POSIX timestamps.
+        end : datetime, str or float, optional
+            Only records logged at or before this time.
+
+        Yields
+        ------
+        dict
+            The fields of each matching record, in file order.
+        """
+        self.refresh()
+        index = self._index
+        candidates = None
+        if function is not None:
+            candidates = index["functions"].get(function, [])
+        if level is not None:
+            by_level = index["levels"].get(level, [])
+            candidates = (
+                by_level if candidates is None else _intersect(candidates, by_level)
+            )
+
+        lo = self._timestamp(start) if start is not None else None
+        hi = self._timestamp(end) if end is not None else None
+        times = index["times"]
+        if index["ordered"] and (lo is not None or hi is not None):
+            # Narrow down to a slice of the log, then to the candidates in it.
+            first = 0 if lo is None else bisect.bisect_left(times, lo)
+            last = len(times) if hi is None else bisect.bisect_right(times, hi)
+            if candidates is None:
+                candidates = range(first, last)
+            else:
+                first = bisect.bisect_left(candidates, first)
+                last = bisect.bisect_left(candidates, last)
+                candidates = candidates[first:last]
+            lo = hi = None
+        elif candidates is None:
+            candidates = range(len(times))
+
+        for position in candidates:
+            if lo is not None or hi is not None:
+                timestamp = times[position]
+                if (
+                    timestamp is None
+                    or (lo is not None and timestamp < lo)
+                    or (hi is not None and timestamp > hi)
+                ):
+                    continue
+            yield self._read(position)
+
+    def _open_map(self):
+        """Memory-map the log file."""
+        # Kept open for as long as the map is in use, closed by ``close``.
+        self._file = open(self.path, "rb")  # noqa: SIM115
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read(self, position):
+        """Parse the record at a position in the index."""
+        if self._map is None:
+            self._open_map()
+        offset = self._index["offsets"][position]
+        end = self._map.find(b"\n", offset)
+        return self._parse(self._map[offset:end])
+
+    def _parse(self, line):
+        """Parse one line of the log into a dict of fields."""
+        return self._parse_text(line.decode("utf-8").rstrip("\r"))
+
+    def _add_to_index(self, offset, record):
+        """Add a parsed record at ``offset`` to the index."""
+        index = self._index
+        position = len(index["offsets"])
+        index["offsets"].append(offset)
+
+        try:
+            timestamp = self._timestamp(record.get("asctime"))
+        except (TypeError, ValueError):
+            timestamp = None
+        times = index["times"]
+        if timestamp is None or (
+            times and (times[-1] is None or timestamp < times[-1])
+        ):
+            index["ordered"] = False
+        times.append(timestamp)
+
+        function = record.get("function_name")
+        index["functions"].setdefault(function or "", []).append(position)
+        level = record.get("levelname")
+        index["levels"].setdefault(level or "", []).append(position)
+
+    def _timestamp(self, value):
+        """Convert a datetime, date string or POSIX timestamp to a float."""
+        if isinstance(value, str):
+            value = datetime.datetime.strptime(value, self.date_format)
+        if isinstance(value, datetime.datetime):
+            return value.timestamp()
+        if isinstance(value, int | float):
+            return float(value)
+        raise TypeError(f"Cannot convert {value!r} to a timestamp.")
+
+    def _head_digest(self):
+        """Digest the first line of the log file."""
+        end = self._map.find(b"\n", 0, _HEAD_BYTES)
+        head = self._map[: end if end != -1 else _HEAD_BYTES]
+        return hashlib.blake2b(head, digest_size=16).hexdigest()
+
+    def _empty_index(self):
+        return {
+            "version": INDEX_VERSION,
+            "file_format_str": self.file_format_str,
+            "size": 0,
+            "file_size": 0,
+            "mtime_ns": None,
+            "head": None,
+            "ordered": True,
+            "offsets": [],
+            "times": [],
+            "functions": {},
+            "levels": {},
+        }
+
+    def _load_index(self):
+        """Load the sidecar index, or start a new one if it is unusable."""
+        index = self._empty_index()
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                if (
+                    header.get("version") != INDEX_VERSION
+                    or header.get("file_format_str") != self.file_format_str
+                ):
+                    return index
+                chunks = 0
+                for line in f:
+                    chunk = json.loads(line)
+                    chunks += 1
+                    if chunk["start"] != len(index["offsets"]):
+                        # Written by another reader that updated the index
+                        # from the same state.
+                        continue
+                    for key in _INDEX_STATE:
+                        index[key] = chunk[key]
+                    index["offsets"] += chunk["offsets"]
+                    index["times"] += chunk["times"]
+                    for key in ("functions", "levels"):
+                        for name, positions in chunk[key].items():
+                            index[key].setdefault(name, []).extend(positions)
+        except (OSError, ValueError, KeyError, AttributeError):
+            # Also a chunk that was cut short, which is indexed again.
+            return self._empty_index()
+        self._saved = len(index["offsets"])
+        self._chunks = chunks
+        return index
+
+    def _save_index(self):
+        """Add the records indexed since the last save to the sidecar.
+
+        They are appended as a chunk. The sidecar is replaced atomically
+        instead if the index was rebuilt, or has too many chunks.
+        """
+        if not self._persist:
+            return
+        index = self._index
+        start = self._saved
+        if self._chunks >= MAX_INDEX_CHUNKS:
+            start = None
+        chunk = {key: index[key] for key in _INDEX_STATE}
+        first = start or 0
+        chunk["start"] = first
+        chunk["offsets"] = index["offsets"][first:]
+        chunk["times"] = index["times"][first:]
+        for key in ("functions", "levels"):
+            chunk[key] = {}
+            for name, positions in index[key].items():
+                new = positions[bisect.bisect_left(positions, first) :]
+                if new:
+                    chunk[key][name] = new
+        line = json.dumps(chunk, separators=(",", ":")) + "\n"
+        try:
+            if start is None:
+                header = {
+                    "version": INDEX_VERSION,
+                    "file_format_str": self.file_format_str,
+                }
+                tmp_path = self.index_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(json.dumps(header) + "\n")
+                    f.write(line)
+                os.replace(tmp_path, self.index_path)
+                self._chunks = 1
+            else:
+                with open(self.index_path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                self._chunks += 1
+        except OSError:
+            # E.g. a log in a read-only archive.
+            self._persist = False
+            return
+        self._saved = len(index["offsets"])
+
+
+def read_rotated_log(path, file_format_str: str | None = None):
+    """Stream the records of a rotated log, across all of its segments.
+
+    Reads the closed segments listed in the manifest of a log written by a
+    ``RotatingCompressedFileHandler``, oldest first, followed by the active
+    segment.
+
+    Parameters
+    ----------
+    path : str or PathLike
+        Path of the active segment, i.e. the ``logfile`` passed to
+        ``configure``.
+    file_format_str : str, optional
+        The format string a text log was written with. Leave out for JSON
+        Lines logs.
+
+    Yields
+    ------
+    dict
+        The fields of each record, in the order they were written.
+    """
+    path = os.fspath(path)
+    parse = _make_parser(file_format_str)
+    try:
+        with open(path + ".manifest.json", encoding="utf-8") as f:
+            segments = json.load(f)["segments"]
+    except FileNotFoundError:
+        segments = []
+
+    directory = os.path.dirname(path)
+    paths = [os.path.join(directory, entry["path"]) for entry in segments]
+    for segment in [*paths, path]:
+        if not segment.endswith(".gz") and not os.path.exists(segment):
+            if segment == path:
+                continue
+            # Compressed since the manifest was read.
+            segment += ".gz"
+        opener = gzip.open if segment.endswith(".gz") else open
+        with opener(segment, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\r\n")
+                if line.strip():
+                    yield parse(line)
+
+
+def _make_parser(file_format_str):
+    """Build a function that parses one line of a log into a dict."""
+    if file_format_str is None:
+        return json.loads
+
+    # Turn the format string into a regex that matches its lines.
+    parts = []
+    seen = set()
+    pos = 0
+    fields = list(_FORMAT_FIELD.finditer(file_format_str))
+    for i, match in enumerate(fields):
+        parts.append(re.escape(file_format_str[pos : match.start()]))
+        name = match.group(1)
+        if name in seen:
+            parts.append(f"(?P={name})")
+        else:
+            # The last field takes the rest of the line.
+            lazy = "" if i == len(fields) - 1 else "?"
+            parts.append(f"(?P<{name}>.*{lazy})")
+            seen.add(name)
+        pos = match.end()
+    parts.append(re.escape(file_format_str[pos:]))
+    pattern = re.compile("".join(parts) + "$")
+
+    def parse(text):
+        match = pattern.match(text)
+        if match is None:
+            return {"message": text}
+        return match.groupdict()
+
+    return parse
+
+
+def _intersect(a, b):
+    """Intersect two sorted lists of positions."""
+    if len(a) > len(b):
+        a, b = b, a
+    members = set(b)
+    return [position for position in a if position in members]
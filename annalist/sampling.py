@@ -0,0 +1,163 @@
+"""Sampling policies for frequently called audited functions.
+
+A policy decides, call by call, whether a call is logged. ``sample``
+returns None for calls that are skipped, and for logged calls the sample
+rate: the fraction of calls that the record stands for. Adding up
+``1 / sample_rate`` over the records of a function estimates how often it
+was called.
+
+Policies can be given to a decorator (``function_logger(sampling=...)``),
+or set for all decorated functions with ``configure(sampling=...)``. A
+global policy is copied for every function, so e.g. each function gets its
+own token bucket. Policies are thread-safe: the state they keep between
+calls is guarded by a lock.
+"""
+
+import copy
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+
+
+class SamplingPolicy(ABC):
+    """Base class of sampling policies.
+
+    Subclasses implement ``sample``, and hold ``self._lock`` while they
+    update state that is shared between calls.
+    """
+
+    def __init__(self):
+        """Create the lock of the policy."""
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        """Leave out the lock when copying or pickling a policy."""
+        state = self.__dict__.copy()
+        state.pop("_lock", None)
+        return state
+
+    def __setstate__(self, state):
+        """Restore a copied policy, with a lock of its own."""
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def sample(self):
+        """Decide whether to log a call.
+
+        Returns
+        -------
+        float or None
+            None to skip the call, otherwise the sample rate of the record,
+            between 0 (exclusive) and 1.
+        """
+
+    def clone(self):
+        """Return a copy of the policy, for use by another function."""
+        return copy.deepcopy(self)
+
+
+class EveryN(SamplingPolicy):
+    """Log the first call and every ``n``-th call after it.
+
+    Parameters
+    ----------
+    n : int
+        One in this many calls is logged.
+    """
+
+    def __init__(self, n: int):
+        """Construct an EveryN policy."""
+        if n < 1:
+            raise ValueError(f"n must be at least 1, got {n}.")
+        super().__init__()
+        self.n = n
+        self.rate = 1 / n
+        self._calls = 0
+
+    def sample(self):
+        """Log one in ``n`` calls."""
+        with self._lock:
+            calls = self._calls
+            self._calls = calls + 1
+        if calls % self.n:
+            return None
+        return self.rate
+
+
+class Probability(SamplingPolicy):
+    """Log each call with probability ``p``.
+
+    Parameters
+    ----------
+    p : float
+        Probability of logging a call, between 0 (exclusive) and 1.
+    seed : int, optional
+        Seed of the random generator, for reproducible runs.
+    """
+
+    def __init__(self, p: float, seed: int | None = None):
+        """Construct a Probability policy."""
+        if not 0 < p <= 1:
+            raise ValueError(f"p must be in (0, 1], got {p}.")
+        super().__init__()
+        self.p = p
+        # Sampling is not security sensitive.
+        self._random = random.Random(seed).random  # noqa: S311
+
+    def sample(self):
+        """Log a call with probability ``p``."""
+        with self._lock:
+            draw = self._random()
+        if draw < self.p:
+            return self.p
+        return None
+
+
+class TokenBucket(SamplingPolicy):
+    """Log at most ``rate`` calls per second, with bursts of up to ``burst``.
+
+    Each logged call takes a token from the bucket, which is refilled at
+    ``rate`` tokens per second. Calls are skipped while the bucket is
+    empty. The sample rate of a record is one over the number of calls
+    since the previous record, so it counts the calls that were skipped.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second.
+    burst : float, optional
+        Capacity of the bucket. Defaults to ``rate`` (but at least 1).
+    """
+
+    def __init__(self, rate: float, burst: float | None = None):
+        """Construct a TokenBucket policy."""
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}.")
+        super().__init__()
+        self.rate = rate
+        self.burst = max(1.0, rate) if burst is None else burst
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._calls = 0
+
+    def sample(self):
+        """Log a call if a token is available."""
+        with self._lock:
+            self._calls += 1
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            if self._tokens < 1:
+                return None
+            self._tokens -= 1
+            calls = self._calls
+            self._calls = 0
+        return 1 / calls
+
+    def clone(self):
+        """Return a new, full bucket with the same settings."""
+        return TokenBucket(self.rate, self.burst)
@@ -0,0 +1,198 @@
+"""Bounded serialization of logged values."""
+
+from annalist.summaries import summarizer_for
+
+
+class _BudgetExhausted(Exception):
+    """Raised internally once a serializer has used up its character budget."""
+
+
+class BoundedSerializer:
+    """Produce size-limited string representations of arbitrary values.
+
+    Works in the spirit of ``reprlib``: containers are walked element by
+    element, and output stops as soon as the character budget is used up,
+    so that serializing a huge list or dict costs about as much as the part
+    that is actually logged. Within the limits, the output is identical to
+    ``str(value)``.
+
+    Values of other types are rendered with ``str`` (or ``repr`` when nested
+    in a container) and then truncated. NumPy arrays and pandas Series and
+    DataFrames are summarized instead, see ``annalist.summaries``. Types
+    that are expensive to render can be given a cheaper serializer with
+    ``register``.
+
+    Parameters
+    ----------
+    max_chars : int, optional
+        Maximum number of characters produced for a value.
+    max_depth : int, optional
+        Maximum nesting depth of containers. Deeper containers are
+        rendered as e.g. ``[...]``.
+    max_elements : int, optional
+        Maximum number of elements rendered per container. Remaining
+        elements are replaced by ``...``.
+    fillvalue : str, optional
+        Appended to the output of ``serialize`` when it was truncated.
+    """
+
+    def __init__(
+        self,
+        max_chars: int = 1000,
+        max_depth: int = 6,
+        max_elements: int = 100,
+        fillvalue: str = "...",
+    ):
+        """Construct a BoundedSerializer."""
+        self.max_chars = max_chars
+        self.max_depth = max_depth
+        self.max_elements = max_elements
+        self.fillvalue = fillvalue
+        self.serializers: dict = {}
+
+    def register(self, value_type, serializer):
+        """Register a custom serializer for a type.
+
+        Parameters
+        ----------
+        value_type : type
+            Values of exactly this type are passed to ``serializer``.
+        serializer : callable
+            Takes the value and returns its string representation. The
+            result is still truncated to the character budget.
+        """
+        self.serializers[value_type] = serializer
+
+    def serialize(self, value, max_chars: int | None = None) -> str:
+        """Serialize a value, marking the output if it was truncated.
+
+        Parameters
+        ----------
+        value : object
+            The value to serialize.
+        max_chars : int, optional
+            Overrides the ``max_chars`` of the serializer for this value.
+
+        Returns
+        -------
+        str
+            The bounded representation of ``value``, followed by
+            ``fillvalue`` if it had to be cut short.
+        """
+        text, truncated = self.serialize_bounded(value, max_chars)
+        if truncated:
+            text += self.fillvalue
+        return text
+
+    def serialize_bounded(self, value, max_chars: int | None = None):
+        """Serialize a value within the character budget.
+
+        Parameters
+        ----------
+        value : object
+            The value to serialize.
+        max_chars : int, optional
+            Overrides the ``max_chars`` of the serializer for this value.
+
+        Returns
+        -------
+        tuple[str, bool]
+            The bounded representation of ``value``, and whether it was cut
+            short.
+        """
+        writer = _Writer(self.max_chars if max_chars is None else max_chars)
+        try:
+            self._write(writer, value, 0, top=True)
+        except _BudgetExhausted:
+            return "".join(writer.parts), True
+        return "".join(writer.parts), False
+
+    def _write(self, writer, value, depth, top=False):
+        value_type = type(value)
+        serializer = self.serializers.get(value_type)
+        if serializer is not None:
+            writer.emit(serializer(value))
+        elif value_type is str:
+            if top:
+                writer.emit(value)
+            else:
+                # Only repr the part of the string that can fit.
+                writer.emit(repr(value[: writer.remaining + 1]))
+        elif value_type is bytes:
+            writer.emit(repr(value[: writer.remaining + 1]))
+        elif value_type is list:
+            self._write_items(writer, value, depth, "[", "]")
+        elif value_type is tuple:
+            if len(value) == 1:
+                self._write_items(writer, value, depth, "(", ",)")
+            else:
+                self._write_items(writer, value, depth, "(", ")")
+        elif value_type is dict:
+            self._write_dict(writer, value, depth)
+        elif value_type is set:
+            if value:
+                self._write_items(writer, value, depth, "{", "}")
+            else:
+                writer.emit("set()")
+        elif value_type is frozenset:
+            if value:
+                self._write_items(writer, value, depth, "frozenset({", "})")
+            else:
+                writer.emit("frozenset()")
+        else:
+            summarizer = summarizer_for(value_type)
+            if summarizer is not None:
+                # Arrays and DataFrames, summarized as far as the budget goes.
+                writer.emit(summarizer(value, writer.remaining))
+            elif top:
+                writer.emit(str(value))
+            else:
+                writer.emit(repr(value))
+
+    def _write_items(self, writer, items, depth, opening, closing):
+        writer.emit(opening)
+        if depth >= self.max_depth:
+            writer.emit("...")
+        else:
+            for i, item in enumerate(items):
+                if i:
+                    writer.emit(", ")
+                if i >= self.max_elements:
+                    writer.emit("...")
+                    break
+                self._write(writer, item, depth + 1)
+        writer.emit(closing)
+
+    def _write_dict(self, writer, value, depth):
+        writer.emit("{")
+        if depth >= self.max_depth:
+            writer.emit("...")
+        else:
+            for i, (key, item) in enumerate(value.items()):
+                if i:
+                    writer.emit(", ")
+                if i >= self.max_elements:
+                    writer.emit("...")
+                    break
+                self._write(writer, key, depth + 1)
+                writer.emit(": ")
+                self._write(writer, item, depth + 1)
+        writer.emit("}")
+
+
+class _Writer:
+    """Accumulates output until the character budget runs out."""
+
+    __slots__ = ("parts", "remaining")
+
+    def __init__(self, max_chars):
+        self.parts = []
+        self.remaining = max_chars
+
+    def emit(self, text):
+        if len(text) > self.remaining:
+            self.parts.append(text[: self.remaining])
+            self.remaining = 0
+            raise _BudgetExhausted
+        self.parts.append(text)
+        self.remaining -= len(text)
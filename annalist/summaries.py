@@ -0,0 +1,174 @@
+"""Statistical summaries of NumPy arrays and pandas objects.
+
+The text of a large array or DataFrame only shows its first and last
+values. Instead, ``BoundedSerializer`` logs a summary of it: the shape and
+dtype, and for numeric data the minimum, maximum, mean and number of NaN
+values, per column for DataFrames.
+
+The statistics are computed with vectorized reductions: three passes over
+a numeric column without NaN values, and a few more to skip them if there
+are any. Values with more than ``MAX_STATS_SIZE`` elements only get their
+shape and dtype, so that a summary is never slower than the text of the
+value. The statistics are also skipped when the shape alone already
+exceeds the character budget, e.g. for the short values in the messages of
+``ClassLogger``. Neither library is a dependency of Annalist: summaries
+are only used for types of libraries that the audited code has imported.
+"""
+
+import numbers
+import sys
+
+# Statistics are only computed for arrays, Series and DataFrames of at most
+# this many elements. Around this size they take about as long as ``str``.
+MAX_STATS_SIZE = 500_000
+
+
+def summarizer_for(value_type):
+    """Return the summary function of a NumPy or pandas type, if any.
+
+    Parameters
+    ----------
+    value_type : type
+        The type of a value to serialize.
+
+    Returns
+    -------
+    callable or None
+        Takes a value of ``value_type`` and optionally the number of
+        characters that will be logged of it, and returns its summary. None
+        if the type isn't an array, Series or DataFrame.
+    """
+    library = value_type.__module__.partition(".")[0]
+    if library == "numpy":
+        np = sys.modules["numpy"]
+        if value_type is np.ndarray:
+            return summarize_array
+    elif library == "pandas":
+        pd = sys.modules["pandas"]
+        if value_type is pd.DataFrame:
+            return summarize_frame
+        if value_type is pd.Series:
+            return summarize_series
+    return None
+
+
+def summarize_array(values, max_chars=None):
+    """Summarize a NumPy array.
+
+    E.g. ``ndarray(shape=(3,), dtype=float64, min=1, max=3, mean=2,
+    nan_count=1, null_fraction=0.333333)``.
+    """
+    fields = {"shape": values.shape, "dtype": values.dtype}
+    if values.size <= MAX_STATS_SIZE and not _exceeds("ndarray", fields, max_chars):
+        fields.update(_numeric_stats(values))
+    return _format("ndarray", fields)
+
+
+def summarize_series(series, max_chars=None):
+    """Summarize a pandas Series, like a column of ``summarize_frame``."""
+    fields = {"name": series.name, "shape": series.shape, "dtype": series.dtype}
+    if series.size <= MAX_STATS_SIZE and not _exceeds("Series", fields, max_chars):
+        fields.update(_column_stats(series))
+    return _format("Series", fields)
+
+
+def summarize_frame(frame, max_chars=None):
+    """Summarize a pandas DataFrame, with the statistics of every column.
+
+    Columns are rendered as e.g. ``'flow': float64(min=1.5, max=2.5, mean=2,
+    nan_count=0, null_fraction=0)``. Numeric columns count NaN values as
+    nulls, other columns count what ``isna`` counts. Only the columns that
+    fit in ``max_chars`` are summarized, and large DataFrames only get the
+    dtypes of their columns.
+    """
+    head = f"DataFrame(shape={frame.shape}, columns={{"
+    with_stats = frame.size <= MAX_STATS_SIZE
+    columns = []
+    length = len(head)
+    for name, column in frame.items():
+        if max_chars is not None and length > max_chars:
+            # The rest would be cut off anyway.
+            columns.append("...")
+            break
+        if with_stats:
+            text = f"{name!r}: {_format(str(column.dtype), _column_stats(column))}"
+        else:
+            text = f"{name!r}: {column.dtype}"
+        columns.append(text)
+        length += len(text) + 2
+    return f"{head}{', '.join(columns)}}})"
+
+
+def _exceeds(name, fields, max_chars):
+    """Whether the summary would exceed max_chars with just these fields."""
+    return max_chars is not None and len(_format(name, fields)) > max_chars
+
+
+def _column_stats(column):
+    """Compute the statistics of a pandas Series."""
+    import numpy as np
+    import pandas as pd
+
+    dtype = column.dtype
+    if isinstance(dtype, np.dtype):
+        if dtype.kind in "biuf":
+            # A view of the column, not a copy.
+            return _numeric_stats(column.to_numpy())
+    elif pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+        # Nullable extension types, with pd.NA as null.
+        return _numeric_stats(column.to_numpy(dtype="float64", na_value=np.nan))
+
+    null_count = int(column.isna().sum())
+    return {
+        "null_count": null_count,
+        "null_fraction": null_count / len(column) if len(column) else 0.0,
+    }
+
+
+def _numeric_stats(values):
+    """Compute min, max, mean and NaN count of a numeric NumPy array."""
+    import numpy as np
+
+    if values.dtype.kind not in "biuf" or not values.size:
+        return {}
+    size = values.size
+    nan_count = 0
+    if values.dtype.kind == "f":
+        total = values.sum()
+        if np.isnan(total):
+            # Only look for the NaN values if there are any.
+            mask = np.isnan(values)
+            nan_count = int(np.count_nonzero(mask))
+            not_nan = np.logical_not(mask, out=mask)
+            if nan_count == size:
+                minimum = maximum = mean = np.nan
+            else:
+                minimum = np.fmin.reduce(values, axis=None)
+                maximum = np.fmax.reduce(values, axis=None)
+                mean = values.sum(where=not_nan) / (size - nan_count)
+        else:
+            minimum = values.min()
+            maximum = values.max()
+            mean = total / size
+    else:
+        minimum = values.min()
+        maximum = values.max()
+        mean = values.mean()
+    return {
+        "min": minimum,
+        "max": maximum,
+        "mean": mean,
+        "nan_count": nan_count,
+        "null_fraction": nan_count / size,
+    }
+
+
+def _format(name, fields):
+    """Render a summary as e.g. ``ndarray(shape=(3,), min=1)``."""
+    rendered = []
+    for key, value in fields.items():
+        if isinstance(value, numbers.Real) and not isinstance(value, numbers.Integral):
+            # Rounded to keep the summary short.
+            value = f"{value:.6g}"
+        rendered.append(f"{key}={value}")
+    return f"{name}({', '.join(rendered)})"
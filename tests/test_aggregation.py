@@ -0,0 +1,156 @@
+"""Tests for the aggregation mode."""
+
+import io
+import json
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from annalist.aggregation import CallStatistics
+from annalist.annalist import Annalist
+from annalist.decorators import ClassLogger, function_logger
+from tests.example_class import return_greeting
+
+
+def test_percentiles():
+    """Test that the histogram estimates percentiles within its accuracy."""
+    durations = [random.randint(1_000, 10_000_000) for _ in range(10000)]
+    stats = CallStatistics()
+    for duration in durations:
+        stats.add(duration)
+    stats.add(None, error=True)
+
+    durations.sort()
+    for q in (50, 95, 99):
+        exact = durations[int(q / 100 * len(durations)) - 1]
+        assert stats.percentile(q) == pytest.approx(exact, rel=0.07)
+    assert stats.calls == 10001
+    assert stats.errors == 1
+    assert stats.total_ns == sum(durations)
+
+    # Small values are counted exactly.
+    stats = CallStatistics()
+    for duration in range(8):
+        stats.add(duration)
+    assert stats.percentile(50) == 3
+    assert CallStatistics().percentile(50) is None
+
+
+def test_aggregated_logging(tmp_path):
+    """Test that calls are summarized instead of logged one by one."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.jsonl"
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_aggregated_logging",
+        stream_format_str="%(function_name)s %(call_count)s",
+        file_output="jsonl",
+        aggregation={"flush_interval": None},
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    @function_logger
+    def parse(value):
+        """Parse a reading."""
+        return float(value)
+
+    class Gauge:
+        @ClassLogger  # type: ignore
+        def read(self):
+            """Read the gauge."""
+            return 1.5
+
+    gauge = Gauge()
+    for value in ["1.5", "2", "oops", "3"] * 50:
+        try:
+            parse(value)
+        except ValueError:
+            pass
+        gauge.read()
+    assert stream.getvalue() == ""
+
+    ann.flush()
+    assert sorted(stream.getvalue().splitlines()) == ["parse 200", "read 200"]
+    with open(logfile, encoding="utf-8") as f:
+        summaries = {r["function_name"]: r for r in map(json.loads, f)}
+    assert summaries["parse"]["call_count"] == 200
+    assert summaries["parse"]["error_count"] == 50
+    assert summaries["read"]["error_count"] == 0
+    assert summaries["parse"]["message"] == "SUMMARY of 200 calls to parse, 50 failed"
+    for summary in summaries.values():
+        p50, p95, p99 = (summary[f"duration_p{q}_ns"] for q in (50, 95, 99))
+        assert 0 < p50 <= p95 <= p99
+        assert summary["duration_total_ns"] >= p50 * 100
+
+    # The counters start over after a flush, and functions that weren't
+    # called are left out of the next summaries.
+    parse("4")
+    ann.shutdown()
+    assert stream.getvalue().splitlines()[-1] == "parse 1"
+
+    # After shutdown, calls are logged one by one again.
+    parse("5")
+    assert stream.getvalue().splitlines()[-1] == "parse None"
+
+
+def test_periodic_summaries():
+    """Test that the background thread logs summaries periodically."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_periodic_summaries",
+        stream_format_str="%(function_name)s %(call_count)s",
+        aggregation={"flush_interval": 0.05},
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    @function_logger
+    def tick():
+        """Called in a tight loop."""
+
+    for _ in range(1000):
+        tick()
+    time.sleep(0.3)
+    # The loop may span more than one interval.
+    lines = stream.getvalue().splitlines()
+    assert lines
+    assert sum(int(line.split()[1]) for line in lines) == 1000
+    ann.shutdown()
+
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_pool_aggregation(tmp_path, start_method):
+    """Test that the calls of pool workers are counted in one summary."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.jsonl"
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_pool_aggregation",
+        stream_format_str="%(function_name)s %(call_count)s",
+        file_output="jsonl",
+        aggregation={"flush_interval": None},
+    )
+    ann.stream_handler.setStream(io.StringIO())
+
+    names = [f"Craig {i}" for i in range(200)]
+    context = multiprocessing.get_context(start_method)
+    pool_kwargs = ann.pool_kwargs(mp_context=context)
+    with ProcessPoolExecutor(max_workers=4, mp_context=context, **pool_kwargs) as pool:
+        greetings = list(pool.map(return_greeting, names))
+    return_greeting("Speve")
+    ann.flush()
+
+    assert greetings == [f"Hi {name}" for name in names]
+    with open(logfile, encoding="utf-8") as f:
+        summaries = [json.loads(line) for line in f]
+    assert sorted(r["call_count"] for r in summaries) == [1, 200]
+    for summary in summaries:
+        assert summary["function_name"] == "return_greeting"
+        assert summary["function_doc"] == "Return a friendly greeting."
+        assert summary["error_count"] == 0
+        assert summary["duration_p50_ns"] > 0
+    ann.shutdown()
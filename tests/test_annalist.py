@@ -2,11 +2,30 @@
 
 """Tests for `annalist` package."""
 
+import asyncio
+import datetime
+import enum
+import fractions
 import inspect
+import io
 import json
-
-from annalist.annalist import Annalist
-from annalist.decorators import function_logger
+import logging
+import multiprocessing
+import pathlib
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from annalist.annalist import Annalist, get_function_metadata
+from annalist.binary import read_binary_log
+from annalist.decorators import ClassLogger, function_logger
+from annalist.formatters import JSONLinesFormatter
+from annalist.handlers import BufferedFileHandler
+from annalist.reader import read_rotated_log
+from annalist.serializer import BoundedSerializer
 from tests.example_class import Craig, return_greeting, which_craig_is_that
 
 
@@ -64,7 +83,7 @@ def test_all_fields(capsys):
         '"ret_val_type": "<class \'str\'>",'
         '"ret_annotation": "<class \'str\'>",'
         "\"params\": \"{'name': {'default': 'loneliness'; "
-        "'annotation': <class 'str'>; 'kind': 'keyword'; 'value': 'Craig'}}\","
+        "'annotation': <class 'str'>; 'kind': 'positional'; 'value': 'Craig'}}\","
         '"asctime": "unknown",'
         '"filename": "annalist.py",'
         '"funcName": "log_call",'
@@ -618,3 +637,1090 @@ def test_identity_dissociation():
     assert cb.army_of_craigs.__name__ == "army_of_craigs"
     assert cb.army_of_craigs.__doc__ == "Make an army of tall, healthy, shaven craigs."
     assert cb.army_of_craigs.__module__ == "tests.example_class"
+
+    # Methods are bound like plain methods.
+    assert cb.grow_craig.__self__ is cb
+    assert cb.grow_craig == cb.grow_craig
+    assert cb.grow_craig.__wrapped__.__name__ == "grow_craig"
+
+
+def test_metadata_cache(capsys):
+    """Test that function metadata is cached and refreshed on redecoration."""
+    ann = Annalist()
+
+    format_str = "%(function_name)s | %(function_doc)s"
+
+    ann.configure(
+        analyst_name="test_metadata_cache",
+        stream_format_str=format_str,
+    )
+
+    def hydrate(site):
+        """Hydrate a site."""
+        return site
+
+    decorated = function_logger(hydrate)
+    assert get_function_metadata(hydrate).doc == "Hydrate a site."
+
+    decorated("Manawatu")
+    hydrate.__doc__ = "Dehydrate a site."
+    decorated("Manawatu")
+
+    # Redecoration picks up the new docstring.
+    function_logger(hydrate)("Manawatu")
+
+    captured = capsys.readouterr()
+    test_output = captured.err.split("\n")
+
+    assert test_output[0] == "hydrate | Hydrate a site."
+    assert test_output[1] == "hydrate | Hydrate a site."
+    assert test_output[2] == "hydrate | Dehydrate a site."
+
+
+def test_params_binding(capsys):
+    """Test that call arguments are bound to the right parameters."""
+    ann = Annalist()
+
+    format_str = "%(function_name)s | %(params)s"
+
+    ann.configure(
+        analyst_name="test_params_binding",
+        stream_format_str=format_str,
+    )
+
+    def resample(site, *sites, freq: str = "15min", **options):
+        return site
+
+    function_logger(resample)("Manawatu", "Rangitikei", freq="1h", fill=0)
+
+    cb = Craig(
+        surname="Beaven",
+        height=5.5,
+        shoesize=9,
+        injured=True,
+        bearded=True,
+    )
+    cb.measure_the_craig(height=6.1)
+
+    captured = capsys.readouterr()
+    test_output = captured.err.split("\n")
+
+    assert test_output[0] == (
+        "resample | {'site': {'default': None; 'annotation': None; "
+        "'kind': 'positional'; 'value': 'Manawatu'}; "
+        "'sites': {'default': None; 'annotation': None; "
+        "'kind': 'var_positional'; 'value': ('Rangitikei';)}; "
+        "'freq': {'default': '15min'; 'annotation': <class 'str'>; "
+        "'kind': 'keyword'; 'value': '1h'}; "
+        "'fill': {'default': None; 'annotation': None; "
+        "'kind': 'var_keyword'; 'value': 0}}"
+    )
+    assert test_output[2] == (
+        "measure_the_craig | {'height': {'default': None; "
+        "'annotation': float | None; 'kind': 'keyword'; 'value': 6.1}}"
+    )
+
+
+def test_required_fields_only(capsys):
+    """Test that fields absent from the formatters are not computed."""
+    ann = Annalist()
+
+    class Expensive:
+        renders = 0
+
+        def __str__(self):
+            Expensive.renders += 1
+            return "expensive"
+
+    def load_frame():
+        return Expensive()
+
+    ann.configure(
+        analyst_name="test_required_fields_only",
+        stream_format_str="%(function_name)s",
+    )
+    function_logger(load_frame)()
+    assert Expensive.renders == 0
+
+    ann.set_stream_formatter("%(function_name)s | %(ret_val)s")
+    function_logger(load_frame)()
+    assert Expensive.renders == 1
+
+    captured = capsys.readouterr()
+    test_output = captured.err.split("\n")
+
+    assert test_output[0] == "load_frame"
+    assert test_output[1] == "load_frame | expensive"
+
+
+def test_filtered_level_builds_nothing(capsys):
+    """Test that no record is built for calls below the level filter."""
+    ann = Annalist()
+
+    class Expensive:
+        renders = 0
+
+        def __repr__(self):
+            Expensive.renders += 1
+            return "expensive"
+
+    def load_frame(frame):
+        return frame
+
+    ann.configure(
+        analyst_name="test_filtered_level_builds_nothing",
+        stream_format_str="%(function_name)s | %(params)s | %(ret_val)s",
+        level_filter="WARNING",
+    )
+
+    function_logger(load_frame)(Expensive())
+    ann.log_call("", None, load_frame, Expensive(), None, Expensive())
+
+    cb = Craig(
+        surname="Beaven",
+        height=5.5,
+        shoesize=9,
+        injured=True,
+        bearded=True,
+    )
+    cb.measure_the_craig(Expensive())
+    cb.surname = Expensive()
+
+    assert Expensive.renders == 0
+
+    function_logger(load_frame, level="ERROR")(Expensive())
+
+    captured = capsys.readouterr()
+    assert captured.err == (
+        "load_frame | {'frame': {'default': None; 'annotation': None; "
+        "'kind': 'positional'; 'value': expensive}} | expensive\n"
+    )
+
+
+def test_disable(capsys, monkeypatch):
+    """Test the process-wide disable switch."""
+    ann = Annalist()
+
+    ann.configure(
+        analyst_name="test_disable",
+        stream_format_str="%(function_name)s",
+    )
+
+    def load_frame():
+        return "frame"
+
+    async def load_async():
+        return "frame"
+
+    class Loader:
+        @ClassLogger  # type: ignore
+        def load(self):
+            return "frame"
+
+    audited = function_logger(load_frame)
+    tracked = function_logger(load_frame, track_memory=True)
+    audited_async = function_logger(load_async)
+    try:
+        ann.disable()
+
+        # Nothing is measured once the flag is checked.
+        def fail():
+            raise AssertionError("Timer started while disabled")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(ann, "start_timer", fail)
+            assert audited() == "frame"
+            assert tracked() == "frame"
+            assert asyncio.run(audited_async()) == "frame"
+            assert Loader().load() == "frame"
+
+        # Decorating while disabled leaves the function untouched.
+        assert function_logger(load_frame) is load_frame
+        assert function_logger()(load_frame) is load_frame
+        setter = property().setter(lambda self, value: None)
+        assert ClassLogger(setter) is setter
+
+        # Functions decorated earlier skip logging at runtime.
+        audited()
+
+        cb = Craig(
+            surname="Beaven",
+            height=5.5,
+            shoesize=9,
+            injured=True,
+            bearded=True,
+        )
+        cb.surname = "Coulomb"
+    finally:
+        ann.enable()
+
+    audited()
+
+    captured = capsys.readouterr()
+    assert captured.err == "load_frame\n"
+
+
+def test_async_logging(capsys, tmp_path):
+    """Test queue-backed logging on a background thread."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.log"
+
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_async_logging",
+        file_format_str="%(analyst_name)s | %(function_name)s",
+        stream_format_str="%(function_name)s",
+        async_logging=True,
+        queue_size=2,
+    )
+
+    for _ in range(5):
+        return_greeting("Craig")
+    ann.flush()
+
+    assert logfile.read_text() == "test_async_logging | return_greeting\n" * 5
+
+    ann.set_stream_formatter("%(function_name)s | %(message)s")
+    return_greeting("Craig")
+    ann.shutdown()
+
+    # After shutdown, records are written synchronously again.
+    return_greeting("Craig")
+
+    captured = capsys.readouterr()
+    assert captured.err == (
+        "return_greeting\n" * 5 + "return_greeting | Just saying hi.\n" * 2
+    )
+
+
+def test_buffered_file(tmp_path):
+    """Test writing the log file in batches."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.log"
+
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_buffered_file",
+        file_format_str="%(function_name)s",
+        file_buffer={"max_records": 3, "flush_interval": None, "fsync": "flush"},
+    )
+
+    return_greeting("Craig")
+    return_greeting("Craig")
+    assert logfile.read_text() == ""
+
+    return_greeting("Craig")
+    assert logfile.read_text() == "return_greeting\n" * 3
+
+    return_greeting("Craig")
+    ann.flush()
+    assert logfile.read_text() == "return_greeting\n" * 4
+
+    # Changing the formatter keeps the buffering, and flushes the old file.
+    return_greeting("Craig")
+    ann.set_file_formatter("%(function_name)s | %(message)s")
+    assert logfile.read_text() == "return_greeting\n" * 5
+    return_greeting("Craig")
+    assert logfile.read_text() == "return_greeting\n" * 5
+    ann.flush()
+    assert logfile.read_text().endswith("return_greeting | Just saying hi.\n")
+
+
+def test_buffered_file_flush_interval(tmp_path):
+    """Test timed flushing and the fsync policies of BufferedFileHandler."""
+    logfile = tmp_path / "audit.log"
+
+    with pytest.raises(ValueError, match="fsync"):
+        BufferedFileHandler(logfile, fsync="sometimes")
+
+    handler = BufferedFileHandler(logfile, flush_interval=0.01, fsync="close")
+    handler.handle(logging.makeLogRecord({"msg": "first"}))
+    for _ in range(100):
+        if logfile.read_text():
+            break
+        time.sleep(0.01)
+    assert logfile.read_text() == "first\n"
+
+    handler.handle(logging.makeLogRecord({"msg": "second"}))
+    handler.close()
+    assert logfile.read_text() == "first\nsecond\n"
+
+
+def test_jsonl_output(tmp_path, capsys):
+    """Test writing the log file as typed JSON lines."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.jsonl"
+
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_jsonl_output",
+        stream_format_str="%(function_name)s | %(injured)s",
+        file_output="jsonl",
+    )
+
+    def gauge(site, levels, *, calibrated=True):
+        """Read a gauge, once, twice."""
+        return {"site": site, "levels": levels, "max": max(levels)}
+
+    function_logger(gauge, extra_info={"injured": False})(
+        "Manawatu, at Teachers College", (1.5, 2.25), calibrated=False
+    )
+    return_greeting("Craig")
+    ann.flush()
+
+    records = [json.loads(line) for line in logfile.read_text().splitlines()]
+
+    assert list(records[0]) == [
+        "asctime",
+        "levelname",
+        "name",
+        "message",
+        "analyst_name",
+        "function_name",
+        "function_doc",
+        "ret_annotation",
+        "params",
+        "ret_val",
+        "ret_val_type",
+        "injured",
+    ]
+    assert records[0]["function_name"] == "gauge"
+    # Unlike text output, the strings are written as they are.
+    assert records[0]["function_doc"] == "Read a gauge, once, twice."
+    assert records[0]["params"] == {
+        "site": {
+            "default": None,
+            "annotation": None,
+            "kind": "positional",
+            "value": "Manawatu, at Teachers College",
+        },
+        "levels": {
+            "default": None,
+            "annotation": None,
+            "kind": "positional",
+            "value": [1.5, 2.25],
+        },
+        "calibrated": {
+            "default": True,
+            "annotation": None,
+            "kind": "keyword",
+            "value": False,
+        },
+    }
+    assert records[0]["ret_val"] == {
+        "site": "Manawatu, at Teachers College",
+        "levels": [1.5, 2.25],
+        "max": 2.25,
+    }
+    assert records[0]["ret_val_type"] == "dict"
+    assert records[0]["injured"] is False
+
+    assert records[1]["ret_val"] == "Hi Craig"
+    assert records[1]["ret_annotation"] == "str"
+    assert records[1]["params"]["name"]["annotation"] == "str"
+
+    ann.set_stream_formatter("%(message)s | %(analyst_name)s | %(function_doc)s")
+    ann.analyst_name = "Doe, Jane"
+
+    def multiline():
+        pass
+
+    multiline.__doc__ = "Do one thing,\n        then another.\n        "
+    ann.log_call("Called, twice\nover", "INFO", multiline, None, {})
+    with ann.context(analyst_name="Smith,\tJohn"):
+        ann.log_call("Called", "INFO", multiline, None, {})
+    ann.flush()
+
+    records = [json.loads(line) for line in logfile.read_text().splitlines()]
+    assert records[2]["message"] == "Called, twice\nover"
+    assert records[2]["analyst_name"] == "Doe, Jane"
+    assert records[2]["function_doc"] == multiline.__doc__
+    assert records[3]["analyst_name"] == "Smith,\tJohn"
+    assert capsys.readouterr().err.splitlines()[-2:] == [
+        "Called; twiceover | Doe; Jane | Do one thing;        then another.        ",
+        "Called | Smith,\tJohn | Do one thing;        then another.        ",
+    ]
+
+    with pytest.raises(ValueError, match="file output"):
+        ann.configure(logfile=logfile, file_output="xml")
+
+
+def test_jsonl_encoders():
+    """Test the per-type encoders and limits of the JSON lines formatter."""
+    formatter = JSONLinesFormatter(
+        fields=["asctime", "message", "raw_ret_val"],
+        serializer=BoundedSerializer(max_chars=8, max_depth=2, max_elements=3),
+    )
+
+    class Colour(enum.Enum):
+        RED = 1
+
+    class Gauge:
+        def __str__(self):
+            return "Gauge at Teachers College"
+
+    assert formatter.to_json(Colour.RED) == 1
+    assert formatter.to_json(datetime.date(2024, 1, 31)) == "2024-01-31"
+    assert formatter.to_json(pathlib.PurePosixPath("a/b")) == "a/b"
+    assert formatter.to_json(Gauge()) == "Gauge at..."
+    assert formatter.to_json("x" * 10) == "xxxxxxxx..."
+    assert formatter.to_json(list(range(5))) == [0, 1, 2, "..."]
+    assert formatter.to_json({1: {2: {3: 4}}}) == {"1": {"2": "..."}}
+    assert formatter.to_json({i: i for i in range(5)}) == {
+        "0": 0,
+        "1": 1,
+        "2": 2,
+        "...": "...",
+    }
+    assert formatter.to_json(fractions.Fraction(1, 2)) == 0.5
+
+    record = logging.makeLogRecord({"msg": "hi", "raw_ret_val": {1, 2}})
+    line = json.loads(formatter.format(record))
+    assert line["message"] == "hi"
+    assert sorted(line["raw_ret_val"]) == [1, 2]
+
+
+def test_binary_output(tmp_path):
+    """Test writing and reading back the compact binary format."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.bin"
+
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_binary_output",
+        file_output="binary",
+    )
+
+    def gauge(site, level):
+        """Read a gauge."""
+        return {"site": site, "level": level, "huge": 2**70, "ok": True}
+
+    for level in (1.5, -3):
+        function_logger(gauge)("Manawatu at Teachers College", level)
+    return_greeting("Craig")
+    ann.flush()
+
+    records = list(read_binary_log(logfile))
+
+    assert len(records) == 3
+    assert list(records[0]) == list(JSONLinesFormatter.DEFAULT_FIELDS)
+    assert records[0]["analyst_name"] == "test_binary_output"
+    assert records[1]["ret_val"] == {
+        "site": "Manawatu at Teachers College",
+        "level": -3,
+        "huge": 2**70,
+        "ok": True,
+    }
+    assert records[1]["params"]["level"]["value"] == -3
+    assert records[2]["ret_annotation"] == "str"
+
+    # Long docstrings are written once, long values every time.
+    long_doc = "Read a gauge. " + "Calibrated against the staff gauge. " * 20
+    gauge.__doc__ = long_doc
+    audited = function_logger(gauge)
+    size = logfile.stat().st_size
+    audited("x" * 500, 1)
+    ann.flush()
+    first_size = logfile.stat().st_size - size
+    audited("x" * 500, 1)
+    ann.flush()
+    assert logfile.stat().st_size - size - first_size < first_size - len(long_doc)
+    records = list(read_binary_log(logfile))
+    assert records[-1]["function_doc"] == long_doc
+
+    # Appending starts a new string table, and formatters select fields.
+    ann.set_file_formatter("%(function_name)s %(ret_val)s")
+    return_greeting("Speve")
+    ann.flush()
+
+    records = list(read_binary_log(logfile))
+    assert len(records) == 6
+    assert records[5] == {"function_name": "return_greeting", "ret_val": "Hi Speve"}
+
+    # A record that was cut short mid-write is skipped.
+    logfile.write_bytes(logfile.read_bytes()[:-3])
+    assert len(list(read_binary_log(logfile))) == 5
+
+    logfile.write_bytes(b"Not an annalist log")
+    with pytest.raises(ValueError, match="not a binary Annalist log"):
+        list(read_binary_log(logfile))
+
+
+def test_rotated_file(tmp_path):
+    """Test rotating the log into compressed segments."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.jsonl"
+
+    with pytest.raises(ValueError, match="rotation"):
+        ann.configure(logfile=logfile, file_output="binary", rotation={})
+
+    def run(analyst_name):
+        ann.configure(
+            logfile=logfile,
+            analyst_name=analyst_name,
+            file_format_str="%(analyst_name)s %(ret_val)s",
+            file_output="jsonl",
+            rotation={"max_bytes": 500},
+        )
+        audited = function_logger(lambda i: i)
+        for i in range(50):
+            audited(i)
+
+    run("first")
+    handler = ann.file_handler
+    handler.wait_for_compression()
+    manifest = json.loads((tmp_path / "audit.jsonl.manifest.json").read_text())
+    segments = manifest["segments"]
+    assert len(segments) > 1
+    assert all(entry["path"].endswith(".gz") for entry in segments)
+    assert sum(entry["records"] for entry in segments) < 50
+    assert [r["ret_val"] for r in read_rotated_log(logfile)] == list(range(50))
+
+    # A new run adds to the segments of the previous one.
+    run("second")
+    ann.file_handler.close()
+    assert not logfile.exists()
+    records = list(read_rotated_log(logfile))
+    assert [r["analyst_name"] for r in records] == ["first"] * 50 + ["second"] * 50
+    assert [r["ret_val"] for r in records] == list(range(50)) * 2
+    assert not list(tmp_path.glob("audit.jsonl.0*[0-9]"))
+
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_process_pool(tmp_path, start_method):
+    """Test that records from pool workers all reach the parent's log."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.jsonl"
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_process_pool",
+        file_format_str="%(process)s %(function_name)s %(params)s %(ret_val)s",
+        stream_format_str="%(function_name)s",
+        file_output="jsonl",
+    )
+    ann.stream_handler.setStream(io.StringIO())
+
+    names = [f"Craig {i}" for i in range(200)]
+    context = multiprocessing.get_context(start_method)
+    pool_kwargs = ann.pool_kwargs(batch_size=16, mp_context=context)
+    with ProcessPoolExecutor(max_workers=4, mp_context=context, **pool_kwargs) as pool:
+        greetings = list(pool.map(return_greeting, names))
+    ann.flush()
+
+    records = [json.loads(line) for line in logfile.read_text().splitlines()]
+    assert greetings == [f"Hi {name}" for name in names]
+    assert len(records) == len(names)
+    assert sorted(r["ret_val"] for r in records) == sorted(greetings)
+    assert all(r["function_name"] == "return_greeting" for r in records)
+    assert {r["params"]["name"]["value"] for r in records} == set(names)
+    assert len({r["process"] for r in records}) > 1
+    ann.shutdown()
+
+
+def test_context_fields():
+    """Test per-thread and per-task fields added with ann.context."""
+    ann = Annalist()
+    stream = io.StringIO()
+    ann.configure(
+        analyst_name="test_context_fields",
+        stream_format_str="%(analyst_name)s | %(site)s | %(ret_val)s",
+    )
+    ann.stream_handler.setStream(stream)
+
+    @function_logger
+    def measure(value):
+        """Measure a value."""
+        return value
+
+    with ann.context(site="Manawatu"):
+        measure(1)
+        with ann.context(site="Rangitikei", analyst_name="Speve"):
+            measure(2)
+        measure(3)
+    measure(4)
+    with ann.context(site="Manawatu"):
+        function_logger(lambda value: value, extra_info={"site": "Whanganui"})(5)
+
+    assert stream.getvalue().splitlines() == [
+        "test_context_fields | Manawatu | 1",
+        "Speve | Rangitikei | 2",
+        "test_context_fields | Manawatu | 3",
+        "test_context_fields | None | 4",
+        "test_context_fields | Whanganui | 5",
+    ]
+
+    # Each thread and each asyncio task sees only its own context.
+    stream.seek(0)
+    stream.truncate()
+    barrier = threading.Barrier(4)
+
+    def process_site(site):
+        with ann.context(site=site):
+            barrier.wait()
+            measure(site)
+
+    threads = [
+        threading.Thread(target=process_site, args=(f"site {i}",)) for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    async def process_site_async(site):
+        with ann.context(site=site):
+            await asyncio.sleep(0)
+            measure(site)
+
+    async def main():
+        await asyncio.gather(*(process_site_async(f"task {i}") for i in range(4)))
+
+    asyncio.run(main())
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 8
+    for line in lines:
+        _, site, ret_val = line.split(" | ")
+        assert site == ret_val
+
+
+def test_async_functions():
+    """Test logging coroutine functions and async methods once awaited."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_async_functions",
+        stream_format_str="%(function_name)s | %(ret_val)s | %(site)s",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    # Record which thread writes each record.
+    writers = []
+    thread_filter = logging.Filter()
+    thread_filter.filter = lambda record: writers.append(threading.get_ident()) or 1
+    ann.stream_handler.addFilter(thread_filter)
+
+    @function_logger
+    async def fetch(site):
+        """Fetch the data of a site."""
+        await asyncio.sleep(0)
+        return f"data of {site}"
+
+    class Ingestor:
+        site = "Manawatu"
+
+        @ClassLogger  # type: ignore
+        async def ingest(self, data):
+            """Ingest some data."""
+            await asyncio.sleep(0)
+            return len(data)
+
+    assert inspect.iscoroutinefunction(fetch)
+
+    async def main():
+        with ann.context(site="Rangitikei"):
+            data = await fetch("Rangitikei")
+        return data, await Ingestor().ingest(data)
+
+    assert asyncio.run(main()) == ("data of Rangitikei", 18)
+    assert stream.getvalue().splitlines() == [
+        "fetch | data of Rangitikei | Rangitikei",
+        "ingest | 18 | Manawatu",
+    ]
+    # The records were not written on the thread of the event loop.
+    assert threading.get_ident() not in writers
+
+
+def test_generator_functions(tmp_path):
+    """Test the summary records of generator functions and methods."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.jsonl"
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_generator_functions",
+        file_format_str=(
+            "%(function_name)s %(ret_val)s %(item_count)s %(item_sample)s "
+            "%(exhausted)s %(duration_ns)s"
+        ),
+        stream_format_str="%(function_name)s | %(item_count)s | %(item_sample)s",
+        file_output="jsonl",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    @function_logger(sample_size=2)
+    def read_chunks(n):
+        """Read n chunks."""
+        for i in range(n):
+            sent = yield f"chunk {i}"
+            if sent:
+                yield sent
+        return "done"
+
+    class Reader:
+        @ClassLogger  # type: ignore
+        def rows(self, n):
+            """Read n rows."""
+            yield from range(n)
+
+    assert inspect.isgeneratorfunction(read_chunks)
+    chunks = read_chunks(5)
+    assert stream.getvalue() == ""
+    assert next(chunks) == "chunk 0"
+    assert chunks.send("extra") == "extra"
+    assert list(chunks) == ["chunk 1", "chunk 2", "chunk 3", "chunk 4"]
+
+    rows = Reader().rows(100)
+    assert next(rows) == 0
+    rows.close()
+
+    ann.flush()
+    assert stream.getvalue().splitlines() == [
+        "read_chunks | 6 | ['chunk 0'; 'extra']",
+        "rows | 1 | None",
+    ]
+    records = [json.loads(line) for line in logfile.read_text().splitlines()]
+    assert records[0]["ret_val"] == "done"
+    assert records[0]["item_sample"] == ["chunk 0", "extra"]
+    assert records[0]["exhausted"] is True
+    assert records[0]["duration_ns"] > 0
+    assert records[1]["exhausted"] is False
+
+
+def test_timing_fields():
+    """Test the duration_ns and cpu_ns fields."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_timing_fields",
+        stream_format_str="%(function_name)s",
+    )
+    # The clocks are only read if a formatter prints the fields.
+    assert ann.start_timer() is None
+
+    ann.set_stream_formatter("%(function_name)s %(duration_ns)s %(cpu_ns)s")
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    @function_logger
+    def wait(seconds):
+        """Wait without using the CPU."""
+        time.sleep(seconds)
+
+    class Worker:
+        @ClassLogger  # type: ignore
+        def work(self, n):
+            """Keep the CPU busy."""
+            return sum(i * i for i in range(n))
+
+    wait(0.02)
+    Worker().work(200000)
+
+    timings = {}
+    for line in stream.getvalue().splitlines():
+        name, duration_ns, cpu_ns = line.split()
+        timings[name] = int(duration_ns), int(cpu_ns)
+    assert timings["wait"][0] >= 20_000_000
+    assert timings["wait"][1] < timings["wait"][0] / 2
+    assert timings["work"][1] > 0
+
+
+def test_track_memory():
+    """Test the memory fields of functions and methods with track_memory."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_track_memory",
+        stream_format_str="%(function_name)s %(memory_peak)s %(memory_delta)s",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    @function_logger(track_memory=True)
+    def allocate(n, keep):
+        """Allocate n bytes, and maybe keep them."""
+        data = bytearray(n)
+        return data if keep else len(data)
+
+    class Site:
+        @ClassLogger(track_memory=True)  # type: ignore
+        def load(self, n):
+            """Load two blocks of n bytes, one after the other."""
+            allocate(n, keep=False)
+            return allocate(n, keep=True)
+
+    @function_logger
+    def untracked():
+        """Allocate nothing."""
+
+    kept = allocate(1_000_000, keep=True)
+    allocate(2_000_000, keep=False)
+    Site().load(3_000_000)
+    untracked()
+    assert not tracemalloc.is_tracing()
+
+    lines = [line.split() for line in stream.getvalue().splitlines()]
+    fields = [(name, int(peak), int(delta)) for name, peak, delta in lines[:5]]
+    assert [name for name, _, _ in fields] == [
+        "allocate",
+        "allocate",
+        "allocate",
+        "allocate",
+        "load",
+    ]
+    for (_, peak, delta), (size, keep) in zip(
+        fields[:4],
+        [(1_000_000, True), (2_000_000, False), (3_000_000, False), (3_000_000, True)],
+    ):
+        assert size <= peak < size * 1.1
+        if keep:
+            assert size <= delta < size * 1.1
+        else:
+            assert delta < size / 10
+    # The peak of the inner calls counts towards the method.
+    assert 3_000_000 <= fields[4][1] < 3_300_000
+    assert lines[5] == ["untracked", "None", "None"]
+    del kept
+
+    with pytest.raises(ValueError, match="track_memory"):
+        function_logger(track_memory=True)(lambda: (yield))
+
+
+def test_instance_plan():
+    """Test that the custom fields of methods follow formatter changes."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_instance_plan",
+        stream_format_str="%(function_name)s %(site)s",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    class Gauge:
+        site = "Manawatu"
+        unit = "m"
+
+        @ClassLogger  # type: ignore
+        def read(self, site=None, *, unit=None):
+            """Read the gauge."""
+            return 1.5
+
+    gauge = Gauge()
+    gauge.read()
+    gauge.read("Rangitikei")
+    gauge.read(site="Whanganui")
+    assert stream.getvalue().splitlines() == [
+        "read Manawatu",
+        "read Rangitikei",
+        "read Whanganui",
+    ]
+    plan = get_function_metadata(Gauge.__dict__["read"].func).instance_plan
+    assert plan.fields is ann.instance_fields
+
+    # A new formatter recompiles the plan for its fields.
+    ann.set_stream_formatter("%(function_name)s %(site)s %(unit)s")
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+    gauge.read(unit="cm")
+    gauge.read()
+    assert stream.getvalue().splitlines() == [
+        "read Manawatu cm",
+        "read Manawatu m",
+    ]
+    new_plan = get_function_metadata(Gauge.__dict__["read"].func).instance_plan
+    assert new_plan is not plan
+
+
+def test_attribute_schema():
+    """Test that formatter changes don't duplicate the record fields."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_attribute_schema",
+        stream_format_str="%(levelname)s %(function_name)s %(site)s",
+    )
+    for _ in range(5):
+        ann.set_stream_formatter("%(levelname)s %(function_name)s %(site)s")
+    assert ann.all_attributes.count("site") == 1
+    assert ann.all_attributes.count("function_name") == 1
+    assert ann.all_attributes is ann.logger.extra_attributes
+    # Attributes of every record don't get a default that would hide them.
+    assert "levelname" in ann.all_attributes
+    assert "levelname" not in ann.logger.field_defaults
+    assert ann.logger.field_defaults["site"] is None
+
+    record = ann.logger.makeRecord(
+        "auditor", logging.INFO, "", 0, "msg", (), None, extra={"site": "Manawatu"}
+    )
+    assert record.levelname == "INFO"
+    assert record.site == "Manawatu"
+    assert record.ret_val is None
+    with pytest.raises(KeyError, match="levelname"):
+        ann.logger.makeRecord(
+            "auditor", logging.INFO, "", 0, "msg", (), None, extra={"levelname": "x"}
+        )
+
+
+def test_reserved_keyword_arguments():
+    """Test arguments named like the parameters of log_call."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_reserved_keyword_arguments",
+        stream_format_str="%(function_name)s %(ret_val)s",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    class Gauge:
+        @ClassLogger  # type: ignore
+        def set_level(self, level):
+            """Set the water level."""
+            self.level = level
+            return level
+
+    @function_logger
+    def send(message, func=None):
+        """Send a message."""
+        return message
+
+    Gauge().set_level(level=3.2)
+    send(message="hi", func="now")
+    assert stream.getvalue().splitlines() == [
+        "set_level 3.2",
+        "send hi",
+    ]
+
+
+def test_bounded_method_message():
+    """Test that the arguments in a method's message are truncated."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_bounded_method_message",
+        stream_format_str="%(message)s",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    class Gauge:
+        @ClassLogger  # type: ignore
+        def load(self, readings, unit="m"):
+            """Load readings."""
+            return len(readings)
+
+    Gauge().load(list(range(100_000)), unit="m")
+    message = stream.getvalue()
+    # The commas are cleaned like those of any other message.
+    assert message.startswith(
+        "METHOD test_bounded_method_message.<locals>.Gauge.load called with "
+        "args ([0; 1; 2;"
+    )
+    assert message.endswith(
+        "98; 99; ...];) and kwargs {'unit': 'm'}. It is on an instance of Gauge; "
+        "and returns the value 100000.\n"
+    )
+
+
+def test_set_file_output(tmp_path):
+    """Test switching the output format of the log file."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.log"
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_set_file_output",
+        file_format_str="%(function_name)s | %(ret_val)s",
+    )
+    return_greeting("Speve")
+
+    ann.set_file_formatter("%(function_name)s %(ret_val)s", file_output="jsonl")
+    return_greeting("Craig")
+    ann.flush()
+
+    lines = logfile.read_text(encoding="utf-8").splitlines()
+    assert lines[0] == "return_greeting | Hi Speve"
+    assert json.loads(lines[1]) == {
+        "function_name": "return_greeting",
+        "ret_val": "Hi Craig",
+    }
+
+    with pytest.raises(ValueError, match="Unknown file output"):
+        ann.set_file_formatter("%(message)s", file_output="xml")
+
+
+def test_async_raw_values(tmp_path):
+    """Test that async JSON Lines records keep the values at call time."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.jsonl"
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_async_raw_values",
+        file_format_str="%(params)s %(ret_val)s",
+        file_output="jsonl",
+        async_logging=True,
+    )
+
+    @function_logger
+    def collect(readings):
+        """Return the readings collected so far."""
+        return readings
+
+    readings = [1.5]
+    # The listener can't write the record before the values are changed.
+    ann.file_handler.acquire()
+    try:
+        collect(readings)
+        readings.append(2.5)
+    finally:
+        ann.file_handler.release()
+    ann.shutdown()
+
+    with open(logfile, encoding="utf-8") as f:
+        record = json.loads(f.readline())
+    assert record["params"]["readings"]["value"] == [1.5]
+    assert record["ret_val"] == [1.5]
+
+
+def test_track_memory_threads():
+    """Test tracking the memory of calls that overlap in several threads."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_track_memory_threads",
+        stream_format_str="%(ret_val)s %(memory_peak)s",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    sizes = [1_000_000, 2_000_000, 3_000_000, 4_000_000]
+    started = threading.Event()
+    barrier = threading.Barrier(len(sizes))
+    done = [threading.Event() for _ in sizes]
+    tracing = []
+
+    @function_logger(track_memory=True)
+    def allocate(i):
+        """Allocate a block while the other threads hold theirs."""
+        data = bytearray(sizes[i])
+        started.set()
+        barrier.wait()
+        # The calls end one after the other, the first one first.
+        if i:
+            done[i - 1].wait()
+        tracing.append(tracemalloc.is_tracing())
+        return len(data)
+
+    def run(i):
+        allocate(i)
+        done[i].set()
+
+    # The first thread starts tracing, and is the first to end its call.
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(sizes))]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Tracing only stops once the last call has ended.
+    assert tracing == [True] * len(sizes)
+    assert not tracemalloc.is_tracing()
+    lines = [line.split() for line in stream.getvalue().splitlines()]
+    assert [int(size) for size, _ in lines] == sizes
+    for size, peak in lines:
+        assert int(peak) >= int(size)
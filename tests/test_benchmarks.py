@@ -0,0 +1,374 @@
+"""Benchmarks for the overhead that `annalist` adds to audited calls."""
+
+import inspect
+import io
+import logging
+import time
+import timeit
+import tracemalloc
+
+import pytest
+
+from annalist import summaries
+from annalist.annalist import Annalist, BindPlan
+from annalist.decorators import ClassLogger, function_logger
+from annalist.handlers import BufferedFileHandler
+from annalist.sampling import EveryN
+from annalist.serializer import BoundedSerializer
+
+pytestmark = pytest.mark.slow
+
+
+def _legacy_params(signature, args, kwargs):
+    """Build the params field the way log_call did before bind plans."""
+    params = {}
+    all_args = list(args) + list(kwargs.values())
+    for i, ((name, param), arg) in enumerate(
+        zip(signature.parameters.items(), all_args)
+    ):
+        if param.default == inspect._empty:
+            default_val = None
+        else:
+            default_val = param.default
+
+        if param.annotation == inspect._empty:
+            annotation = None
+        else:
+            annotation = param.annotation
+
+        if i > len(args):
+            kind = "positional"
+        else:
+            kind = "keyword"
+        params[name] = {
+            "default": default_val,
+            "annotation": annotation,
+            "kind": kind,
+            "value": arg,
+        }
+    return params
+
+
+class _LegacyLogger(logging.Logger):
+    """An AnnalistLogger as it was before the attribute schema."""
+
+    def __init__(self, name, extra_attributes):
+        super().__init__(name)
+        self.extra_attributes = extra_attributes
+
+    def makeRecord(self, *args, **kwargs):  # type: ignore
+        rv = super().makeRecord(*args, **kwargs)
+        for attr in self.extra_attributes:
+            rv.__dict__[attr] = rv.__dict__.get(attr, None)
+        return rv
+
+
+def _peak_allocation(func, *args):
+    """Measure the peak memory allocated while running func once."""
+    func(*args)  # Warm up any lazily created caches.
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - before
+
+
+def test_bind_plan_allocations():
+    """The precompiled bind plan allocates less per call than zipping."""
+
+    def process(site, measurement, start, end, *, freq="15min", fill=None):
+        pass
+
+    signature = inspect.signature(process)
+    plan = BindPlan(signature)
+    args = ("Manawatu at Teachers College", "Flow", "2021-01-01", "2022-01-01")
+    kwargs = {"freq": "1h", "fill": 0}
+
+    legacy = _peak_allocation(_legacy_params, signature, args, kwargs)
+    compiled = _peak_allocation(plan.bind, args, kwargs)
+
+    print(f"\nparams binding peak allocation: {legacy}B -> {compiled}B")
+    assert compiled < legacy
+
+
+def test_bounded_serializer_speed():
+    """Bounded serialization of a large list is cheaper than str()."""
+    serializer = BoundedSerializer()
+    readings = [float(i) for i in range(1_000_000)]
+
+    start = time.perf_counter()
+    str(readings)
+    full = time.perf_counter() - start
+
+    start = time.perf_counter()
+    serializer.serialize(readings)
+    bounded = time.perf_counter() - start
+
+    print(f"\nserializing 1M floats: str {full:.4f}s -> bounded {bounded:.6f}s")
+    assert bounded < full
+
+
+def _per_call(func, number=100_000):
+    """Best time per call of func over a few repeats."""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def test_disabled_level_overhead():
+    """A call below the level filter costs about as much as an undecorated one."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_disabled_level_overhead",
+        stream_format_str="%(function_name)s | %(params)s | %(ret_val)s",
+        level_filter="WARNING",
+    )
+
+    def add(a, b):
+        return a + b
+
+    audited = function_logger(add)
+
+    plain = _per_call(lambda: add(1, 2))
+    decorated = _per_call(lambda: audited(1, 2))
+
+    print(
+        f"\ndisabled function_logger: {plain * 1e9:.0f}ns undecorated "
+        f"-> {decorated * 1e9:.0f}ns decorated"
+    )
+    assert decorated - plain < 2e-6
+
+
+def test_sampled_call_overhead():
+    """Sampling out most calls removes most of the logging cost."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_sampled_call_overhead",
+        stream_format_str="%(function_name)s | %(params)s | %(ret_val)s",
+    )
+    ann.stream_handler.setStream(io.StringIO())
+
+    @function_logger
+    def logged(a, b):
+        return a + b
+
+    @function_logger(sampling=EveryN(100))
+    def sampled(a, b):
+        return a + b
+
+    every_call = _per_call(lambda: logged(1, 2), number=10_000)
+    one_in_100 = _per_call(lambda: sampled(1, 2), number=10_000)
+
+    print(
+        f"\nsampling: {every_call * 1e9:.0f}ns logging every call "
+        f"-> {one_in_100 * 1e9:.0f}ns logging 1 in 100"
+    )
+    assert one_in_100 < every_call / 5
+
+
+def test_method_access_overhead():
+    """Accessing a ClassLogger method costs about as much as a bound method."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_method_access_overhead",
+        stream_format_str="%(function_name)s",
+    )
+
+    class Gauge:
+        def plain(self):
+            return 1.5
+
+        @ClassLogger  # type: ignore
+        def audited(self):
+            return 1.5
+
+    gauge = Gauge()
+    plain = _per_call(lambda: gauge.plain)
+    audited = _per_call(lambda: gauge.audited)
+
+    print(
+        f"\nmethod access: {plain * 1e9:.0f}ns plain "
+        f"-> {audited * 1e9:.0f}ns ClassLogger"
+    )
+    assert audited < plain * 5
+
+
+def test_record_schema_speed():
+    """Records are built with one merge of the deduplicated field defaults."""
+    ann = Annalist()
+    format_str = (
+        "%(asctime)s | %(levelname)s | %(function_name)s | %(site)s | %(ret_val)s"
+    )
+    ann.configure(
+        analyst_name="test_record_schema_speed",
+        file_format_str=format_str,
+        stream_format_str=format_str,
+    )
+    # A long session that changes the formatter now and then.
+    for _ in range(10):
+        ann.set_stream_formatter(format_str)
+    legacy_attributes = list(ann.all_attributes)
+    for _ in range(11):
+        legacy_attributes += ann.parse_formatter(format_str)
+    legacy = _LegacyLogger("legacy", legacy_attributes)
+    extra = {"function_name": "resample", "site": "Manawatu", "ret_val": "1.5"}
+
+    def make(logger):
+        return logger.makeRecord(
+            "auditor", logging.INFO, "", 0, "msg", (), None, extra=extra
+        )
+
+    before = _per_call(lambda: make(legacy), number=10_000)
+    after = _per_call(lambda: make(ann.logger), number=10_000)
+
+    def records(logger):
+        return [make(logger) for _ in range(1000)]
+
+    memory_before = _peak_allocation(records, legacy) / 1000
+    memory_after = _peak_allocation(records, ann.logger) / 1000
+
+    print(
+        f"\nmakeRecord: {len(legacy_attributes)} attributes {before * 1e9:.0f}ns "
+        f"{memory_before:.0f}B -> {len(ann.all_attributes)} attributes "
+        f"{after * 1e9:.0f}ns {memory_after:.0f}B per record"
+    )
+    # Memory is only reported: dicts of LogRecords share their keys while
+    # attributes are added in the same order, which depends on earlier tests.
+    assert after < before
+
+
+class _SlowStream(io.StringIO):
+    """A stream that takes a millisecond per write, like network storage."""
+
+    def write(self, s):
+        time.sleep(0.001)
+        return super().write(s)
+
+
+def test_async_logging_latency(tmp_path):
+    """Async mode takes slow writes off the calling thread."""
+    ann = Annalist()
+
+    def add(a, b):
+        return a + b
+
+    audited = function_logger(add)
+
+    latencies = {}
+    for async_logging in (False, True):
+        ann.configure(
+            logfile=tmp_path / "audit.log",
+            analyst_name="test_async_logging_latency",
+            file_format_str="%(function_name)s | %(params)s | %(ret_val)s",
+            stream_format_str="%(function_name)s",
+            async_logging=async_logging,
+        )
+        ann.file_handler.setStream(_SlowStream())
+        ann.stream_handler.setStream(io.StringIO())
+
+        start = time.perf_counter()
+        for i in range(50):
+            audited(i, 1)
+        latencies[async_logging] = (time.perf_counter() - start) / 50
+        ann.shutdown()
+
+    print(
+        f"\ncaller latency per call: sync {latencies[False] * 1e6:.0f}us "
+        f"-> async {latencies[True] * 1e6:.0f}us"
+    )
+    assert latencies[True] < latencies[False] / 5
+
+
+def test_buffered_file_throughput(tmp_path):
+    """Batching records into fewer writes speeds up file logging."""
+    record = logging.makeLogRecord({"msg": "return_greeting | Just saying hi."})
+    timings = {}
+    for name, handler in (
+        ("plain", logging.FileHandler(tmp_path / "plain.log")),
+        ("buffered", BufferedFileHandler(tmp_path / "buffered.log")),
+    ):
+        start = time.perf_counter()
+        for _ in range(20000):
+            handler.handle(record)
+        handler.close()
+        timings[name] = time.perf_counter() - start
+
+    print(
+        f"\n20k records to file: plain {timings['plain']:.3f}s "
+        f"-> buffered {timings['buffered']:.3f}s"
+    )
+    assert (tmp_path / "plain.log").read_text() == (
+        tmp_path / "buffered.log"
+    ).read_text()
+    assert timings["buffered"] < timings["plain"]
+
+
+def test_binary_file_size(tmp_path):
+    """The binary format with string interning cuts the size of the log."""
+    ann = Annalist()
+
+    def resample(site, freq="15min"):
+        """Resample the measurements of a site to a regular frequency."""
+        return len(site)
+
+    sizes = {}
+    for file_output in ("text", "binary"):
+        logfile = tmp_path / f"audit.{file_output}"
+        ann.configure(
+            logfile=logfile,
+            analyst_name="test_binary_file_size",
+            file_format_str=(
+                "%(asctime)s | %(levelname)s | %(name)s | %(message)s | "
+                "%(analyst_name)s | %(function_name)s | %(function_doc)s | "
+                "%(ret_annotation)s | %(params)s | %(ret_val)s | %(ret_val_type)s"
+            ),
+            stream_format_str="%(function_name)s",
+            file_output=file_output,
+        )
+        ann.stream_handler.setStream(io.StringIO())
+        audited = function_logger(resample)
+        for i in range(2000):
+            audited(f"Site {i % 20}", freq="1h")
+        ann.flush()
+        sizes[file_output] = logfile.stat().st_size
+
+    print(f"\n2000 records: text {sizes['text']}B -> binary {sizes['binary']}B")
+    assert sizes["binary"] < sizes["text"] / 2
+
+
+def test_frame_summary_speed():
+    """Summarizing a DataFrame is faster than its text, at any size."""
+    np = pytest.importorskip("numpy")
+    pd = pytest.importorskip("pandas")
+    rng = np.random.default_rng(42)
+    serializer = BoundedSerializer()
+    # The largest DataFrame that gets statistics, and a 10M row one.
+    for rows in (summaries.MAX_STATS_SIZE // 3, 10_000_000):
+        frame = pd.DataFrame(
+            {
+                "flow": rng.random(rows),
+                "stage": rng.random(rows),
+                "quality_code": rng.integers(0, 600, rows),
+            }
+        )
+        frame.loc[::1000, "flow"] = np.nan
+
+        start = time.perf_counter()
+        text = str(frame)
+        text_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        summary = serializer.serialize(frame)
+        summary_time = time.perf_counter() - start
+
+        print(
+            f"\n{rows} rows: str {text_time:.4f}s ({len(text)} chars), "
+            f"summary {summary_time:.4f}s"
+        )
+        assert summary_time < text_time
+    assert summary == (
+        "DataFrame(shape=(10000000, 3), columns={'flow': float64, "
+        "'stage': float64, 'quality_code': int64})"
+    )
@@ -0,0 +1,203 @@
+"""Tests for the content fingerprints."""
+
+import array
+import io
+import tracemalloc
+
+import pytest
+
+from annalist.annalist import Annalist
+from annalist.decorators import function_logger
+from annalist.fingerprint import Fingerprinter
+
+
+def test_python_values():
+    """Test that equal values, and only those, share a fingerprint."""
+    fingerprinter = Fingerprinter()
+    fingerprint = fingerprinter.fingerprint
+
+    assert fingerprint({"a": [1, 2.5], "b": {3, 4}}) == fingerprint(
+        {"b": {4, 3}, "a": [1, 2.5]}
+    )
+    assert len(fingerprint(None)) == 32
+    distinct = [
+        1,
+        1.0,
+        "1",
+        b"1",
+        True,
+        None,
+        [1],
+        (1,),
+        {1},
+        {1: None},
+        [1, 2],
+        [2, 1],
+        ["ab", "c"],
+        ["a", "bc"],
+    ]
+    assert len({fingerprint(value) for value in distinct}) == len(distinct)
+
+    # Containers beyond the limits are hashed by their length only.
+    fingerprinter = Fingerprinter(max_items=10)
+    assert fingerprinter.fingerprint(list(range(11))) == fingerprinter.fingerprint(
+        [0] * 11
+    )
+    assert fingerprinter.fingerprint(list(range(10))) != fingerprinter.fingerprint(
+        [0] * 10
+    )
+
+    # Custom hashers replace the default encoding.
+    class Reading:
+        def __init__(self, value):
+            self.value = value
+
+    fingerprinter.register(Reading, lambda r, hasher: hasher.update(b"%d" % r.value))
+    assert fingerprinter.fingerprint(Reading(1)) == fingerprinter.fingerprint(
+        Reading(1)
+    )
+    assert fingerprinter.fingerprint(Reading(1)) != fingerprinter.fingerprint(
+        Reading(2)
+    )
+
+
+def test_buffers_are_not_copied():
+    """Test that large buffers are hashed in place."""
+    data = bytearray(64 * 2**20)
+    fingerprinter = Fingerprinter()
+    tracemalloc.start()
+    try:
+        digest = fingerprinter.fingerprint(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 2**20
+
+    data[-1] = 1
+    assert fingerprinter.fingerprint(data) != digest
+    # The item format is part of the fingerprint.
+    assert fingerprinter.fingerprint(array.array("b", [0, 1])) != (
+        fingerprinter.fingerprint(bytes([0, 1]))
+    )
+
+
+def test_numpy_and_pandas():
+    """Test the fingerprints of arrays and DataFrames."""
+    np = pytest.importorskip("numpy")
+    pd = pytest.importorskip("pandas")
+    fingerprint = Fingerprinter().fingerprint
+
+    values = np.arange(12.0)
+    assert fingerprint(values) == fingerprint(np.arange(12.0))
+    assert fingerprint(values) != fingerprint(values.reshape(3, 4))
+    assert fingerprint(values) != fingerprint(values.astype("float32"))
+    # Strided arrays are hashed by their content.
+    assert fingerprint(values[::2]) == fingerprint(values[::2].copy())
+    # Object arrays are hashed element by element, not by their pointers.
+    objects = np.array([str(i) for i in range(2000)], dtype=object)
+    assert fingerprint(objects) == fingerprint(objects.copy())
+    changed = objects.copy()
+    changed[1000] = "changed"
+    assert fingerprint(objects) != fingerprint(changed)
+
+    frame = pd.DataFrame({"flow": [1.5, 2.0, np.nan], "site": ["a", "b", "c"]})
+    assert fingerprint(frame) == fingerprint(frame.copy())
+    changed = frame.copy()
+    changed.loc[2, "flow"] = 0.0
+    assert fingerprint(frame) != fingerprint(changed)
+    assert fingerprint(frame) != fingerprint(frame.rename(columns={"flow": "stage"}))
+    assert fingerprint(frame["flow"]) != fingerprint(frame["flow"].astype("float32"))
+
+
+def test_fingerprint_fields():
+    """Test the params_hash and ret_val_hash fields."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_fingerprint_fields",
+        stream_format_str="%(function_name)s %(params_hash)s %(ret_val_hash)s",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    @function_logger
+    def scale(values, factor=2):
+        """Scale the values."""
+        return [value * factor for value in values]
+
+    scale([1, 2, 3], 2)
+    scale(values=[1, 2, 3], factor=2)
+    scale([1, 2, 3], 3)
+
+    fingerprint = ann.fingerprinter.fingerprint
+    lines = [line.split() for line in stream.getvalue().splitlines()]
+    assert lines[0] == [
+        "scale",
+        fingerprint({"values": [1, 2, 3], "factor": 2}),
+        fingerprint([2, 4, 6]),
+    ]
+    assert lines[1] == lines[0]
+    assert lines[2][1:] != lines[0][1:]
+
+
+def test_pandas_scalars_and_arrays():
+    """Test the fingerprints of pandas values that aren't Series or frames."""
+    pd = pytest.importorskip("pandas")
+    fingerprint = Fingerprinter().fingerprint
+
+    values = [
+        pd.Timestamp("2024-01-01"),
+        pd.Timestamp("2024-01-02"),
+        pd.Timedelta(days=1),
+        pd.array([1, None, 3], dtype="Int64"),
+        pd.array([1, 2, 3], dtype="Int64"),
+        pd.Categorical(["a", "b", "a"]),
+        pd.Categorical(["a", "b", "b"]),
+        pd.Index([1, 2, 3]),
+        pd.RangeIndex(3),
+    ]
+    digests = [fingerprint(value) for value in values]
+    assert len(set(digests)) == len(values)
+    assert fingerprint(pd.Timestamp("2024-01-01")) == digests[0]
+    assert fingerprint(pd.array([1, None, 3], dtype="Int64")) == digests[3]
+    assert fingerprint(pd.Categorical(["a", "b", "a"])) == digests[5]
+    assert fingerprint({"when": pd.Timestamp("2024-01-01")}) == fingerprint(
+        {"when": pd.Timestamp("2024-01-01")}
+    )
+
+
+def test_unhashable_values_are_logged():
+    """Test values that export no buffer or that pandas can't hash."""
+    np = pytest.importorskip("numpy")
+    pd = pytest.importorskip("pandas")
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_unhashable_values_are_logged",
+        stream_format_str="%(function_name)s %(params_hash)s %(ret_val_hash)s",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    @function_logger
+    def dates():
+        """Return some dates."""
+        return np.array(["2020-01-01"], dtype="datetime64[ns]")
+
+    @function_logger
+    def nested(frame):
+        """Take a frame of lists."""
+        return frame["a"]
+
+    assert dates()[0] == np.datetime64("2020-01-01")
+    nested(pd.DataFrame({"a": [[1]]}))
+    assert len(stream.getvalue().splitlines()) == 2
+
+    fingerprint = ann.fingerprinter.fingerprint
+    values = np.array(["2020-01-01", "2020-01-02"], dtype="datetime64[ns]")
+    assert fingerprint(values) == fingerprint(values.copy())
+    assert fingerprint(values) != fingerprint(values.view("i8"))
+    assert fingerprint(values) != fingerprint(values.astype("datetime64[s]"))
+    assert fingerprint(values[:1]) != fingerprint(values[1:])
+    assert fingerprint(np.timedelta64(1, "D")) != fingerprint(np.timedelta64(2, "D"))
+    frame = pd.DataFrame({"a": [[1], {"b": 2}]})
+    assert fingerprint(frame) == fingerprint(frame.copy())
+    assert fingerprint(frame["a"]) != fingerprint(pd.Series([[2], {"b": 2}]))
@@ -0,0 +1,176 @@
+"""Tests for the indexed log reader."""
+
+import io
+import json
+
+from annalist import reader
+from annalist.annalist import Annalist
+from annalist.decorators import function_logger
+from annalist.reader import AuditLog
+
+
+def _write_records(path, records, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def _record(second, function, level="INFO"):
+    return {
+        "asctime": f"2024-03-01 12:00:{second:02d}",
+        "levelname": level,
+        "function_name": function,
+        "ret_val": second,
+    }
+
+
+def test_query(tmp_path):
+    """Test queries by function, level and time range."""
+    logfile = tmp_path / "audit.jsonl"
+    _write_records(
+        logfile,
+        [
+            _record(i, "resample" if i % 2 else "gauge", "DEBUG" if i % 3 else "INFO")
+            for i in range(30)
+        ],
+    )
+    log = AuditLog(logfile)
+
+    assert len(log) == 30
+    assert log.functions == ["gauge", "resample"]
+    resample = list(log.query(function="resample"))
+    assert [r["ret_val"] for r in resample] == list(range(1, 30, 2))
+    assert [r["ret_val"] for r in log.query(function="resample", level="INFO")] == [
+        3,
+        9,
+        15,
+        21,
+        27,
+    ]
+    in_range = log.query(
+        function="gauge", start="2024-03-01 12:00:10", end="2024-03-01 12:00:16"
+    )
+    assert [r["ret_val"] for r in in_range] == [10, 12, 14, 16]
+    assert list(log.query(function="missing")) == []
+    log.close()
+
+
+def test_incremental_index(tmp_path):
+    """Test that only records appended since the last build are indexed."""
+    logfile = tmp_path / "audit.jsonl"
+    _write_records(logfile, [_record(i, "gauge") for i in range(10)])
+    with AuditLog(logfile) as log:
+        assert len(log) == 10
+
+    index_file = tmp_path / "audit.jsonl.idx"
+    assert index_file.exists()
+
+    # Reopening an unchanged log reuses the index.
+    with AuditLog(logfile) as log:
+        assert log.refresh() == 0
+        assert len(log) == 10
+
+    # A partially written line is left for the next build.
+    _write_records(logfile, [_record(i, "resample") for i in range(10, 15)], "a")
+    with open(logfile, "a", encoding="utf-8") as f:
+        f.write('{"asctime": "2024-03-01 12:00:15", "levelname"')
+    with AuditLog(logfile) as log:
+        assert len(log) == 15
+        assert [r["ret_val"] for r in log.query(function="resample")] == [
+            10,
+            11,
+            12,
+            13,
+            14,
+        ]
+
+        with open(logfile, "a", encoding="utf-8") as f:
+            f.write(': "INFO", "function_name": "resample", "ret_val": 15}\n')
+        assert log.refresh() == 1
+        assert list(log.query(function="resample"))[-1]["ret_val"] == 15
+
+    # A rewritten log is indexed from scratch.
+    _write_records(logfile, [_record(i, "other") for i in range(3)])
+    with AuditLog(logfile) as log:
+        assert len(log) == 3
+        assert log.functions == ["other"]
+
+
+def test_index_chunks(tmp_path, monkeypatch):
+    """Test that updates of the index are appended to the sidecar."""
+    logfile = tmp_path / "audit.jsonl"
+    index_file = tmp_path / "audit.jsonl.idx"
+    _write_records(logfile, [_record(i, "gauge") for i in range(10)])
+    with AuditLog(logfile) as log:
+        for i in range(10, 13):
+            _write_records(logfile, [_record(i, "resample", "DEBUG")], "a")
+            assert log.refresh() == 1
+    # The header, the first build and one chunk per refresh.
+    assert len(index_file.read_text().splitlines()) == 5
+
+    with AuditLog(logfile) as log:
+        assert log.refresh() == 0
+        assert len(log) == 13
+        assert [r["ret_val"] for r in log.query(level="DEBUG")] == [10, 11, 12]
+
+    # The sidecar is compacted once it has too many chunks.
+    monkeypatch.setattr(reader, "MAX_INDEX_CHUNKS", 4)
+    with AuditLog(logfile) as log:
+        _write_records(logfile, [_record(13, "resample")], "a")
+        assert log.refresh() == 1
+    assert len(index_file.read_text().splitlines()) == 2
+
+    # A chunk that was cut short is indexed again.
+    index_file.write_text(index_file.read_text()[:-5])
+    with AuditLog(logfile) as log:
+        assert len(log) == 14
+        assert log.functions == ["gauge", "resample"]
+
+
+def test_unwritable_index(tmp_path):
+    """Test that the index is kept in memory if it can't be saved."""
+    logfile = tmp_path / "audit.jsonl"
+    _write_records(logfile, [_record(i, "gauge") for i in range(5)])
+    with AuditLog(logfile, index_path=tmp_path / "missing" / "audit.idx") as log:
+        assert len(log) == 5
+        _write_records(logfile, [_record(5, "resample")], "a")
+        assert [r["ret_val"] for r in log.query(function="resample")] == [5]
+    assert not (tmp_path / "missing").exists()
+
+
+def test_text_log(tmp_path):
+    """Test reading a text log written by Annalist."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.txt"
+    file_format_str = "%(asctime)s | %(levelname)s | %(function_name)s | %(ret_val)s"
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_text_log",
+        file_format_str=file_format_str,
+        stream_format_str="%(function_name)s",
+    )
+    ann.stream_handler.setStream(io.StringIO())
+
+    def resample(site, freq="15min"):
+        """Resample the measurements of a site."""
+        return f"{site} at {freq}"
+
+    def gauge(site):
+        """Read a gauge."""
+        return 1.5
+
+    audited_resample = function_logger(resample)
+    audited_gauge = function_logger(gauge)
+    for site in ("Manawatu", "Rangitikei", "Whanganui"):
+        audited_resample(site)
+        audited_gauge(site)
+    ann.flush()
+
+    with AuditLog(logfile, file_format_str=file_format_str) as log:
+        records = list(log.query(function="resample", level="INFO"))
+        assert [r["ret_val"] for r in records] == [
+            "Manawatu at 15min",
+            "Rangitikei at 15min",
+            "Whanganui at 15min",
+        ]
+        assert len(list(log.query(start=records[0]["asctime"]))) == 6
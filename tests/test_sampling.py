@@ -0,0 +1,222 @@
+"""Tests for the sampling policies."""
+
+import io
+import json
+import pickle
+import threading
+import time
+
+import pytest
+
+from annalist.annalist import Annalist
+from annalist.decorators import ClassLogger, function_logger
+from annalist.sampling import EveryN, Probability, SamplingPolicy, TokenBucket
+
+
+def test_every_n():
+    """Test that EveryN logs the first call and every n-th after it."""
+    policy = EveryN(3)
+    assert [policy.sample() for _ in range(7)] == [
+        1 / 3,
+        None,
+        None,
+        1 / 3,
+        None,
+        None,
+        1 / 3,
+    ]
+    with pytest.raises(ValueError, match="n must be at least 1"):
+        EveryN(0)
+
+
+def test_probability():
+    """Test that Probability logs about the expected fraction of calls."""
+    policy = Probability(0.25, seed=42)
+    rates = [policy.sample() for _ in range(4000)]
+    logged = [rate for rate in rates if rate is not None]
+    assert set(logged) == {0.25}
+    assert 800 < len(logged) < 1200
+
+    # Seeded policies make the same decisions.
+    policy = Probability(0.25, seed=42)
+    assert [policy.sample() for _ in range(4000)] == rates
+
+
+def test_token_bucket():
+    """Test that TokenBucket limits the rate and counts skipped calls."""
+    policy = TokenBucket(rate=100, burst=2)
+    rates = [policy.sample() for _ in range(5)]
+    assert rates[:2] == [1.0, 1.0]
+    assert rates[2:] == [None, None, None]
+
+    time.sleep(0.02)
+    # The record stands for itself and the three skipped calls.
+    assert policy.sample() == 0.25
+
+    # Copies start with a full bucket of their own.
+    clone = policy.clone()
+    assert clone.sample() == 1.0
+
+
+def test_policies_are_thread_safe():
+    """Test that concurrent calls don't lose updates of a policy."""
+    with pytest.raises(TypeError, match="abstract"):
+        SamplingPolicy()  # type: ignore
+
+    policy = EveryN(10)
+    logged = []
+
+    def call():
+        for _ in range(10_000):
+            if policy.sample() is not None:
+                logged.append(1)
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(logged) == 8_000
+
+    # Copies and pickles, e.g. for pool workers, get a lock of their own.
+    pickled = pickle.loads(pickle.dumps(policy))  # noqa: S301
+    for copied in (policy.clone(), pickled):
+        assert copied._lock is not policy._lock
+        assert copied.sample() == 0.1
+
+
+def test_sampled_logging():
+    """Test per-decorator and global sampling of logged calls."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_sampled_logging",
+        stream_format_str="%(function_name)s %(sample_rate)s",
+        sampling=EveryN(2),
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    @function_logger(sampling=EveryN(5))
+    def hot_helper(x):
+        """Called a lot."""
+        return x
+
+    @function_logger
+    def globally_sampled(x):
+        """Called a lot too."""
+        return x
+
+    @function_logger
+    def also_globally_sampled(x):
+        """Sampled separately."""
+        return x
+
+    class Gauge:
+        @ClassLogger(sampling=EveryN(10))  # type: ignore
+        def read(self):
+            """Read the gauge."""
+            return 1.5
+
+    gauge = Gauge()
+    for i in range(20):
+        assert hot_helper(i) == i
+        globally_sampled(i)
+        gauge.read()
+    also_globally_sampled(0)
+
+    counts = {}
+    for line in stream.getvalue().splitlines():
+        name, sample_rate = line.split()
+        counts.setdefault(name, []).append(float(sample_rate))
+    assert counts["hot_helper"] == [0.2] * 4
+    assert counts["globally_sampled"] == [0.5] * 10
+    assert counts["also_globally_sampled"] == [0.5]
+    assert counts["read"] == [0.1] * 2
+    # The sample rates reconstruct the number of calls.
+    assert sum(1 / rate for rate in counts["hot_helper"]) == 20
+
+    # Without a policy, every call is logged with a sample rate of 1.
+    ann.sampling = None
+    stream.truncate(0)
+    stream.seek(0)
+    globally_sampled(1)
+    assert stream.getvalue() == "globally_sampled 1.0\n"
+
+
+def test_sampled_jsonl_output(tmp_path):
+    """Test that JSON lines files include the sample rate by default."""
+    ann = Annalist()
+    logfile = tmp_path / "audit.jsonl"
+    ann.configure(
+        logfile=logfile,
+        analyst_name="test_sampled_jsonl_output",
+        stream_format_str="%(function_name)s",
+        file_output="jsonl",
+        sampling=EveryN(4),
+    )
+    ann.stream_handler.setStream(io.StringIO())
+
+    @function_logger
+    def level(x):
+        """Measure the level."""
+        return x
+
+    for i in range(8):
+        level(i)
+    ann.flush()
+
+    records = [json.loads(line) for line in logfile.read_text().splitlines()]
+    assert [record["sample_rate"] for record in records] == [0.25, 0.25]
+    assert [record["ret_val"] for record in records] == [0, 4]
+
+
+def test_sampling_survives_redecoration():
+    """Test that every decorator keeps its own sampling policy."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_sampling_survives_redecoration",
+        stream_format_str="%(function_name)s %(sample_rate)s",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    def level(x):
+        """Measure the level."""
+        return x
+
+    sampled = function_logger(level, sampling=EveryN(10))
+    # Redecorating the function replaces its cached metadata.
+    function_logger(level)
+    for i in range(20):
+        sampled(i)
+    assert stream.getvalue().splitlines() == ["level 0.1"] * 2
+
+
+def test_sampled_out_methods_build_nothing():
+    """Test that methods are sampled before their fields are collected."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_sampled_out_methods_build_nothing",
+        stream_format_str="%(function_name)s %(site)s",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    class Gauge:
+        lookups = 0
+
+        @property
+        def site(self):
+            Gauge.lookups += 1
+            return "Ngaruroro"
+
+        @ClassLogger(sampling=EveryN(10))  # type: ignore
+        def read(self):
+            """Read the gauge."""
+            return 1.5
+
+    gauge = Gauge()
+    for _ in range(20):
+        gauge.read()
+    assert stream.getvalue().splitlines() == ["read Ngaruroro"] * 2
+    assert Gauge.lookups == 2
@@ -0,0 +1,74 @@
+"""Tests for the bounded serializer."""
+
+from annalist.serializer import BoundedSerializer
+
+
+def test_matches_str_within_limits():
+    """Test that small values serialize exactly like str()."""
+    serializer = BoundedSerializer()
+    values = [
+        "Manawatu",
+        42,
+        3.5,
+        None,
+        b"bytes",
+        [1, "two", 3.0],
+        (1,),
+        ("a", "b"),
+        {"site": "Rangitikei", "flows": [1.2, 3.4]},
+        set(),
+        {7},
+        frozenset(),
+        frozenset({7}),
+        [[["deep"]]],
+    ]
+    for value in values:
+        assert serializer.serialize(value) == str(value)
+
+
+def test_character_budget():
+    """Test that output stops once the character budget is used up."""
+    serializer = BoundedSerializer(max_chars=10)
+
+    assert serializer.serialize_bounded("x" * 10) == ("x" * 10, False)
+    assert serializer.serialize_bounded("x" * 11) == ("x" * 10, True)
+    assert serializer.serialize(list(range(100))) == "[0, 1, 2, ..."
+    assert serializer.serialize("abc", max_chars=2) == "ab..."
+
+
+def test_depth_and_element_limits():
+    """Test the nesting depth and element count limits."""
+    serializer = BoundedSerializer(max_depth=2, max_elements=3)
+
+    assert serializer.serialize(list(range(10))) == "[0, 1, 2, ...]"
+    assert serializer.serialize({i: i for i in range(4)}) == ("{0: 0, 1: 1, 2: 2, ...}")
+    assert serializer.serialize([[[[1]]]]) == "[[[...]]]"
+
+
+def test_stops_rendering_early():
+    """Test that elements beyond the budget are never rendered."""
+    rendered = []
+
+    class Reading:
+        def __repr__(self):
+            rendered.append(self)
+            return "Reading()"
+
+    serializer = BoundedSerializer(max_chars=50)
+    serializer.serialize([Reading() for _ in range(10000)])
+
+    assert len(rendered) < 10
+
+
+def test_custom_serializer():
+    """Test registering a serializer for an expensive type."""
+
+    class Frame:
+        def __str__(self):
+            raise AssertionError("Should not be rendered in full.")
+
+    serializer = BoundedSerializer()
+    serializer.register(Frame, lambda frame: "<Frame>")
+
+    assert serializer.serialize(Frame()) == "<Frame>"
+    assert serializer.serialize([Frame()]) == "[<Frame>]"
@@ -0,0 +1,123 @@
+"""Tests for the summaries of NumPy arrays and pandas objects."""
+
+import io
+
+import pytest
+
+from annalist import summaries
+from annalist.annalist import Annalist
+from annalist.decorators import function_logger, trunc_value_string
+from annalist.serializer import BoundedSerializer
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+
+def test_array_summary():
+    """Test the statistics of numeric and other arrays."""
+    serializer = BoundedSerializer()
+    assert serializer.serialize(np.array([1.0, np.nan, 3.0])) == (
+        "ndarray(shape=(3,), dtype=float64, min=1, max=3, mean=2, nan_count=1, "
+        "null_fraction=0.333333)"
+    )
+    assert serializer.serialize(np.arange(6).reshape(2, 3)) == (
+        "ndarray(shape=(2, 3), dtype=int64, min=0, max=5, mean=2.5, nan_count=0, "
+        "null_fraction=0)"
+    )
+    assert serializer.serialize(np.full(2, np.nan)).endswith(
+        "min=nan, max=nan, mean=nan, nan_count=2, null_fraction=1)"
+    )
+    assert serializer.serialize(np.array(["a", "b"])) == (
+        "ndarray(shape=(2,), dtype=<U1)"
+    )
+    assert serializer.serialize(np.array([])) == "ndarray(shape=(0,), dtype=float64)"
+    # Nested arrays are summarized too.
+    assert serializer.serialize({"flow": np.ones(2)}) == (
+        "{'flow': ndarray(shape=(2,), dtype=float64, min=1, max=1, mean=1, "
+        "nan_count=0, null_fraction=0)}"
+    )
+
+    # Registered serializers take precedence.
+    serializer.register(np.ndarray, lambda values: f"array of {values.size}")
+    assert serializer.serialize(np.ones(3)) == "array of 3"
+
+
+def test_frame_summary(monkeypatch):
+    """Test the per-column statistics of DataFrames and Series."""
+    frame = pd.DataFrame(
+        {
+            "flow": [1.5, 2.5, np.nan, 4.0],
+            "site": ["a", None, "c", "d"],
+            "count": pd.array([1, None, 3, 4], dtype="Int64"),
+        }
+    )
+    serializer = BoundedSerializer()
+    assert serializer.serialize(frame) == (
+        "DataFrame(shape=(4, 3), columns={"
+        "'flow': float64(min=1.5, max=4, mean=2.66667, nan_count=1, "
+        "null_fraction=0.25), "
+        f"'site': {frame['site'].dtype}(null_count=1, null_fraction=0.25), "
+        "'count': Int64(min=1, max=4, mean=2.66667, nan_count=1, "
+        "null_fraction=0.25)})"
+    )
+    assert serializer.serialize(frame["flow"]) == (
+        "Series(name=flow, shape=(4,), dtype=float64, min=1.5, max=4, "
+        "mean=2.66667, nan_count=1, null_fraction=0.25)"
+    )
+
+    # Large values only get their shape and dtype.
+    monkeypatch.setattr(summaries, "MAX_STATS_SIZE", 4)
+    assert serializer.serialize(frame) == (
+        "DataFrame(shape=(4, 3), columns={'flow': float64, "
+        f"'site': {frame['site'].dtype}, 'count': Int64}})"
+    )
+    # A column of the same length still gets them.
+    assert serializer.serialize(frame["flow"]).endswith("null_fraction=0.25)")
+    assert serializer.serialize(np.arange(5.0)) == (
+        "ndarray(shape=(5,), dtype=float64)"
+    )
+
+
+def test_logged_summary():
+    """Test that log_call logs the summary of a returned DataFrame."""
+    ann = Annalist()
+    ann.configure(
+        analyst_name="test_logged_summary",
+        stream_format_str="%(function_name)s | %(ret_val)s",
+    )
+    stream = io.StringIO()
+    ann.stream_handler.setStream(stream)
+
+    @function_logger
+    def load(n):
+        """Load n readings."""
+        return pd.DataFrame({"stage": np.arange(n, dtype=float)})
+
+    load(1000)
+    # The commas of the summary are cleaned like those of any other value.
+    assert stream.getvalue() == (
+        "load | DataFrame(shape=(1000; 1); columns={'stage': float64(min=0; "
+        "max=999; mean=499.5; nan_count=0; null_fraction=0)})\n"
+    )
+
+
+def test_short_summaries(monkeypatch):
+    """Test that statistics are only computed if they fit in the budget."""
+    frame = pd.DataFrame({"flow": np.arange(1000.0), "stage": np.ones(1000)})
+    values = np.arange(1000.0)
+    serializer = BoundedSerializer()
+    full = [
+        serializer.serialize_bounded(value, max_chars=30)
+        for value in (frame, frame["flow"], values)
+    ]
+
+    def fail(values):
+        raise AssertionError("Statistics computed for a short summary")
+
+    monkeypatch.setattr(summaries, "_column_stats", fail)
+    monkeypatch.setattr(summaries, "_numeric_stats", fail)
+    for value, expected in zip((frame, frame["flow"], values), full, strict=True):
+        assert serializer.serialize_bounded(value, max_chars=30) == expected
+    assert trunc_value_string(frame) == (
+        "DataFrame(shape=(100 ... [<class 'pandas.DataFrame'> of len 1000]"
+    )